@@ -1,18 +1,41 @@
+from src import profiler
+# must wrap db_manager before the imports below copy its functions
+profiler.install()
+profiler.start_run()
+profiler.section("startup")
+
 from datetime import datetime, timedelta
 import re
 import streamlit as st
 import pandas as pd
 from src.db_manager import (
-    fetch_emails, get_email_by_id, update_email_ai_data,
-    get_all_emails_for_chat, mark_as_read  
+    get_email_by_id, update_email_ai_data, update_email_fields, init_db,
+    mark_as_read,
+    fetch_email_page, fetch_deadlines, fetch_untagged_emails,
+    search_emails, fetch_chat_rows
 )
 from src.prompt_manager import PromptManager
 from src.llm_engine import LLMEngine
+from src.retrieval import build_chat_context
+from src.dedupe import cluster_new_emails, report as dedupe_report
+from src.embeddings import index_new_emails, similar_emails
+from src.job_queue import enqueue_job, active_jobs_for_email, dead_jobs_for_email, latest_job
+from src.pipeline import AUTO_ANALYZE, enqueue_insights
+from src.preclassifier import shared_preclassifier
+from src.reprocess import REPROCESS_BUDGET, schedule_reprocessing, plan as stale_plan
+from src.prompt_registry import version_id
+from src.imap_sync import sync_account, ImapSyncError
+from src.llm_metrics import summarize, by_method, by_prompt_version, over_time, recent_failures
+from src.deadlines import DUE_FORMAT, format_due
+from worker import start_background_worker
 from setup_data import reset_and_seed_db
-from src.db_manager import schedule_with_shadow_summary
 import os
+import imaplib
 
 DB_FILE = "data/mock_inbox.db"
+PAGE_SIZE = 50
+# overdue tasks from this many past days stay on today's column
+OVERDUE_DAYS = 7
 
 # Check if DB exists. If not, run setup.
 if not os.path.exists(DB_FILE):
@@ -24,6 +47,17 @@ if not os.path.exists(DB_FILE):
     reset_and_seed_db()
     print(" Database initialized automatically on first run.")
 
+# Brings older databases up to the current schema and indexes,
+# and embeds and clusters any emails that arrived since the last run
+init_db()
+index_new_emails()
+cluster_new_emails()
+
+# LLM work is queued and run by worker threads; set EXTERNAL_WORKER=1 when
+# `python worker.py` runs separately
+if os.getenv("EXTERNAL_WORKER") != "1":
+    start_background_worker()
+
     
 # Page Config
 st.set_page_config(page_title="AI Email Agent", layout="wide")
@@ -46,6 +80,21 @@ st.markdown("""
 llm = LLMEngine()
 
 
+# Keeps the latest streaming timing (time to first token) for the sidebar
+def remember_stream_timing():
+    if llm.last_timing:
+        st.session_state.stream_timing = llm.last_timing
+
+
+# Scheduled tasks for the week (plus recent overdue and undated ones), shared
+# by the dashboard and the calendar: one indexed range query
+profiler.section("header")
+week_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+upcoming_tasks = fetch_deadlines(
+    (week_start - timedelta(days=OVERDUE_DAYS)).strftime(DUE_FORMAT),
+    (week_start + timedelta(days=7)).strftime(DUE_FORMAT)
+)
+
 # TOP DASHBOARD SECTION 
 col_header, col_dashboard = st.columns([2, 3])
 
@@ -54,20 +103,13 @@ with col_header:
     st.caption("By Aniruddha Dhawale")
 
 with col_dashboard:
-    df_all = fetch_emails()
-    if 'is_scheduled' not in df_all.columns: df_all['is_scheduled'] = 0
-    if 'calendar_summary' not in df_all.columns: df_all['calendar_summary'] = None
-        
-    df_actions = df_all[df_all['is_scheduled'] == 1].copy()
-
-    if not df_actions.empty:
-        df_actions['is_urgent'] = df_actions['category'].apply(lambda x: 1 if x == 'Urgent' else 0)
-        df_actions = df_actions.sort_values(by=['is_urgent', 'received_at'], ascending=[False, False])
+    top_actions = upcoming_tasks[:5]
 
+    if top_actions:
         with st.container(border=True):
             st.markdown("##### Approaching Deadlines")
 
-            for i, (index, row) in enumerate(df_actions.head(5).iterrows()):
+            for i, row in enumerate(top_actions):
                 raw_text = row['calendar_summary'] if row['calendar_summary'] else row['action_items']
                 
                 if raw_text:
@@ -75,7 +117,10 @@ with col_dashboard:
                 else:
                     snippet = "Processing..."
 
-                st.markdown(f"**{i+1}. {row['sender']}:** {snippet}...")
+                due = format_due(row['due_at'])
+                if row['due_at'] and row['due_at'] < datetime.now().strftime(DUE_FORMAT):
+                    due = f":red[overdue, {due}]"
+                st.markdown(f"**{i+1}. {row['sender']}:** {snippet}... ({due})")
     else:
 
         with st.container(border=True):
@@ -94,6 +139,7 @@ if 'selected_email_id' not in st.session_state:
 
 
 # SIDEBAR: DATA SOURCE
+profiler.section("sidebar")
 st.sidebar.header("Data Source")
 data_source = st.sidebar.selectbox(
     "Select Inbox Type",
@@ -102,10 +148,25 @@ data_source = st.sidebar.selectbox(
 
 if data_source == "Connect Real Email (IMAP)":
     st.sidebar.info("Enter credentials to sync.")
+    imap_host = st.sidebar.text_input("IMAP Server", value="imap.gmail.com")
     email_user = st.sidebar.text_input("Email Address")
     email_pass = st.sidebar.text_input("App Password", type="password")
     if st.sidebar.button("Sync Emails"):
-        st.sidebar.warning("Live connection disabled for this demo. Please use Mock Inbox.")
+        if not (imap_host and email_user and email_pass):
+            st.sidebar.warning("Server, address and app password are required.")
+        else:
+            # incremental: only mail newer than the last sync is downloaded
+            try:
+                with st.spinner("Syncing inbox..."):
+                    results = sync_account(imap_host, email_user, email_pass)
+                    new_ids = [email_id for r in results for email_id in r["new_ids"]]
+                    index_new_emails()
+                    cluster_new_emails()
+                    if AUTO_ANALYZE:
+                        enqueue_insights(new_ids)
+                st.sidebar.success(f"Synced {len(new_ids)} new emails.")
+            except (ImapSyncError, imaplib.IMAP4.error, OSError) as e:
+                st.sidebar.error(f"Sync failed: {e}")
        
 else:
     st.sidebar.caption("Using local simulation database.")
@@ -132,6 +193,8 @@ with st.sidebar.expander("Edit Prompts", expanded=False):
     new_cat_prompt = st.text_area("Categorization Rules", value=current_cat_prompt, height=100)
     new_act_prompt = st.text_area("Action Extraction Rules", value=current_act_prompt, height=100)
     new_rep_prompt = st.text_area("Reply Tone/Persona", value=current_rep_prompt, height=100)
+    versions = PromptManager.get_versions()
+    st.caption("Versions: " + ", ".join(f"{key} `{versions.get(key, '-')}`" for key in ("categorize", "extract", "reply")))
 
     if st.button("Save Prompts"):
         PromptManager.update_prompts(new_cat_prompt, new_act_prompt, new_rep_prompt)
@@ -143,34 +206,75 @@ with st.sidebar.expander("Edit Prompts", expanded=False):
 st.sidebar.markdown("---")
 st.sidebar.header("Inbox Tools")
 if st.sidebar.button("Auto-Tag New Emails"):
-    df_all = fetch_emails()
-    df_new = df_all[df_all['category'].isnull() | (df_all['category'] == "")]
-
-    if df_new.empty:
+    if not fetch_untagged_emails():
         st.sidebar.success("All emails are already tagged!")
-
     else:
-        progress_bar = st.sidebar.progress(0)
-        total = len(df_new)
-
-        for i, (index, row) in enumerate(df_new.iterrows()):
-            cat = llm.categorize_only(
-                row['body'],
-                row['sender'],
-                row['subject'],
-                new_cat_prompt
-            )
-            update_email_ai_data(row['id'], cat, row['action_items'], row['draft_reply'])
-            progress_bar.progress((i + 1) / total)
+        enqueue_job("autotag", payload={"prompt": new_cat_prompt})
+        st.rerun()
 
-        st.sidebar.success(f"Tagged {total} emails!")
+if st.sidebar.button("Analyze New Emails"):
+    untagged = fetch_untagged_emails()
+    enqueue_insights([e['id'] for e in untagged], {
+        'categorize': new_cat_prompt, 'extract': new_act_prompt, 'reply': new_rep_prompt
+    })
+    st.sidebar.success(f"Queued {len(untagged)} emails for category, actions and draft.")
+
+# Rows generated by an older prompt are re-run stage by stage, most
+# important first and paced (see src/reprocess.py)
+if st.sidebar.button("Reprocess After Prompt Changes"):
+    stale = stale_plan()
+    if not any(stale.values()):
+        st.sidebar.success("Everything is up to date with the current prompts.")
+    else:
+        queued = schedule_reprocessing()
+        st.sidebar.success(
+            f"Stale: {stale['category']} categories, {stale['action_items']} action items, "
+            f"{stale['draft_reply']} drafts. Queued {queued} emails (up to {REPROCESS_BUDGET} per run)."
+        )
+
+# Shows the background auto-tag run and refreshes the app when it ends
+@st.fragment(run_every=2)
+def autotag_status():
+    job = latest_job("autotag")
+    if not job:
+        return
+    if job['status'] in ("queued", "running"):
+        st.sidebar.info(f"Auto-tagging in background... {job['result'] or ''}")
+        st.session_state.autotag_running = True
+    elif st.session_state.pop("autotag_running", False):
+        if job['status'] == "dead":
+            st.sidebar.warning(f"Auto-tag failed: {(job['error'] or '')[:200]}")
         st.rerun()
 
+autotag_status()
+
+cache_stats = llm.cache.stats()
+st.sidebar.caption(
+    f"LLM cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+    f"({cache_stats['entries']} stored)"
+)
+api_stats = llm.metrics()
+st.sidebar.caption(
+    f"LLM API: {api_stats['calls']} calls, {api_stats['queued']} queued, "
+    f"{api_stats['throttled']} throttled, {api_stats['failed']} failed "
+    f"(circuit {api_stats['circuit']})"
+)
+timing = st.session_state.get("stream_timing")
+if timing:
+    st.sidebar.caption(
+        f"Last streamed reply: first token {timing['ttft']:.2f}s, "
+        f"complete {timing['total']:.2f}s{' (cached)' if timing['cached'] else ''}"
+    )
+if st.sidebar.button("Clear LLM Cache"):
+    llm.cache.clear()
+    st.sidebar.success("LLM cache cleared")
+
 # Main Interface
 
-tab1, tab2, tab3 = st.tabs(["[Inbox]", "[Chat with Inbox]", "[Calendar]"])
+tab1, tab2, tab3, tab4 = st.tabs(["[Inbox]", "[Chat with Inbox]", "[Calendar]", "[Stats]"])
 
 # LIST VIEW 
+profiler.section("tab.inbox")
 with tab1:
     if st.session_state.page_view == 'list':
         col_filter, col_content = st.columns([1, 5])
@@ -193,15 +297,22 @@ with tab1:
                 if f"filter_{cat}" not in st.session_state:
                     st.session_state[f"filter_{cat}"] = False
 
+            # keyset cursors of the pages visited so far (None = newest page)
+            if "inbox_cursors" not in st.session_state:
+                st.session_state.inbox_cursors = [None]
+
             def on_cat_change():
                 st.session_state.filter_inbox = False
+                st.session_state.inbox_cursors = [None]
 
             def on_inbox_change():
+                st.session_state.inbox_cursors = [None]
                 if st.session_state.filter_inbox:
                     for c in categories:
                         st.session_state[f"filter_{c}"] = False
 
             show_all = st.checkbox("Inbox", key="filter_inbox", on_change=on_inbox_change)
+            unread_only = st.checkbox("Unread only", key="filter_unread", on_change=on_inbox_change)
 
             st.markdown("---")
             st.caption("Categories")
@@ -217,17 +328,25 @@ with tab1:
         with col_content:
             st.subheader("Inbox")
 
-            df_emails = fetch_emails()
-
-            if not show_all:
-                if selected_filters:
-                    df_emails = df_emails[df_emails['category'].isin(selected_filters)]
+            search_query = st.text_input(
+                "Search",
+                placeholder="Search sender, subject, body or action items...",
+                label_visibility="collapsed",
+                key="inbox_search"
+            ).strip()
 
-                else:
-                    df_emails = df_emails.iloc[0:0]
+            if search_query:
+                page_emails, next_cursor = search_emails(search_query, limit=PAGE_SIZE), None
+            else:
+                page_emails, next_cursor = fetch_email_page(
+                    limit=PAGE_SIZE,
+                    after=st.session_state.inbox_cursors[-1],
+                    categories=None if show_all else selected_filters,
+                    unread_only=unread_only
+                )
 
-            if not df_emails.empty:
-                for index, row in df_emails.iterrows():
+            if page_emails:
+                for row in page_emails:
 
                     # READ/UNREAD LOGIC 
                     is_unread = (row['is_read'] == 0)
@@ -256,8 +375,28 @@ with tab1:
                         st.session_state.page_view = 'detail'
                         st.rerun()
 
+                    if row.get('snippet'):
+                        st.caption(row['snippet'])
+
+                if search_query:
+                    st.caption(f"{len(page_emails)} best matches for '{search_query}'")
+                else:
+                    col_newer, col_page, col_older = st.columns([1, 4, 1])
+                    with col_newer:
+                        if len(st.session_state.inbox_cursors) > 1 and st.button("<- Newer", use_container_width=True):
+                            st.session_state.inbox_cursors.pop()
+                            st.rerun()
+                    with col_page:
+                        st.caption(f"Page {len(st.session_state.inbox_cursors)}")
+                    with col_older:
+                        if next_cursor and st.button("Older ->", use_container_width=True):
+                            st.session_state.inbox_cursors.append(next_cursor)
+                            st.rerun()
+
             else:
-                if not show_all and not selected_filters:
+                if search_query:
+                    st.write("No emails match your search.")
+                elif not show_all and not selected_filters:
                     st.info("Select 'Inbox' or a Category to view emails.")
                 else:
                     st.write("No emails found.")
@@ -283,21 +422,17 @@ with tab1:
                     else:
                         st.subheader(subject_text)
 
-                is_scheduled = email_data.get('is_scheduled', 0)             
+                is_scheduled = email_data.get('is_scheduled', 0)
+                pending_jobs = active_jobs_for_email(e_id)
+                failed_jobs = dead_jobs_for_email(e_id)
                 with c_cal_btn:
                     if not is_scheduled:
-                        if st.button("Add to Calendar", use_container_width=True):
-                            with st.spinner("Analyzing & Scheduling"):
-                                hidden_actions = llm.extract_only(
-                                    email_data['body'], 
-                                    email_data['sender'], 
-                                    email_data['subject'], 
-                                    new_act_prompt
-                                )
-                                schedule_with_shadow_summary(e_id, hidden_actions)
-                                
-                                st.toast("Added to Calendar (Background Processed)")
-                                st.rerun()
+                        if "schedule" in pending_jobs:
+                            st.info("Scheduling...")
+                        elif st.button("Add to Calendar", use_container_width=True):
+                            enqueue_job("schedule", e_id, {"prompt": new_act_prompt})
+                            st.toast("Adding to Calendar (Background Processed)")
+                            st.rerun()
                     else:
                         st.success("Event is on Calendar")
 
@@ -307,6 +442,17 @@ with tab1:
 
                 with st.container(border=True, height=150):
                     st.markdown(email_data['body'])
+
+                similar = similar_emails(e_id, k=5)
+                if similar:
+                    with st.expander("Similar emails", expanded=False):
+                        scores = dict(similar)
+                        for row in fetch_chat_rows([email_id for email_id, _ in similar]):
+                            label = f"{row['sender']} - {row['subject']} ({scores[row['id']]:.0%} similar)"
+                            if st.button(label, key=f"similar_{row['id']}", use_container_width=True):
+                                mark_as_read(row['id'])
+                                st.session_state.selected_email_id = row['id']
+                                st.rerun()
                 
                 # action items and draft reply
                 has_category = email_data['category'] and email_data['category'].strip() != ""
@@ -316,21 +462,24 @@ with tab1:
                 col_tools, col_display = st.columns([1, 2])
                 
                 with col_tools:
+                    # ONE-CLICK ANALYSIS: whatever is missing, in one consolidated call
+                    if not (has_category and has_actions and has_draft):
+                        if "insights" in pending_jobs:
+                            st.info("Analyzing email...")
+                        elif st.button("Analyze & Draft", use_container_width=True, type="primary"):
+                            enqueue_insights([e_id], {
+                                'categorize': new_cat_prompt, 'extract': new_act_prompt, 'reply': new_rep_prompt
+                            })
+                            st.rerun()
+
                     st.caption("Actions")              
                     # EXTRACT ACTIONS
                     if not has_actions:
-                        if st.button("Extract Action Items", use_container_width=True):
-                            with st.spinner("Extracting tasks"):
-                                # Call the specific extract method
-                                actions = llm.extract_only(
-                                    email_data['body'], 
-                                    email_data['sender'], 
-                                    email_data['subject'], 
-                                    new_act_prompt
-                                )
-                                # Update DB
-                                update_email_ai_data(e_id, email_data['category'], actions, email_data['draft_reply'])
-                                st.rerun()
+                        if "extract" in pending_jobs:
+                            st.info("Extracting tasks...")
+                        elif st.button("Extract Action Items", use_container_width=True):
+                            enqueue_job("extract", e_id, {"prompt": new_act_prompt})
+                            st.rerun()
                     else:
                         st.success("Actions Extracted")
 
@@ -338,21 +487,29 @@ with tab1:
                     # DRAFT REPLY 
                     st.caption("Replies")
                     if not has_draft:
-                        if st.button("Draft Reply", use_container_width=True):
-                            with st.spinner("Drafting response"):
-                                # Call the specific draft method
-                                reply = llm.draft_only(
-                                    email_data['body'], 
-                                    email_data['sender'], 
-                                    email_data['subject'], 
-                                    new_rep_prompt
-                                )
-                                # Update DB 
-                                update_email_ai_data(e_id, email_data['category'], email_data['action_items'], reply)
+                        if "draft" in pending_jobs:
+                            st.info("Drafting response...")
+                        elif st.button("Draft Reply", use_container_width=True):
+                            # streamed in place; saved once the model finishes
+                            with col_display:
+                                st.write("### Draft Reply")
+                                st.write_stream(llm.draft_stream(
+                                    email_data['body'], email_data['sender'], email_data['subject'], new_rep_prompt,
+                                    on_complete=lambda text: update_email_fields(
+                                        e_id, {"draft_reply": text}, {"draft_reply": version_id(new_rep_prompt)}
+                                    )
+                                ))
+                            remember_stream_timing()
+                            if llm.last_error:
+                                st.error(f"Draft failed: {llm.last_error[:200]}")
+                            else:
                                 st.rerun()
                     else:
                         st.success("Reply Drafted")
 
+                    for kind, error in failed_jobs.items():
+                        st.error(f"{kind.title()} failed: {(error or '')[:200]}")
+
                     # Reset Button
                     if has_actions or has_draft:
                         st.markdown("---")
@@ -360,6 +517,15 @@ with tab1:
                              update_email_ai_data(e_id, email_data['category'], None, None)
                              st.rerun()
 
+                # Polls queued work for this email and refreshes when it lands
+                if pending_jobs:
+                    @st.fragment(run_every=2)
+                    def poll_email_jobs():
+                        if active_jobs_for_email(e_id) != pending_jobs:
+                            st.rerun()
+
+                    poll_email_jobs()
+
                 with col_display:
                     # Display Actions
                     if has_actions:
@@ -373,6 +539,7 @@ with tab1:
                         
                         st.write("Refinement")
                         c_ref_input, c_ref_btn = st.columns([3, 1])
+                        run_refine = False
                         
                         with c_ref_input:
                             refine_feedback = st.text_input(
@@ -382,12 +549,22 @@ with tab1:
                             )
                             
                         with c_ref_btn:
-                            if st.button("Refine", use_container_width=True):
-                                if refine_feedback:
-                                    with st.spinner("Rewriting..."):
-                                        new_draft = llm.refine_reply(email_data['draft_reply'], refine_feedback)
-                                        update_email_ai_data(e_id, email_data['category'], email_data['action_items'], new_draft)
-                                        st.rerun()
+                            if "refine" in pending_jobs:
+                                st.info("Rewriting...")
+                            else:
+                                run_refine = st.button("Refine", use_container_width=True) and refine_feedback
+
+                        if run_refine:
+                            st.write("Refined draft")
+                            st.write_stream(llm.refine_stream(
+                                email_data['draft_reply'], refine_feedback,
+                                on_complete=lambda text: update_email_fields(e_id, {"draft_reply": text})
+                            ))
+                            remember_stream_timing()
+                            if llm.last_error:
+                                st.error(f"Refine failed: {llm.last_error[:200]}")
+                            else:
+                                st.rerun()
 
                         st.markdown("---")
                         col_send, col_dummy = st.columns([1, 3])
@@ -397,6 +574,7 @@ with tab1:
 
 
 
+profiler.section("tab.chat")
 with tab2:
     st.subheader("Ask questions about your emails")
 
@@ -414,96 +592,155 @@ with tab2:
 
         with st.chat_message("assistant"):
             with st.spinner("Scanning inbox"):
-                inbox_context = get_all_emails_for_chat()
-                response = llm.chat_with_inbox(prompt, inbox_context)
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                inbox_context, retrieval_stats = build_chat_context(prompt)
+            response = st.write_stream(llm.chat_stream(prompt, inbox_context))
+            remember_stream_timing()
+            st.caption(
+                f"Used {retrieval_stats['emails_used']} relevant emails "
+                f"(~{retrieval_stats['tokens_used']} tokens, "
+                f"~{retrieval_stats['tokens_saved']} saved vs. full inbox)"
+            )
+            st.session_state.messages.append({"role": "assistant", "content": response})
 
 
 
 # CALENDAR TAB 
+profiler.section("tab.calendar")
 with tab3:
     st.subheader("Weekly Task Planner")
 
-    # find day of week from text
-    def get_target_date(text):
-        if not text: return None
-        text = text.lower()
-        today = datetime.now()
-        
-        days = {
-            'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 
-            'friday': 4, 'saturday': 5, 'sunday': 6
-        }
-        
-        found_day = None
-        for day, num in days.items():
-            if day in text:
-                found_day = num
-                break
-        
-        if found_day is not None:
-            current_weekday = today.weekday()
-            days_ahead = found_day - current_weekday
-            if days_ahead <= 0:
-                days_ahead += 7
-            if days_ahead == 0 and "today" in text: 
-                days_ahead = 0
-            return today + timedelta(days=days_ahead)
-        
-        if "tomorrow" in text:
-            return today + timedelta(days=1)
-        if "today" in text:
-            return today
-            
-        return None
+    # due day -> tasks; undated and overdue tasks go on today
+    tasks_by_day = {}
+    for row in upcoming_tasks:
+        due_day = datetime.strptime(row['due_at'], DUE_FORMAT).date() if row['due_at'] else week_start.date()
+        tasks_by_day.setdefault(max(due_day, week_start.date()), []).append(row)
 
-    df_all = fetch_emails()
-    if 'is_scheduled' not in df_all.columns: df_all['is_scheduled'] = 0
-    if 'calendar_summary' not in df_all.columns: df_all['calendar_summary'] = None
-        
-    df_tasks = df_all[df_all['is_scheduled'] == 1].copy()
-    
     cols = st.columns(7)
-    today = datetime.now()
     
     for i in range(7):
-        current_date = today + timedelta(days=i)
+        current_date = week_start + timedelta(days=i)
         date_str = current_date.strftime("%a %d") 
         
         with cols[i]:
             st.markdown(f"##### {date_str}")
             st.markdown("---")
             
-            has_tasks = False
-            
-            if not df_tasks.empty:
-                for index, row in df_tasks.iterrows():
-                    # if action item text matches this day
-                    text_source = row['calendar_summary'] if row['calendar_summary'] else row['action_items']
-                    target = get_target_date(text_source)
+            day_tasks = tasks_by_day.get(current_date.date(), [])
+            for row in day_tasks:
+                priority_color = "red" if row['category'] == "Urgent" else "gray"
+                
+                with st.container(border=True):
+                    st.markdown(f"**:{priority_color}[{row['sender']}]**")
+                    st.caption(f"{row['subject'][:20]}...")
+                    raw_text = row['calendar_summary'] if row.get('calendar_summary') else row['action_items']
                     
-                    is_match = False
-                    if target:
-                        if target.date() == current_date.date():
-                            is_match = True
-                    elif i == 0: 
-                        is_match = True
-                        
-                    if is_match:
-                        has_tasks = True
-                        priority_color = "red" if row['category'] == "Urgent" else "gray"
-                        
-                        with st.container(border=True):
-                            st.markdown(f"**:{priority_color}[{row['sender']}]**")
-                            st.caption(f"{row['subject'][:20]}...")
-                            raw_text = row['calendar_summary'] if row.get('calendar_summary') else row['action_items']
-                            
-                            if raw_text:
-                                clean_task = raw_text.split('\n')[0].replace('* ', '').strip()
-                                st.write(f"{clean_task[:40]}...")
-                            else:
-                                st.caption("No details generated.")
+                    if raw_text:
+                        clean_task = raw_text.split('\n')[0].replace('* ', '').strip()
+                        st.write(f"{clean_task[:40]}...")
+                    else:
+                        st.caption("No details generated.")
+                    if row['due_at'] and row['due_at'][:10] != current_date.strftime("%Y-%m-%d"):
+                        st.caption(f":red[Overdue: {format_due(row['due_at'])}]")
+                    elif row['due_at']:
+                        st.caption(f"Due {format_due(row['due_at'])}")
             
-            if not has_tasks:
-                st.caption("No tasks")
\ No newline at end of file
+            if not day_tasks:
+                st.caption("No tasks")
+
+
+# STATS TAB
+# window label -> (seconds, chart bucket)
+STATS_WINDOWS = {
+    "Last hour": (3600, "1min"),
+    "Last 24 hours": (86400, "15min"),
+    "Last 7 days": (7 * 86400, "2h"),
+    "All time": (None, "1D"),
+}
+
+profiler.section("tab.stats")
+with tab4:
+    st.subheader("LLM Calls")
+    window = st.selectbox("Window", list(STATS_WINDOWS), index=1)
+    seconds, bucket = STATS_WINDOWS[window]
+    summary = summarize(seconds)
+
+    if not summary['calls']:
+        st.caption("No LLM calls recorded in this window.")
+    else:
+        c1, c2, c3, c4, c5, c6 = st.columns(6)
+        c1.metric("Calls", summary['calls'], f"{summary['cache_hit_rate']:.0%} cached", delta_color="off")
+        c2.metric("p50 latency", f"{summary['p50_ms'] or 0:.0f} ms")
+        c3.metric("p95 latency", f"{summary['p95_ms'] or 0:.0f} ms")
+        c4.metric("Throughput", f"{summary['calls_per_min']:.1f}/min")
+        c5.metric("Error rate", f"{summary['error_rate']:.1%}", f"{summary['retries']} retries", delta_color="off")
+        c6.metric("Est. spend", f"${summary['cost_usd']:.4f}",
+                  f"{summary['prompt_tokens'] + summary['response_tokens']:,} tokens", delta_color="off")
+
+        series = over_time(seconds, bucket)
+        chart_latency, chart_volume = st.columns(2)
+        with chart_latency:
+            st.caption("Latency (ms)")
+            st.line_chart(series[["p50_ms", "p95_ms"]])
+        with chart_volume:
+            st.caption("Calls and errors")
+            st.bar_chart(series[["calls", "errors"]])
+        chart_tokens, chart_cost = st.columns(2)
+        with chart_tokens:
+            st.caption("Tokens")
+            st.area_chart(series[["tokens"]])
+        with chart_cost:
+            st.caption("Estimated spend (USD)")
+            st.line_chart(series[["cost_usd"]])
+
+        st.markdown("##### By method")
+        st.dataframe(by_method(seconds), hide_index=True, use_container_width=True)
+
+        st.markdown("##### By prompt version")
+        st.dataframe(by_prompt_version(seconds), hide_index=True, use_container_width=True)
+
+        failures = recent_failures(seconds)
+        if not failures.empty:
+            st.markdown("##### Recent failures")
+            st.dataframe(failures, hide_index=True, use_container_width=True)
+
+    # local tier in front of categorization (src/preclassifier.py)
+    st.subheader("Pre-classifier")
+    precls = shared_preclassifier.report()
+    if not precls["decisions"]:
+        st.caption("No emails categorized since the pre-classifier was added.")
+    else:
+        p1, p2, p3 = st.columns(3)
+        p1.metric("Decided locally", f"{precls['hit_rate']:.0%}", f"of {precls['decisions']} emails", delta_color="off")
+        p2.metric("LLM calls saved", precls['llm_calls_saved'])
+        p3.metric("Agreement with LLM", "-" if precls['agreement'] is None else f"{precls['agreement']:.0%}",
+                  "on audited local decisions", delta_color="off")
+        by_tier, by_band = st.columns(2)
+        with by_tier:
+            st.caption("By tier")
+            st.dataframe(pd.DataFrame(precls["by_tier"]), hide_index=True, use_container_width=True)
+        with by_band:
+            st.caption(f"Agreement by confidence (threshold {shared_preclassifier.min_confidence:.2f})")
+            st.dataframe(pd.DataFrame(shared_preclassifier.agreement_by_confidence()), hide_index=True,
+                         use_container_width=True)
+
+    st.subheader("Shared results")
+    clusters = dedupe_report()
+    d1, d2, d3 = st.columns(3)
+    d1.metric("Near duplicates", clusters["near_duplicates"], f"in {clusters['clusters']} clusters", delta_color="off")
+    d2.metric("Threads", clusters["threads"], "with 2+ emails", delta_color="off")
+    d3.metric("Results reused", sum(r["reused"] for r in clusters["reused"]))
+    if clusters["reused"]:
+        st.dataframe(pd.DataFrame(clusters["reused"]), hide_index=True, use_container_width=True)
+
+
+# PROFILER PANEL (EMAIL_AGENT_PROFILE=1, see src/profiler.py)
+profile_run = profiler.end_run()
+if profile_run:
+    with st.sidebar.expander("Profiler: this rerun", expanded=False):
+        st.caption(f"Rerun took {profile_run.total * 1000:.1f} ms")
+        st.dataframe(pd.DataFrame(profiler.report(profile_run)), hide_index=True)
+        if len(profiler.history) > 1:
+            st.caption("Recent reruns (ms)")
+            st.line_chart(list(profiler.history))
+        if st.button("Dump profile"):
+            st.success("Wrote " + ", ".join(profiler.dump(profile_run)))
@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from src import db_manager, embeddings
+from src.db_manager import (
+    init_db, ingest_emails, fetch_emails, fetch_email_page, fetch_untagged_emails, fetch_deadlines,
+    fetch_scheduled_emails, search_emails, get_email_by_id, get_all_emails_for_chat,
+    fetch_chat_rows, chat_context_size, update_email_ai_data, update_categories_bulk,
+    mark_as_read, save_prompt, get_prompt, schedule_with_shadow_summary, close_connections
+)
+from src.deadlines import DUE_FORMAT, due_at_for
+from src.dedupe import cluster_new_emails
+from src.embeddings import index_new_emails, similar_emails
+from src.job_queue import enqueue_job, claim_job, complete_job
+from src.llm_cache import ResponseCache
+from src.llm_backends import FakeBackend
+from src.llm_engine import LLMEngine
+from src.llm_metrics import summarize
+from src.pipeline import current_prompts, process_email_insights, categorize_emails
+from src.preclassifier import shared_preclassifier
+from src.rate_limiter import RateLimiter, CircuitBreaker
+from src.reprocess import plan as reprocess_plan, next_batch
+from src.retrieval import build_chat_context
+from src.synthetic import generate_emails
+
+# End-to-end benchmark on a synthetic mailbox. Every run works in a scratch
+# directory (its own database, vector index and LLM cache), and the LLM is a
+# FakeBackend with configurable latency and 429 rate, so results are
+# repeatable and free. Results are JSON so they can be stored and compared between commits:
+#
+#   python benchmark.py --rows 10000,100000 --output bench.json
+#   python benchmark.py --rows 10000 --baseline bench.json
+
+
+# Runs fn `repeat` times and summarises the wall time in milliseconds
+def timed(fn, repeat=5):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "n": repeat,
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "max_ms": round(max(samples), 3),
+    }, result
+
+
+# The inbox list loop from app.py without Streamlit: one page of rows
+# turned into button labels
+def render_inbox_page(limit=50):
+    rows, _ = fetch_email_page(limit=limit)
+    labels = []
+    today = datetime.now().date()
+    for row in rows:
+        category_label = row['category'] if row['category'] else "New"
+        try:
+            dt_obj = datetime.strptime(row['received_at'], "%Y-%m-%d %H:%M")
+            time_val = dt_obj.strftime("%H:%M") if dt_obj.date() == today else dt_obj.strftime("%b %d")
+        except (TypeError, ValueError):
+            time_val = row['received_at']
+        labels.append(f"[{time_val}] | {row['sender']} - {row['subject']} | [{category_label.upper()}] ")
+    return labels
+
+
+# Action item shapes the deadline parser sees
+DEADLINE_SAMPLES = [
+    "* Confirm availability for this Tuesday at 10 AM by EOD", "* Pay the invoice by the 25th",
+    "* Review the PR by tomorrow afternoon", "* Submit the report by 2025-12-01 14:30",
+    "* Reply to the client", "* Join the call on Nov 28 at 3pm", "* Renew the lease within 60 days",
+    "* Send the numbers next Friday", "* Book tickets for this weekend", "No action items",
+]
+
+
+# The calendar's window: the past week's overdue tasks through a week ahead
+def week_range():
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today - timedelta(days=7)).strftime(DUE_FORMAT), (today + timedelta(days=7)).strftime(DUE_FORMAT)
+
+
+# Walks `pages` pages of the listing with keyset cursors
+def walk_pages(pages=20, limit=50):
+    cursor = None
+    for _ in range(pages):
+        rows, cursor = fetch_email_page(limit=limit, after=cursor)
+        if cursor is None:
+            break
+
+
+# Builds the scratch inbox: ingest, embed, label most rows (the rest stay
+# untagged for the LLM stages) and schedule a few for the calendar
+def build_mailbox(rows, seed, labeled_share=0.8, scheduled_share=0.02):
+    results = {}
+    start = time.perf_counter()
+    kinds = {}
+
+    def remember_kinds(emails):
+        for i, email in enumerate(emails, start=1):
+            kinds[i] = email["kind"]
+            yield email
+
+    stats = ingest_emails(remember_kinds(generate_emails(rows, seed)))
+    results["setup.ingest"] = {
+        "n": 1, "rows": stats["inserted"], "seconds": round(stats["seconds"], 3),
+        "rows_per_second": round(stats["per_second"], 1),
+        "wall_seconds": round(time.perf_counter() - start, 3),
+    }
+
+    results["setup.index_new_emails"], added = timed(index_new_emails, repeat=1)
+    results["setup.index_new_emails"]["rows"] = added
+    results["setup.cluster_new_emails"], added = timed(cluster_new_emails, repeat=1)
+    results["setup.cluster_new_emails"]["rows"] = added
+
+    rng = random.Random(seed)
+    ids = stats["new_ids"]
+    labels = {email_id: kinds[n] for n, email_id in enumerate(ids, start=1) if rng.random() < labeled_share}
+    update_categories_bulk(labels)
+    for email_id in rng.sample(ids, max(1, int(len(ids) * scheduled_share))):
+        schedule_with_shadow_summary(email_id, f"* Follow up {rng.choice(['today', 'tomorrow', 'Friday'])}")
+    for key, value in current_prompts().items():
+        save_prompt(key, value)
+    return results, ids
+
+
+# SQL timings: the read cache is off so repeated reads really query
+def bench_db(ids, repeat):
+    db_manager.READ_CACHE_ENABLED = False
+    try:
+        return _bench_db(ids, repeat)
+    finally:
+        db_manager.READ_CACHE_ENABLED = True
+
+
+# What a Streamlit rerun reads: inbox page, deadlines, calendar, prompts
+def simulated_rerun():
+    render_inbox_page()
+    fetch_deadlines(*week_range())
+    return [get_prompt(key) for key in ("categorize", "extract", "reply")]
+
+
+# A rerun without writes against the warm read cache, and one right after a write
+def bench_rerun(ids, repeat):
+    rng = random.Random(3)
+    results = {}
+    db_manager.READ_CACHE_ENABLED = False
+    results["ui.rerun_uncached"], _ = timed(simulated_rerun, repeat * 4)
+    db_manager.READ_CACHE_ENABLED = True
+    simulated_rerun()
+    results["ui.rerun_cached"], _ = timed(simulated_rerun, repeat * 4)
+
+    def write_then_rerun():
+        mark_as_read(rng.choice(ids))
+        return simulated_rerun()
+    results["ui.rerun_after_write"], _ = timed(write_then_rerun, repeat * 4)
+    return results
+
+
+def _bench_db(ids, repeat):
+    rng = random.Random(1)
+    sample = lambda k: rng.sample(ids, min(k, len(ids)))
+    results = {}
+    plan = [
+        ("db.fetch_emails", fetch_emails, max(1, repeat // 5)),
+        ("db.fetch_email_page", lambda: fetch_email_page(limit=50), repeat * 4),
+        ("db.fetch_email_page_deep_20", walk_pages, repeat),
+        ("db.fetch_email_page_filtered", lambda: fetch_email_page(limit=50, categories=["Work", "Urgent"],
+                                                                  unread_only=True), repeat * 4),
+        ("db.fetch_untagged_emails", fetch_untagged_emails, repeat),
+        ("db.fetch_scheduled_emails", fetch_scheduled_emails, repeat),
+        ("db.fetch_deadlines_week", lambda: fetch_deadlines(*week_range()), repeat * 4),
+        ("deadlines.parse_x1000", lambda: [due_at_for(t) for t in DEADLINE_SAMPLES * 100], repeat),
+        ("db.search_emails_rare", lambda: search_emails("FIX-4242"), repeat * 4),
+        ("db.search_emails_common", lambda: search_emails("team numbers"), repeat),
+        ("db.get_email_by_id_x100", lambda: [get_email_by_id(i) for i in sample(100)], repeat),
+        ("db.get_all_emails_for_chat", get_all_emails_for_chat, max(1, repeat // 5)),
+        ("db.chat_context_size", chat_context_size, repeat),
+        ("db.fetch_chat_rows_30", lambda: fetch_chat_rows(sample(30)), repeat * 4),
+        ("db.update_email_ai_data_x100",
+         lambda: [update_email_ai_data(i, "Work", "* item", "draft") for i in sample(100)], repeat),
+        ("db.mark_as_read_x100", lambda: [mark_as_read(i) for i in sample(100)], repeat),
+        ("db.update_categories_bulk_1000", lambda: update_categories_bulk({i: "Work" for i in sample(1000)}),
+         repeat),
+        ("reprocess.plan", reprocess_plan, repeat),
+        ("reprocess.next_batch_200", lambda: next_batch(200), repeat),
+        ("ui.render_inbox_page", render_inbox_page, repeat * 4),
+    ]
+    for name, fn, n in plan:
+        results[name], _ = timed(fn, n)
+    return results
+
+
+def bench_prompts(llm, repeat):
+    prompts = current_prompts()
+    emails = [dict(r) for r in fetch_email_page(limit=50)[0]]
+    full = [get_email_by_id(e['id']) for e in emails]
+    one = full[0]
+    context, _ = build_chat_context("what is due this week?")
+    plan = [
+        ("prompt.categorize", lambda: llm._categorize_prompt(one['body'], one['sender'], one['subject'],
+                                                             prompts['categorize'])),
+        ("prompt.packed_10", lambda: llm._packed_prompt(full[:10], prompts['categorize'])),
+        ("prompt.make_packs_50", lambda: llm._make_packs(full, prompts['categorize'], 10, 6000)),
+        ("prompt.insights", lambda: llm._insights_prompt(one['body'], one['sender'], one['subject'], prompts)),
+        ("prompt.draft", lambda: llm._email_prompt(prompts['reply'], one['body'], one['sender'], one['subject'])),
+        ("prompt.chat", lambda: llm._chat_prompt("what is due this week?", context)),
+        ("prompt.build_chat_context", lambda: build_chat_context("what is due this week?")),
+    ]
+    results = {}
+    for name, fn in plan:
+        results[name], _ = timed(fn, repeat * 20)
+    return results
+
+
+def bench_pipeline(llm, backend, ids, llm_emails, repeat):
+    results = {}
+    rng = random.Random(2)
+
+    pending = fetch_untagged_emails()
+    untagged = pending[:llm_emails]
+    calls_before = backend.stats['calls']
+    results["pipeline.categorize_batch"], categories = timed(
+        lambda: llm.categorize_batch(untagged, current_prompts()['categorize']), repeat=1
+    )
+    results["pipeline.categorize_batch"].update({
+        "emails": len(untagged),
+        "categorized": sum(1 for c in categories.values() if c),
+        "llm_calls": backend.stats['calls'] - calls_before,
+    })
+
+    # same amount of other emails, with the local pre-classifier in front
+    # (trained first on the emails that already have a category)
+    results["pipeline.preclassifier_train"], learned = timed(shared_preclassifier.train_from_inbox, repeat=1)
+    results["pipeline.preclassifier_train"]["emails"] = learned
+    fresh = pending[llm_emails:2 * llm_emails]
+    calls_before = backend.stats['calls']
+    results["pipeline.categorize_preclassified"], categories = timed(
+        lambda: categorize_emails(fresh, current_prompts()['categorize'], llm), repeat=1
+    )
+    report = shared_preclassifier.report()
+    results["pipeline.categorize_preclassified"].update({
+        "emails": len(fresh),
+        "categorized": sum(1 for c in categories.values() if c),
+        "llm_calls": backend.stats['calls'] - calls_before,
+        "hit_rate": round(report["hit_rate"], 3),
+        "agreement": report["agreement"],
+    })
+
+    targets = rng.sample(ids, min(20, len(ids)))
+    for email_id in targets:
+        update_email_ai_data(email_id, None, None, None)
+    calls_before = backend.stats['calls']
+    results["pipeline.process_email_insights_x20"], _ = timed(
+        lambda: [process_email_insights(i, llm) for i in targets], repeat=1
+    )
+    results["pipeline.process_email_insights_x20"]["llm_calls"] = backend.stats['calls'] - calls_before
+
+    results["pipeline.similar_emails"], _ = timed(lambda: similar_emails(rng.choice(ids)), repeat * 4)
+    results["pipeline.chat_end_to_end"], _ = timed(
+        lambda: llm.chat_with_inbox("what is due this week?", build_chat_context("what is due this week?")[0]),
+        repeat=1
+    )
+
+    def queue_round_trip(n=200):
+        for i in range(n):
+            enqueue_job("bench", payload={"i": i}, dedupe=False)
+        while True:
+            job = claim_job("bench", kinds=["bench"])
+            if job is None:
+                break
+            complete_job(job['id'], "bench", "ok")
+
+    results["pipeline.job_queue_200"], _ = timed(queue_round_trip, repeat=max(1, repeat // 2))
+    results["llm.metrics"] = {"n": 1, **llm.metrics(), **backend.stats}
+    calls = summarize()
+    results["llm.calls"] = {"n": 1, **{k: round(v, 3) if isinstance(v, float) else v for k, v in calls.items()}}
+    return results
+
+
+# One full benchmark at a given mailbox size, in its own scratch directory
+def run(rows, args):
+    workdir = tempfile.mkdtemp(prefix=f"email-bench-{rows}-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        init_db()
+        results, ids = build_mailbox(rows, args.seed)
+
+        backend = FakeBackend(latency_ms=args.llm_latency * 1000, quota_rate=args.llm_429_rate,
+                              malformed_rate=args.llm_malformed_rate, retry_after=args.llm_retry_after,
+                              seed=args.seed)
+        llm = LLMEngine(
+            limiter=RateLimiter(requests_per_min=args.llm_rpm, tokens_per_min=args.llm_rpm * 10000),
+            cache=ResponseCache(os.path.join("data", "llm_cache.db"), enabled=False),
+            breaker=CircuitBreaker(),
+            backend=backend,
+        )
+
+        results.update(bench_db(ids, args.repeat))
+        results.update(bench_rerun(ids, args.repeat))
+        results.update(bench_prompts(llm, args.repeat))
+        results.update(bench_pipeline(llm, backend, ids, args.llm_emails, args.repeat))
+        return {"rows": rows, "results": results}
+    finally:
+        close_connections()
+        db_manager._migrated.discard(db_manager.DB_NAME)
+        embeddings._shared_index = None
+        shared_preclassifier._counts = None
+        os.chdir(cwd)
+
+
+# Prints timings that got slower than the baseline by more than tolerance.
+# Returns the number of regressions.
+def compare(report, baseline, tolerance):
+    old_runs = {run["rows"]: run["results"] for run in baseline.get("runs", [])}
+    regressions = 0
+    for run_data in report["runs"]:
+        old = old_runs.get(run_data["rows"], {})
+        for name, result in run_data["results"].items():
+            before, after = old.get(name, {}).get("median_ms"), result.get("median_ms")
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change > tolerance:
+                regressions += 1
+                print(f"REGRESSION {run_data['rows']} rows {name}: {before:.2f} -> {after:.2f} ms "
+                      f"(+{change:.0%})", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the email agent on a synthetic mailbox.")
+    parser.add_argument("--rows", default="10000", help="comma-separated mailbox sizes, e.g. 10000,100000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="samples per timing")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="median fake LLM latency in seconds")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="share of fake LLM calls failing with 429")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0, help="share of fake LLM JSON answers truncated")
+    parser.add_argument("--llm-retry-after", type=float, default=0.05, help="retry hint in fake 429s")
+    parser.add_argument("--llm-rpm", type=int, default=6000, help="rate limit for the fake LLM")
+    parser.add_argument("--llm-emails", type=int, default=200, help="untagged emails sent to categorize_batch")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown vs baseline")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "llm_latency": args.llm_latency,
+            "llm_429_rate": args.llm_429_rate,
+            "llm_malformed_rate": args.llm_malformed_rate,
+        },
+        "runs": [],
+    }
+    for rows in (int(r) for r in args.rows.split(",")):
+        print(f"Benchmarking {rows} rows...", file=sys.stderr)
+        report["runs"].append(run(rows, args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
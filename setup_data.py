@@ -1,6 +1,13 @@
 import os
 import sys
-from src.db_manager import init_db, get_connection, save_prompt
+import argparse
+from src.db_manager import init_db, transaction, ingest_emails, INGEST_BATCH_SIZE
+from src.dedupe import cluster_new_emails, reset_clusters
+from src.embeddings import get_index, index_new_emails
+from src.pipeline import AUTO_ANALYZE, enqueue_insights
+from src.prompt_registry import shared_registry
+from src.ingest import read_messages
+from src.synthetic import generate_emails
 
 # Ensure data directory exists
 if not os.path.exists('data'):
@@ -10,10 +17,6 @@ def reset_and_seed_db():
     print("Initializing Database")
     init_db()
 
-    # Clear existing data 
-    conn = get_connection()
-    conn.execute("DELETE FROM emails")
-    conn.commit()
     
     # Mock Emails
     mock_emails = [
@@ -41,11 +44,23 @@ def reset_and_seed_db():
 ]
 
     print(f"Inserting {len(mock_emails)} mock emails...")
-    c = conn.cursor()
-    for email in mock_emails:
-        c.execute("INSERT INTO emails (sender, subject, body, received_at) VALUES (?, ?, ?, ?)", email)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        # Clear existing data, and the side tables that point at the old rows
+        conn.execute("DELETE FROM emails")
+        conn.execute("DELETE FROM jobs")
+        conn.execute("DELETE FROM imap_folders")
+        conn.execute("DELETE FROM precls_decisions")
+        conn.execute("DELETE FROM shared_results")
+        seeded = ingest_emails(
+            {"sender": sender, "subject": subject, "body": body, "received_at": received_at}
+            for sender, subject, body, received_at in mock_emails
+        )
+
+    # Old vectors and clusters belong to deleted rows; rebuild for the fresh inbox
+    get_index().reset()
+    index_new_emails()
+    reset_clusters()
+    cluster_new_emails()
 
     # Set Default Prompts
     print("Injecting Default Prompts")
@@ -65,11 +80,58 @@ def reset_and_seed_db():
     If it is work-related, be formal. If personal, be casual.
     """
 
-    save_prompt("categorize", default_categorize)
-    save_prompt("extract", default_action)
-    save_prompt("reply", default_reply)
+    shared_registry.save("categorize", default_categorize)
+    shared_registry.save("extract", default_action)
+    shared_registry.save("reply", default_reply)
+
+    # Insight stage: one consolidated LLM job per new email (run by the worker)
+    if AUTO_ANALYZE:
+        enqueue_insights(seeded["new_ids"])
+        print(f"Queued analysis for {len(seeded['new_ids'])} emails")
 
     print("Database seeded successfully. File location: data/mock_inbox.db")
 
+def _report_batch(stats):
+    print(f"  {stats['read']} read, {stats['inserted']} inserted, {stats['per_second']:.0f} msgs/s")
+
+# Bulk-imports an mbox file, a directory of .eml files or a JSONL file into
+# the existing inbox (duplicates by Message-ID are skipped)
+def import_messages(path, batch_size=INGEST_BATCH_SIZE):
+    init_db()
+    print(f"Importing {path} (batch size {batch_size})")
+    stats = ingest_emails(read_messages(path), batch_size, on_batch=_report_batch)
+    print(f"Imported {stats['inserted']} emails ({stats['skipped']} duplicates skipped) "
+          f"in {stats['seconds']:.2f}s, {stats['per_second']:.0f} msgs/s")
+
+    index_new_emails()
+    cluster_new_emails()
+    if AUTO_ANALYZE:
+        enqueue_insights(stats["new_ids"])
+        print(f"Queued analysis for {len(stats['new_ids'])} emails")
+    return stats
+
+# Adds `count` seeded synthetic emails for load testing. They are left
+# unanalyzed: queueing LLM work for 100k+ fake emails is never wanted.
+def seed_synthetic(count, seed=0, batch_size=INGEST_BATCH_SIZE):
+    init_db()
+    print(f"Generating {count} synthetic emails (seed {seed})")
+    stats = ingest_emails(generate_emails(count, seed), batch_size, on_batch=_report_batch)
+    print(f"Inserted {stats['inserted']} emails in {stats['seconds']:.2f}s, {stats['per_second']:.0f} msgs/s")
+    index_new_emails()
+    cluster_new_emails()
+    return stats
+
 if __name__ == "__main__":
-    reset_and_seed_db()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Seed the mock inbox or import real mail.")
+    parser.add_argument("--import", dest="import_path", metavar="PATH",
+                        help="mbox file, directory of .eml files, or .jsonl file to add to the inbox")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="add N generated emails for load testing")
+    parser.add_argument("--seed", type=int, default=0, help="seed for --synthetic")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="rows per insert transaction")
+    args = parser.parse_args()
+    if args.import_path:
+        import_messages(args.import_path, args.batch_size)
+    elif args.synthetic:
+        seed_synthetic(args.synthetic, args.seed, args.batch_size)
+    else:
+        reset_and_seed_db()
\ No newline at end of file
@@ -1,20 +1,249 @@
+import os
+import re
 import sqlite3
+import threading
+import time
+import weakref
 import pandas as pd
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime
+from src.deadlines import due_at_for, received_time
 
 DB_NAME = "data/mock_inbox.db"
 
+# Applied once to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # readers never block the writer
+    "PRAGMA synchronous=NORMAL",      # safe with WAL, far fewer fsyncs
+    "PRAGMA cache_size=-16000",       # ~16 MB page cache
+    "PRAGMA mmap_size=134217728",     # 128 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",
+)
+STATEMENT_CACHE_SIZE = 256
+# connections of finished threads kept open for the next thread
+IDLE_CONNECTIONS = int(os.getenv("DB_IDLE_CONNECTIONS", "4"))
+
+_local = threading.local()
+_all_connections = []
+_idle_connections = []
+_registry_lock = threading.Lock()
+
+
+# A thread's connections by database path. Python drops it when the thread
+# ends (Streamlit runs each rerun on a new thread), and a finalizer then
+# hands its connections back to the idle pool, or closes them when the pool
+# is full, so the registry never grows with the number of threads.
+class _ThreadConnections(dict):
+    pass
+
+
+def _release(path, conn):
+    with _registry_lock:
+        if conn not in _all_connections:
+            return
+        if not conn.in_transaction and len(_idle_connections) < IDLE_CONNECTIONS:
+            _idle_connections.append((path, conn))
+            return
+        _all_connections.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+# An idle connection to `path` left by a finished thread, or None
+def _reuse_idle(path):
+    with _registry_lock:
+        for i, (idle_path, conn) in enumerate(_idle_connections):
+            if idle_path == path:
+                del _idle_connections[i]
+                return conn
+    return None
+
+
+# Opens and tunes a new connection and registers it
+def _open(path):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    # isolation_level=None: autocommit, transactions are explicit via transaction()
+    conn = sqlite3.connect(
+        path, timeout=30, isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _registry_lock:
+        _all_connections.append(conn)
+    return conn
+
+
+# Returns this thread's connection: an idle one from a finished thread, or a
+# new one. Connections are reused for the life of the thread, never closed
+# by callers.
 def get_connection():
-    return sqlite3.connect(DB_NAME)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = _ThreadConnections()
+    conn = conns.get(DB_NAME)
+    if conn is None:
+        conn = conns[DB_NAME] = _reuse_idle(DB_NAME) or _open(DB_NAME)
+        weakref.finalize(conns, _release, DB_NAME, conn)
+    return conn
 
 
-# Initializes the database with necessary tables.
-def init_db():
+# Runs the block in one write transaction on this thread's connection.
+# BEGIN IMMEDIATE takes the write lock up front so concurrent writers wait
+# (busy_timeout) instead of failing with "database is locked". Nested uses
+# join the outer transaction.
+@contextmanager
+def transaction():
     conn = get_connection()
-    c = conn.cursor()
-    
+    depth = getattr(_local, "tx_depth", 0)
+    if depth:
+        _local.tx_depth = depth + 1
+        try:
+            yield conn
+        finally:
+            _local.tx_depth = depth
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    _local.tx_depth = 1
+    _local.tx_dirty = False
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+        if _local.tx_dirty:
+            invalidate_read_cache()
+    finally:
+        _local.tx_depth = 0
+        _local.tx_dirty = False
+
+
+# Closes every pooled connection (tests, resets, shutdown)
+def close_connections():
+    with _registry_lock:
+        for conn in _all_connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _all_connections.clear()
+        _idle_connections.clear()
+    _local.conns = _ThreadConnections()
+    invalidate_read_cache()
+
+
+# Read cache. Reads decorated with @cached_read keep their results while the
+# data version is unchanged, so a Streamlit rerun without writes runs no SQL.
+# The version is a counter bumped by every write function in this module
+# (after its commit), plus the size and mtime of the WAL file, which catch
+# commits from other processes (e.g. a separate worker.py) without a query.
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "512"))
+READ_CACHE_ENABLED = os.getenv("READ_CACHE_DISABLED", "") == ""
+
+_data_version = 0
+_read_cache = OrderedDict()
+_read_cache_lock = threading.Lock()
+read_cache_stats = {"hits": 0, "misses": 0}
+
+
+# Drops every cached read (call after writing the database outside this module)
+def invalidate_read_cache():
+    global _data_version
+    with _read_cache_lock:
+        _data_version += 1
+        _read_cache.clear()
+
+
+# Called by write functions (here and in the modules that write their own
+# tables): invalidates now, or on commit inside transaction()
+def data_changed():
+    if getattr(_local, "tx_depth", 0):
+        _local.tx_dirty = True
+    else:
+        invalidate_read_cache()
+
+
+def data_version():
+    try:
+        wal = os.stat(DB_NAME + "-wal")
+        wal_state = (wal.st_size, wal.st_mtime_ns)
+    except OSError:
+        wal_state = None
+    return (_data_version, wal_state)
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+# Callers may modify what they get back, so every hit is a fresh copy
+def _copy(value):
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    return value
+
+
+def cached_read(fn):
+    def wrapper(*args, **kwargs):
+        if not READ_CACHE_ENABLED:
+            return fn(*args, **kwargs)
+        # inside a transaction the caller may read its own uncommitted writes
+        if getattr(_local, "tx_depth", 0):
+            return fn(*args, **kwargs)
+        key = (fn.__module__, fn.__qualname__, DB_NAME, _hashable(args), _hashable(kwargs))
+        # taken before the query: a write that lands meanwhile makes this entry stale
+        version = data_version()
+        with _read_cache_lock:
+            entry = _read_cache.get(key)
+            if entry is not None and entry[0] == version:
+                _read_cache.move_to_end(key)
+                read_cache_stats["hits"] += 1
+                return _copy(entry[1])
+            read_cache_stats["misses"] += 1
+        result = fn(*args, **kwargs)
+        with _read_cache_lock:
+            _read_cache[key] = (version, result)
+            _read_cache.move_to_end(key)
+            while len(_read_cache) > READ_CACHE_SIZE:
+                _read_cache.popitem(last=False)
+        return _copy(result)
+    wrapper.__name__ = fn.__name__
+    wrapper.__qualname__ = fn.__qualname__
+    wrapper.__module__ = fn.__module__
+    wrapper.__doc__ = fn.__doc__
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+
+# The user prompt (prompts.key) each AI column is generated from
+FIELD_PROMPT_KEYS = {"category": "categorize", "action_items": "extract", "draft_reply": "reply"}
+
+# Schema migrations. Each step runs once, in order; PRAGMA user_version
+# stores how many have been applied. Append new steps, never edit old ones.
+def _migration_base_tables(conn):
     # Table for Emails
-    c.execute('''CREATE TABLE IF NOT EXISTS emails (
+    conn.execute('''CREATE TABLE IF NOT EXISTS emails (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         sender TEXT,
         subject TEXT,
@@ -26,90 +255,566 @@ def init_db():
         draft_reply TEXT
     )''')
 
-    # Table for User Prompts 
-    c.execute('''CREATE TABLE IF NOT EXISTS prompts (
+    # Table for User Prompts
+    conn.execute('''CREATE TABLE IF NOT EXISTS prompts (
         key TEXT PRIMARY KEY,
         value TEXT
     )''')
 
-    conn.commit()
-    conn.close()
+def _migration_shadow_calendar(conn):
+    # older builds added these lazily, so they may already exist
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(emails)")}
+    if "is_scheduled" not in columns:
+        conn.execute("ALTER TABLE emails ADD COLUMN is_scheduled INTEGER DEFAULT 0")
+    if "calendar_summary" not in columns:
+        conn.execute("ALTER TABLE emails ADD COLUMN calendar_summary TEXT")
+
+def _migration_listing_indexes(conn):
+    # newest-first listing, optionally filtered by category / unread / scheduled
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_received ON emails(received_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_category ON emails(category, received_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_unread ON emails(is_read, received_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_scheduled ON emails(is_scheduled, received_at, id)")
+
+def _migration_full_text_search(conn):
+    # external-content FTS5 index over emails, kept in sync by triggers
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+        sender, subject, body, action_items,
+        content='emails', content_rowid='id', tokenize='porter unicode61'
+    )""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS emails_fts_insert AFTER INSERT ON emails BEGIN
+        INSERT INTO emails_fts(rowid, sender, subject, body, action_items)
+        VALUES (new.id, new.sender, new.subject, new.body, new.action_items);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS emails_fts_delete AFTER DELETE ON emails BEGIN
+        INSERT INTO emails_fts(emails_fts, rowid, sender, subject, body, action_items)
+        VALUES ('delete', old.id, old.sender, old.subject, old.body, old.action_items);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS emails_fts_update
+        AFTER UPDATE OF sender, subject, body, action_items ON emails BEGIN
+        INSERT INTO emails_fts(emails_fts, rowid, sender, subject, body, action_items)
+        VALUES ('delete', old.id, old.sender, old.subject, old.body, old.action_items);
+        INSERT INTO emails_fts(rowid, sender, subject, body, action_items)
+        VALUES (new.id, new.sender, new.subject, new.body, new.action_items);
+    END""")
+    # subject and sender hits outrank body hits; FTS5 sorts on this internally
+    conn.execute("INSERT INTO emails_fts(emails_fts, rank) VALUES ('rank', 'bm25(2.0, 3.0, 1.0, 1.0)')")
+    conn.execute("INSERT INTO emails_fts(emails_fts) VALUES ('rebuild')")
+
+def _migration_job_queue(conn):
+    # durable background work; status: queued | running | done | dead
+    conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        email_id INTEGER,
+        payload TEXT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        available_at REAL NOT NULL DEFAULT 0,
+        worker TEXT,
+        result TEXT,
+        error TEXT,
+        created_at REAL,
+        updated_at REAL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, available_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_email ON jobs(email_id, status)")
+
+def _migration_imap_sync(conn):
+    # RFC 822 Message-ID of synced/imported mail; NULL for the mock seed data
+    conn.execute("ALTER TABLE emails ADD COLUMN message_id TEXT")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_emails_message_id ON emails(message_id) WHERE message_id IS NOT NULL"
+    )
+    # per-folder sync position; a UIDVALIDITY change invalidates last_uid
+    conn.execute("""CREATE TABLE IF NOT EXISTS imap_folders (
+        account TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        uidvalidity INTEGER,
+        last_uid INTEGER NOT NULL DEFAULT 0,
+        uidnext INTEGER,
+        synced_at REAL,
+        PRIMARY KEY (account, folder)
+    )""")
+
+def _migration_bulk_fts(conn):
+    # insert_emails sets deferred=1 inside its transaction and indexes the
+    # whole batch with one INSERT ... SELECT instead of one trigger per row
+    conn.execute("CREATE TABLE IF NOT EXISTS fts_sync (deferred INTEGER NOT NULL)")
+    conn.execute("INSERT INTO fts_sync (deferred) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM fts_sync)")
+    conn.execute("DROP TRIGGER IF EXISTS emails_fts_insert")
+    conn.execute("""CREATE TRIGGER emails_fts_insert AFTER INSERT ON emails
+        WHEN (SELECT deferred FROM fts_sync) = 0 BEGIN
+        INSERT INTO emails_fts(rowid, sender, subject, body, action_items)
+        VALUES (new.id, new.sender, new.subject, new.body, new.action_items);
+    END""")
+
+def _migration_llm_calls(conn):
+    # one row per LLMEngine call, written by src/llm_metrics.py
+    conn.execute("""CREATE TABLE IF NOT EXISTS llm_calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        method TEXT,
+        model TEXT,
+        prompt_tokens INTEGER,
+        response_tokens INTEGER,
+        latency_ms REAL,
+        ttft_ms REAL,
+        retries INTEGER NOT NULL DEFAULT 0,
+        cache_hit INTEGER NOT NULL DEFAULT 0,
+        streamed INTEGER NOT NULL DEFAULT 0,
+        outcome TEXT,
+        error TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_created ON llm_calls(created_at)")
+
+def _migration_due_dates(conn):
+    # deadline parsed once from calendar_summary (else action_items) when
+    # either is written, relative to when the email was received
+    conn.execute("ALTER TABLE emails ADD COLUMN due_at TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_due ON emails(is_scheduled, due_at)")
+    rows = conn.execute(
+        """SELECT id, COALESCE(NULLIF(calendar_summary, ''), action_items), received_at FROM emails
+           WHERE IFNULL(calendar_summary, '') != '' OR IFNULL(action_items, '') != ''"""
+    ).fetchall()
+    conn.executemany(
+        "UPDATE emails SET due_at=? WHERE id=?",
+        [(due, r[0]) for r, due in ((r, due_at_for(r[1], received_time(r[2]))) for r in rows) if due]
+    )
+
+def _migration_prompt_versions(conn):
+    # every prompt text ever saved, keyed by its stable version id
+    from src.prompt_registry import version_id
+    conn.execute("""CREATE TABLE IF NOT EXISTS prompt_versions (
+        version_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        text TEXT,
+        created_at REAL,
+        PRIMARY KEY (key, version_id)
+    )""")
+    conn.executemany(
+        "INSERT OR IGNORE INTO prompt_versions (version_id, key, text, created_at) VALUES (?, ?, ?, ?)",
+        [(version_id(value), key, value, time.time()) for key, value in conn.execute("SELECT key, value FROM prompts")]
+    )
+    # which prompt version produced each recorded LLM call
+    conn.execute("ALTER TABLE llm_calls ADD COLUMN prompt_version TEXT")
+
+def _migration_field_versions(conn):
+    # prompt version that produced each AI column (see src/reprocess.py).
+    # Existing values are assumed to come from the prompts saved now.
+    from src.prompt_registry import DEFAULT_PROMPTS, version_id
+    saved = dict(conn.execute("SELECT key, value FROM prompts").fetchall())
+    for column, key in FIELD_PROMPT_KEYS.items():
+        conn.execute(f"ALTER TABLE emails ADD COLUMN {column}_version TEXT")
+        conn.execute(
+            f"UPDATE emails SET {column}_version=? WHERE IFNULL({column}, '') != ''",
+            (version_id(saved.get(key, DEFAULT_PROMPTS[key])),)
+        )
+
+def _migration_preclassifier(conn):
+    # naive Bayes counts of the local pre-classifier (src/preclassifier.py)
+    conn.execute("""CREATE TABLE IF NOT EXISTS precls_tokens (
+        category TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (category, bucket)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS precls_classes (
+        category TEXT PRIMARY KEY,
+        docs INTEGER NOT NULL,
+        tokens INTEGER NOT NULL
+    )""")
+    # emails already learned, and under which label
+    conn.execute("""CREATE TABLE IF NOT EXISTS precls_trained (
+        email_id INTEGER PRIMARY KEY,
+        category TEXT
+    )""")
+    # latest local decision per email, with the LLM's answer when known
+    conn.execute("""CREATE TABLE IF NOT EXISTS precls_decisions (
+        email_id INTEGER PRIMARY KEY,
+        tier TEXT,
+        category TEXT,
+        confidence REAL,
+        llm_category TEXT,
+        audited INTEGER DEFAULT 0,
+        created_at REAL
+    )""")
+
+def _migration_clusters(conn):
+    # near-duplicate cluster and thread of every email (src/dedupe.py);
+    # cluster_id is the representative's id
+    conn.execute("""CREATE TABLE IF NOT EXISTS email_clusters (
+        email_id INTEGER PRIMARY KEY,
+        cluster_id INTEGER NOT NULL,
+        thread_key TEXT,
+        simhash INTEGER,
+        distance INTEGER
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clusters_cluster ON email_clusters(cluster_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clusters_thread ON email_clusters(thread_key, email_id)")
+    # representatives by 16-bit SimHash slice, for candidate lookup
+    conn.execute("""CREATE TABLE IF NOT EXISTS simhash_bands (
+        band INTEGER NOT NULL,
+        value INTEGER NOT NULL,
+        email_id INTEGER NOT NULL,
+        PRIMARY KEY (band, value, email_id)
+    ) WITHOUT ROWID""")
+    # audit trail of results copied from a cluster or thread mate
+    conn.execute("""CREATE TABLE IF NOT EXISTS shared_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email_id INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        field TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        distance INTEGER,
+        created_at REAL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_results_email ON shared_results(email_id)")
+
+def _migration_cluster_content_hash(conn):
+    # exact-copy key (digits included): only exact copies share action items
+    conn.execute("ALTER TABLE email_clusters ADD COLUMN content_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clusters_content ON email_clusters(content_hash, email_id)")
+
+MIGRATIONS = [
+    _migration_base_tables,
+    _migration_shadow_calendar,
+    _migration_listing_indexes,
+    _migration_full_text_search,
+    _migration_job_queue,
+    _migration_imap_sync,
+    _migration_bulk_fts,
+    _migration_llm_calls,
+    _migration_due_dates,
+    _migration_prompt_versions,
+    _migration_field_versions,
+    _migration_preclassifier,
+    _migration_clusters,
+    _migration_cluster_content_hash,
+]
+
+_migrated = set()
+
+# Brings the database up to the latest schema version
+def run_migrations():
+    with transaction() as conn:
+        # read inside the write lock so two processes never run the same step
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            data_changed()
+    return len(MIGRATIONS)
+
+# Initializes the database with necessary tables. Runs the migrations once
+# per process; later calls are free.
+def init_db():
+    if DB_NAME in _migrated:
+        return
+    run_migrations()
+    _migrated.add(DB_NAME)
+
+# Highest email id, the cheap "anything new?" probe of the post-ingest hooks
+@cached_read
+def max_email_id():
+    return get_connection().execute("SELECT IFNULL(MAX(id), 0) FROM emails").fetchone()[0]
 
 # Returns all emails as a DataFrame
+@cached_read
 def fetch_emails():
-    conn = get_connection()
-    df = pd.read_sql("SELECT * FROM emails ORDER BY received_at DESC", conn)
-    conn.close()
-    return df
+    return pd.read_sql("SELECT * FROM emails ORDER BY received_at DESC", get_connection())
+
+# Columns needed to render the inbox list (no bodies, drafts or action items)
+LISTING_COLUMNS = "id, sender, subject, received_at, is_read, category"
+
+# Returns one page of the inbox listing, newest first, as (rows, next_cursor).
+# after: the cursor returned with the previous page, i.e. (received_at, id)
+#        of its last row. Keyset pagination keeps every page O(limit).
+# categories: only these categories (an empty list matches nothing)
+@cached_read
+def fetch_email_page(limit=50, after=None, categories=None, unread_only=False, scheduled_only=False):
+    clauses, params = [], []
+    if categories is not None:
+        if not categories:
+            return [], None
+        clauses.append(f"category IN ({', '.join('?' * len(categories))})")
+        params.extend(categories)
+    if unread_only:
+        clauses.append("is_read = 0")
+    if scheduled_only:
+        clauses.append("is_scheduled = 1")
+    if after:
+        clauses.append("(received_at, id) < (?, ?)")
+        params.extend(after)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = get_connection().execute(
+        f"SELECT {LISTING_COLUMNS} FROM emails {where} ORDER BY received_at DESC, id DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+
+    rows = [dict(r) for r in rows]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]['received_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+# Scheduled emails for the dashboard/calendar, urgent first then newest
+@cached_read
+def fetch_scheduled_emails(limit=None):
+    sql = f"""SELECT {LISTING_COLUMNS}, action_items, calendar_summary FROM emails
+              WHERE is_scheduled = 1
+              ORDER BY (category = 'Urgent') DESC, received_at DESC"""
+    params = ()
+    if limit:
+        sql += " LIMIT ?"
+        params = (limit,)
+    return [dict(r) for r in get_connection().execute(sql, params).fetchall()]
+
+# Scheduled emails due in [start, end) (due_at strings), plus the undated
+# ones, for the week view and dashboard: soonest first, undated last, urgent
+# first within the same deadline. Both halves are index range scans of
+# idx_emails_due (an OR would scan every scheduled row).
+@cached_read
+def fetch_deadlines(start, end):
+    columns = f"{LISTING_COLUMNS}, action_items, calendar_summary, due_at"
+    rows = get_connection().execute(
+        f"""SELECT * FROM (
+                SELECT {columns} FROM emails WHERE is_scheduled = 1 AND due_at >= ? AND due_at < ?
+                UNION ALL
+                SELECT {columns} FROM emails WHERE is_scheduled = 1 AND due_at IS NULL
+            ) ORDER BY due_at IS NULL, due_at, (category = 'Urgent') DESC, received_at DESC""",
+        (start, end)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+# Emails that still need a category (input for Auto-Tag)
+@cached_read
+def fetch_untagged_emails():
+    rows = get_connection().execute(
+        "SELECT id, sender, subject, body FROM emails WHERE category IS NULL OR category = ''"
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+# Turns free text into a safe FTS5 query. By default every word must match,
+# the last one as a prefix (search-as-you-type); match_any ORs plain words.
+# Returns None if there are no words.
+def _fts_query(text, match_any=False):
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    if match_any:
+        return " OR ".join(terms)
+    terms[-1] += "*"
+    return " ".join(terms)
+
+# Full-text search over sender, subject, body and action items.
+# Returns listing columns plus a highlighted body snippet, best match first.
+@cached_read
+def search_emails(query, limit=20, match_any=False):
+    match = _fts_query(query, match_any)
+    if not match:
+        return []
+    # rank and limit inside FTS5 first, then join only the winners
+    rows = get_connection().execute(
+        """SELECT e.id, e.sender, e.subject, e.received_at, e.is_read, e.category,
+                  hits.snippet, hits.rank
+           FROM (SELECT rowid, snippet(emails_fts, 2, '**', '**', '...', 12) AS snippet, rank
+                 FROM emails_fts WHERE emails_fts MATCH ? ORDER BY rank LIMIT ?) AS hits
+           JOIN emails e ON e.id = hits.rowid
+           ORDER BY hits.rank""",
+        (match, limit)
+    ).fetchall()
+    return [dict(r) for r in rows]
 
 # Fetches a single email
+@cached_read
 def get_email_by_id(email_id):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM emails WHERE id=?", (email_id,))
-    row = c.fetchone()
-    conn.close()
+    row = get_connection().execute("SELECT * FROM emails WHERE id=?", (email_id,)).fetchone()
     return dict(row) if row else None
 
-# Updates the email with generated details
-def update_email_ai_data(email_id, category, action_items, draft_reply):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute('''UPDATE emails 
-                 SET category=?, action_items=?, draft_reply=? 
-                 WHERE id=?''', 
-              (category, action_items, draft_reply, email_id))
-    conn.commit()
-    conn.close()
-
-# Saves or updates a user prompt configuration
+# due_at follows the action items unless a calendar summary set it
+DUE_FROM_ACTIONS = "due_at = CASE WHEN IFNULL(calendar_summary, '') = '' THEN ? ELSE due_at END"
+
+# When the email arrived: relative deadlines in it are resolved from there
+def _received(email_id):
+    row = get_connection().execute("SELECT received_at FROM emails WHERE id=?", (email_id,)).fetchone()
+    return received_time(row[0]) if row else None
+
+# Updates the email with generated details.
+# versions: {column: prompt version id} for the columns just generated;
+# the others keep the version they had.
+def update_email_ai_data(email_id, category, action_items, draft_reply, versions=None):
+    versions = versions or {}
+    get_connection().execute(f'''UPDATE emails
+                 SET category=?, action_items=?, draft_reply=?, {DUE_FROM_ACTIONS},
+                     category_version=COALESCE(?, category_version),
+                     action_items_version=COALESCE(?, action_items_version),
+                     draft_reply_version=COALESCE(?, draft_reply_version)
+                 WHERE id=?''',
+              (category, action_items, draft_reply, due_at_for(action_items, _received(email_id)),
+               versions.get("category"), versions.get("action_items"), versions.get("draft_reply"), email_id))
+    data_changed()
+
+# Columns the AI pipeline may write individually
+AI_COLUMNS = ("category", "action_items", "draft_reply")
+
+# Updates only the given AI columns, leaving the others untouched.
+# fields: {column: value}. Safe when several jobs work on one email at once.
+# versions: {column: prompt version id} of the prompts that generated them
+# (edits that keep the prompt's output, like a refined draft, pass none)
+def update_email_fields(email_id, fields, versions=None):
+    versions = versions or {}
+    unknown = (set(fields) | set(versions)) - set(AI_COLUMNS)
+    if unknown:
+        raise ValueError(f"Not an AI column: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    assignments = [f"{column}=?" for column in fields]
+    values = list(fields.values())
+    for column, version in versions.items():
+        assignments.append(f"{column}_version=?")
+        values.append(version)
+    if "action_items" in fields:
+        assignments.append(DUE_FROM_ACTIONS)
+        values.append(due_at_for(fields["action_items"], _received(email_id)))
+    get_connection().execute(
+        f"UPDATE emails SET {', '.join(assignments)} WHERE id=?", values + [email_id]
+    )
+    data_changed()
+
+# Writes many categories in one transaction. categories: {email_id: category}
+# version: id of the categorize prompt version that produced them
+def update_categories_bulk(categories, version=None):
+    rows = [(cat, version, email_id) for email_id, cat in categories.items() if cat]
+    if not rows:
+        return 0
+    with transaction() as conn:
+        conn.executemany("UPDATE emails SET category=?, category_version=? WHERE id=?", rows)
+        data_changed()
+    return len(rows)
+
+# Columns an incoming email provides
+INSERT_COLUMNS = ("sender", "subject", "body", "received_at", "message_id")
+
+# Inserts new emails in one transaction, skipping any whose Message-ID is
+# already stored. rows: dicts with INSERT_COLUMNS (message_id may be None;
+# a missing received_at becomes now, since listing pages key on it).
+# The rows are added to the FTS index in the same transaction, set-based.
+# Returns the ids of the rows actually inserted.
+def insert_emails(rows):
+    if not rows:
+        return []
+    now = datetime.now().strftime("%Y-%m-%d %H:%M")
+    params = [
+        (row.get("sender"), row.get("subject"), row.get("body"), row.get("received_at") or now, row.get("message_id"))
+        for row in rows
+    ]
+    with transaction() as conn:
+        before = conn.execute("SELECT COALESCE(MAX(id), 0) FROM emails").fetchone()[0]
+        conn.execute("UPDATE fts_sync SET deferred=1")
+        conn.executemany(
+            f"INSERT OR IGNORE INTO emails ({', '.join(INSERT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)", params
+        )
+        conn.execute(
+            """INSERT INTO emails_fts(rowid, sender, subject, body, action_items)
+               SELECT id, sender, subject, body, action_items FROM emails WHERE id > ?""",
+            (before,)
+        )
+        conn.execute("UPDATE fts_sync SET deferred=0")
+        data_changed()
+        return [r[0] for r in conn.execute("SELECT id FROM emails WHERE id > ? ORDER BY id", (before,))]
+
+# Rows per executemany transaction during bulk ingest
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+
+# Bulk ingest: consumes any iterable of email dicts (see insert_emails,
+# e.g. the readers in src/ingest.py) batch_size rows at a time, each batch
+# one executemany transaction. The per-row FTS insert trigger is switched
+# off (fts_sync.deferred) during the batch, and the batch's new rows are
+# bulk-loaded into emails_fts with one INSERT ... SELECT before it commits
+# (see insert_emails). on_batch(stats) runs after every batch.
+# Returns stats: read, inserted, skipped (duplicate Message-IDs), seconds,
+# per_second and new_ids.
+def ingest_emails(messages, batch_size=INGEST_BATCH_SIZE, on_batch=None):
+    messages = iter(messages)
+    stats = {"read": 0, "inserted": 0, "skipped": 0, "seconds": 0.0, "per_second": 0.0, "new_ids": []}
+    start = time.perf_counter()
+    while True:
+        batch = list(islice(messages, batch_size))
+        if not batch:
+            break
+        new_ids = insert_emails(batch)
+        stats["read"] += len(batch)
+        stats["inserted"] += len(new_ids)
+        stats["skipped"] += len(batch) - len(new_ids)
+        stats["new_ids"].extend(new_ids)
+        stats["seconds"] = time.perf_counter() - start
+        stats["per_second"] = stats["read"] / stats["seconds"] if stats["seconds"] else 0.0
+        if on_batch:
+            on_batch(stats)
+    return stats
+
+# Saves or updates a user prompt configuration (without a version record;
+# prompt_registry.shared_registry.save is the versioned way)
 def save_prompt(key, value):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO prompts (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    get_connection().execute("INSERT OR REPLACE INTO prompts (key, value) VALUES (?, ?)", (key, value))
+    data_changed()
 
 # Retrieves a prompt, returning a default if not set
+@cached_read
 def get_prompt(key, default_text=""):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT value FROM prompts WHERE key=?", (key,))
-    row = c.fetchone()
-    conn.close()
+    row = get_connection().execute("SELECT value FROM prompts WHERE key=?", (key,)).fetchone()
     return row[0] if row else default_text
 
+# One chat context line per email
+def format_chat_line(r):
+    return f"- ID {r[0]}: From {r[1]}, Subject '{r[2]}', Category: {r[3]}, Actions: {r[4]}\n"
+
 # Helper to get text context for the agent
+@cached_read
 def get_all_emails_for_chat():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, sender, subject, category, action_items FROM emails")
-    rows = c.fetchall()
-    conn.close()
-    context = "INBOX SUMMARY:\n"
-    for r in rows:
-        context += f"- ID {r[0]}: From {r[1]}, Subject '{r[2]}', Category: {r[3]}, Actions: {r[4]}\n"
-    return context
+    rows = get_connection().execute("SELECT id, sender, subject, category, action_items FROM emails").fetchall()
+    return "INBOX SUMMARY:\n" + "".join(format_chat_line(r) for r in rows)
+
+# Chat fields for the given ids, in the order given
+@cached_read
+def fetch_chat_rows(email_ids):
+    if not email_ids:
+        return []
+    rows = get_connection().execute(
+        f"""SELECT id, sender, subject, category, action_items FROM emails
+            WHERE id IN ({', '.join('?' * len(email_ids))})""",
+        list(email_ids)
+    ).fetchall()
+    by_id = {r[0]: r for r in rows}
+    return [by_id[i] for i in email_ids if i in by_id]
+
+# Size in characters get_all_emails_for_chat() would produce, without building it
+@cached_read
+def chat_context_size():
+    row = get_connection().execute(
+        """SELECT COUNT(*), SUM(LENGTH(id) + IFNULL(LENGTH(sender), 4) + IFNULL(LENGTH(subject), 4)
+                  + IFNULL(LENGTH(category), 4) + IFNULL(LENGTH(action_items), 4))
+           FROM emails"""
+    ).fetchone()
+    count, chars = row[0], row[1] or 0
+    return len("INBOX SUMMARY:\n") + chars + count * len("- ID : From , Subject '', Category: , Actions: \n")
 
 # Marks an email as read in the database
 def mark_as_read(email_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE emails SET is_read=1 WHERE id=?", (email_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute("UPDATE emails SET is_read=1 WHERE id=?", (email_id,))
+    data_changed()
 
-# Updates the shadow calendar column and marks as scheduled
+# Updates the shadow calendar column and marks as scheduled. The deadline
+# is parsed from the summary; an undated summary keeps the one found in the
+# action items.
 def schedule_with_shadow_summary(email_id, summary_text):
-    conn = get_connection()
-    c = conn.cursor()
-    try:
-        c.execute("ALTER TABLE emails ADD COLUMN is_scheduled INTEGER DEFAULT 0")
-    except: pass
-    try:
-        c.execute("ALTER TABLE emails ADD COLUMN calendar_summary TEXT")
-    except: pass
-    c.execute("UPDATE emails SET is_scheduled=1, calendar_summary=? WHERE id=?", (summary_text, email_id))
-    conn.commit()
-    conn.close()
+    get_connection().execute(
+        "UPDATE emails SET is_scheduled=1, calendar_summary=?, due_at=COALESCE(?, due_at) WHERE id=?",
+        (summary_text, due_at_for(summary_text, _received(email_id)), email_id)
+    )
+    data_changed()
@@ -0,0 +1,256 @@
+import re
+import calendar
+from datetime import datetime, timedelta
+
+# Deadline parsing for action items and calendar summaries. The text is
+# resolved once, against the time its email was received (the `now` passed
+# in; the current time when there is none), into the due_at column, so the
+# calendar never re-reads it. Understands
+# weekdays ("this Friday", "next Tuesday"), today / tomorrow / tonight,
+# EOD / COB, end of week / month, weekends, "in 3 days", day-of-month
+# ordinals ("by the 25th"), absolute dates (2025-11-25, 11/25, 25.11.2025,
+# Nov 25, 25th of November) and times (10 AM, 14:30, noon, afternoon).
+# With several deadlines in one text, the earliest wins.
+#
+# Forms that also occur in ordinary prose need a deadline cue ("by", "on",
+# "due", "before", "until" or a weekday) in front of them, or a year:
+# day-month ("Use 2 may be fine"), bare numeric dates ("1/2 of the docs")
+# and weekday abbreviations ("mon", "wed").
+
+DUE_FORMAT = "%Y-%m-%d %H:%M"
+
+# A deadline with a date but no time is due at the end of that day
+END_OF_DAY = (23, 59)
+# EOD / COB and end of week mean close of business
+BUSINESS_CLOSE = (17, 0)
+PART_OF_DAY = {"morning": (9, 0), "noon": (12, 0), "midday": (12, 0), "afternoon": (15, 0),
+               "evening": (19, 0), "tonight": (20, 0), "midnight": (23, 59)}
+
+# Month-day dates without a year: further back than this, they mean next year
+PAST_DATE_GRACE_DAYS = 60
+
+WEEKDAYS = {"monday": 0, "mon": 0, "tuesday": 1, "tues": 1, "tue": 1, "wednesday": 2, "wed": 2,
+            "thursday": 3, "thurs": 3, "thur": 3, "thu": 3, "friday": 4, "fri": 4, "saturday": 5,
+            "sunday": 6}
+WEEKDAY_NAMES = [day.lower() for day in calendar.day_name]
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7}
+
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+_WEEKDAY = "|".join(sorted(WEEKDAYS, key=len, reverse=True))
+_WEEKDAY_NAME = "|".join(WEEKDAY_NAMES)
+_WEEKDAY_ABBR = "|".join(sorted(set(WEEKDAYS) - set(WEEKDAY_NAMES), key=len, reverse=True))
+_ORD = r"(?:st|nd|rd|th)?"
+# words that mark what follows as a deadline
+_CUE = rf"(?P<cue>by|on|before|until|due(?:\s+(?:on|by))?|{_WEEKDAY}),?\s+(?:the\s+)?"
+
+# Date patterns in priority order; each consumes its span so later ones
+# cannot re-read it ("25th of November" is not also "the 25th")
+DATE_PATTERNS = [
+    ("iso", re.compile(r"\b(\d{4})[-/](\d{1,2})[-/](\d{1,2})\b")),
+    ("dotted", re.compile(r"\b(\d{1,2})\.(\d{1,2})\.(\d{4}|\d{2})\b")),
+    ("month_day", re.compile(rf"\b({_MONTH})\.?\s+(\d{{1,2}}){_ORD}(?:,?\s+(\d{{4}}))?\b", re.I)),
+    ("day_month", re.compile(rf"\b(?:{_CUE})?(\d{{1,2}}){_ORD}\s+(?:of\s+)?({_MONTH})\b\.?(?:,?\s+(\d{{4}}))?", re.I)),
+    ("numeric", re.compile(rf"\b(?:{_CUE})?(\d{{1,2}})/(\d{{1,2}})(?:/(\d{{4}}|\d{{2}}))?\b", re.I)),
+    ("ordinal", re.compile(r"\b(?:by|on|before|until|due(?: on| by)?)\s+(?:the\s+)?(\d{1,2})(?:st|nd|rd|th)\b", re.I)),
+    ("day_after", re.compile(r"\bday after tomorrow\b", re.I)),
+    ("tomorrow", re.compile(r"\b(?:tomorrow|tmrw|tmr)\b", re.I)),
+    ("today", re.compile(r"\b(today|tonight)\b", re.I)),
+    ("eod", re.compile(r"\b(?:eod|cob|end of (?:the )?(?:business )?day|close of business)\b", re.I)),
+    ("eow", re.compile(r"\b(?:eow|end of (?:the |this )?week)\b", re.I)),
+    ("eom", re.compile(r"\b(?:eom|end of (?:the |this )?month)\b", re.I)),
+    ("weekend", re.compile(r"\b(?:this |the )?weekend\b", re.I)),
+    ("next_week", re.compile(r"\bnext week\b", re.I)),
+    ("in_days", re.compile(r"\bin\s+(\d+|a|an|one|two|three|four|five|six|seven)\s+(day|week)s?\b", re.I)),
+    ("weekday", re.compile(rf"\b(?:(this|next|coming)\s+)?({_WEEKDAY_NAME})\b\.?", re.I)),
+    ("weekday", re.compile(rf"\b(?:(this|next|coming)|by|on|before|until|due(?:\s+(?:on|by))?)\s+({_WEEKDAY_ABBR})\b\.?",
+                           re.I)),
+]
+
+TIME_PATTERNS = [
+    ("ampm", re.compile(r"\b(\d{1,2})(?::([0-5]\d))?\s*([ap])\.?m\b\.?", re.I)),
+    ("clock", re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")),
+    ("part", re.compile(r"\b(morning|noon|midday|afternoon|evening|tonight|midnight)\b", re.I)),
+]
+
+
+def _safe_date(year, month, day):
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+
+# A month/day with no year: this year, unless that is long past
+def _without_year(now, month, day):
+    date = _safe_date(now.year, month, day)
+    if date and (now - date).days > PAST_DATE_GRACE_DAYS:
+        date = _safe_date(now.year + 1, month, day)
+    return date
+
+
+def _year(text):
+    if not text:
+        return None
+    year = int(text)
+    return year + 2000 if year < 100 else year
+
+
+def _next_weekday(now, weekday, include_today=False):
+    days = (weekday - now.weekday()) % 7
+    if days == 0 and not include_today:
+        days = 7
+    return now + timedelta(days=days)
+
+
+# (date, explicit (hour, minute) or None) for one date match
+def _resolve(kind, match, now):
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    groups = match.groups()
+    if kind == "iso":
+        return _safe_date(int(groups[0]), int(groups[1]), int(groups[2])), None
+    if kind == "dotted":
+        return _safe_date(_year(groups[2]), int(groups[1]), int(groups[0])), None
+    if kind == "month_day":
+        month, day = MONTHS[groups[0].lower()], int(groups[1])
+        year = _year(groups[2])
+        return (_safe_date(year, month, day) if year else _without_year(today, month, day)), None
+    if kind in ("day_month", "numeric"):
+        # groups[0] is the cue; without it, only a full date counts
+        cue, year = groups[0], _year(groups[3])
+        if not cue and not year:
+            return None, None
+        if kind == "day_month":
+            month, day = MONTHS[groups[2].lower()], int(groups[1])
+        else:
+            month, day = int(groups[1]), int(groups[2])
+        return (_safe_date(year, month, day) if year else _without_year(today, month, day)), None
+    if kind == "ordinal":
+        day = int(groups[0])
+        if not 1 <= day <= 31:
+            return None, None
+        year, month = today.year, today.month
+        if day < today.day:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        # "the 31st" in a 30-day month is its last day
+        day = min(day, calendar.monthrange(year, month)[1])
+        return datetime(year, month, day), None
+    if kind == "day_after":
+        return today + timedelta(days=2), None
+    if kind == "tomorrow":
+        return today + timedelta(days=1), None
+    if kind == "today":
+        return today, PART_OF_DAY["tonight"] if groups[0].lower() == "tonight" else None
+    if kind == "eod":
+        return today, BUSINESS_CLOSE
+    if kind == "eow":
+        return _next_weekday(today, 4, include_today=True), BUSINESS_CLOSE
+    if kind == "eom":
+        return today.replace(day=calendar.monthrange(today.year, today.month)[1]), None
+    if kind == "weekend":
+        return _next_weekday(today, 5, include_today=True), None
+    if kind == "next_week":
+        return _next_weekday(today, 0), None
+    if kind == "in_days":
+        count = NUMBER_WORDS.get(groups[0].lower()) or int(groups[0])
+        return today + timedelta(days=count * (7 if groups[1].lower() == "week" else 1)), None
+    if kind == "weekday":
+        qualifier, weekday = (groups[0] or "").lower(), WEEKDAYS[groups[1].lower()]
+        date = _next_weekday(today, weekday, include_today=qualifier == "this")
+        # "next Tuesday" is the one in the following week
+        if qualifier == "next" and date - today < timedelta(days=7 - today.weekday()):
+            date += timedelta(days=7)
+        return date, None
+    return None, None
+
+
+def _time(kind, match):
+    groups = match.groups()
+    if kind == "ampm":
+        hour, minute = int(groups[0]), int(groups[1] or 0)
+        if not 1 <= hour <= 12:
+            return None
+        return (hour % 12 + (12 if groups[2].lower() == "p" else 0), minute)
+    if kind == "clock":
+        return (int(groups[0]), int(groups[1]))
+    return PART_OF_DAY[groups[0].lower()]
+
+
+def _overlaps(span, taken):
+    return any(span[0] < end and start < span[1] for start, end in taken)
+
+
+# Deadlines found in one line: each time joins the nearest date without one;
+# a line with only a time is due today at that time
+def _line_deadlines(line, now):
+    taken, dates = [], []
+    for kind, pattern in DATE_PATTERNS:
+        for match in pattern.finditer(line):
+            if _overlaps(match.span(), taken):
+                continue
+            date, at = _resolve(kind, match, now)
+            if date is None:
+                continue
+            taken.append(match.span())
+            dates.append([match.start(), date, at])
+
+    times = []
+    for kind, pattern in TIME_PATTERNS:
+        for match in pattern.finditer(line):
+            if _overlaps(match.span(), taken):
+                continue
+            at = _time(kind, match)
+            if at:
+                taken.append(match.span())
+                times.append((match.start(), at))
+
+    if not dates and times:
+        dates.append([times[0][0], now.replace(hour=0, minute=0, second=0, microsecond=0), None])
+    for position, at in sorted(times):
+        open_dates = [d for d in dates if d[2] is None]
+        if open_dates:
+            min(open_dates, key=lambda d: abs(d[0] - position))[2] = at
+
+    return [date.replace(hour=(at or END_OF_DAY)[0], minute=(at or END_OF_DAY)[1]) for _, date, at in dates]
+
+
+# The earliest deadline in `text` as a datetime, or None when it has none
+def parse_deadline(text, now=None):
+    if not text:
+        return None
+    now = now or datetime.now()
+    found = []
+    for line in text.splitlines():
+        found.extend(_line_deadlines(line, now))
+    return min(found) if found else None
+
+
+# An email's received_at as the `now` for its relative deadlines ("tomorrow"
+# is the day after it arrived, not after it was processed). None when the
+# value can't be parsed.
+def received_time(received_at):
+    for fmt in (DUE_FORMAT, "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(str(received_at), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+# parse_deadline formatted for the due_at column (None when undated)
+def due_at_for(text, now=None):
+    due = parse_deadline(text, now)
+    return due.strftime(DUE_FORMAT) if due else None
+
+
+# Short label for the UI: "Fri 28 Nov" or "Fri 28 Nov, 10:00"
+def format_due(due_at):
+    if not due_at:
+        return "No date"
+    due = datetime.strptime(due_at, DUE_FORMAT)
+    label = due.strftime("%a %d %b")
+    if (due.hour, due.minute) != END_OF_DAY:
+        label += due.strftime(", %H:%M")
+    return label
@@ -0,0 +1,304 @@
+import os
+import re
+import time
+import zlib
+import hashlib
+import numpy as np
+from src.db_manager import get_connection, transaction, cached_read, data_changed, max_email_id
+
+# Near-duplicate and thread clustering, so recurring mail (ticket
+# notifications, bank alerts, receipts, newsletters) shares LLM results
+# instead of paying for one call each.
+#
+# Near duplicates: every email gets a 64-bit SimHash of its word 3-shingles.
+# Emails within MAX_DISTANCE bits of a cluster representative join that
+# cluster. Representatives are indexed in simhash_bands by BANDS 16-bit
+# slices of the hash; two hashes at distance <= BANDS - 1 agree on at least
+# one slice, so a new email only compares against representatives sharing a
+# slice value (a few indexed lookups, not a scan of the mailbox).
+# Threads: sender plus the subject without Re:/Fwd: prefixes and [tags].
+#
+# Sharing: a field produced under the current prompt version is reused by
+# the other members of its near-duplicate cluster or thread (category only:
+# near duplicates differ in amounts and dates, and a reply asks for
+# different things). Action items, and the deadline parsed from them, are
+# only copied between exact copies (same text, digits included). Every
+# reuse is recorded in shared_results.
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# the band index only guarantees finding matches up to BANDS - 1 bits apart
+MAX_DISTANCE = min(int(os.getenv("DEDUPE_MAX_DISTANCE", "3")), BANDS - 1)
+SHINGLE = 3
+# shorter texts are too generic to call near duplicates
+MIN_WORDS = 8
+BODY_CHARS = 4000
+CLUSTER_BATCH = 1000
+
+NEAR_DUPLICATE = "near_duplicate"
+EXACT_DUPLICATE = "exact_duplicate"
+THREAD = "thread"
+
+# field -> kinds of grouping it may be shared across, preferred first
+SHARE_FIELDS = {"category": (NEAR_DUPLICATE, THREAD), "action_items": (EXACT_DUPLICATE,)}
+
+MASK64 = (1 << 64) - 1
+_BIT_WEIGHTS = (1 << np.arange(64, dtype=np.uint64)).astype(np.uint64)
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+WORD = re.compile(r"[a-z0-9]+")
+DIGITS = re.compile(r"\d+")
+SUBJECT_PREFIX = re.compile(r"^\s*(?:(?:re|fwd?|aw|sv)\s*(?:\[\d+\])?\s*:\s*|\[[^\]]*\]\s*)+", re.I)
+
+
+# 64-bit SimHash (unsigned) of the text's word shingles; None when too
+# short. Numbers are masked, so notifications differing only in order
+# numbers, amounts or dates hash alike.
+def simhash(text):
+    words = WORD.findall(DIGITS.sub("0", (text or "").lower()))
+    if len(words) < MIN_WORDS:
+        return None
+    hashes = np.unique(_shingle_hashes(np.array([zlib.crc32(w.encode()) for w in words], dtype=np.uint64)))
+    bits = ((hashes[:, None] & _BIT_WEIGHTS) != 0).sum(axis=0)
+    return int(_BIT_WEIGHTS[bits * 2 > len(hashes)].sum())
+
+
+# 64-bit hash of every run of SHINGLE consecutive word hashes (uint64
+# arithmetic wraps), finished with the splitmix64 mixer
+def _shingle_hashes(words):
+    n = len(words) - SHINGLE + 1
+    x = np.zeros(n, dtype=np.uint64)
+    for i in range(SHINGLE):
+        x = x * _MULTIPLIER + words[i:i + n]
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def hamming(a, b):
+    return bin((a ^ b) & MASK64).count("1")
+
+
+# SQLite integers are signed 64-bit
+def _to_db(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _bands(value):
+    return [(band, (value >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)) for band in range(BANDS)]
+
+
+# Subject without reply/forward prefixes and [tags], lowercased
+def normalize_subject(subject):
+    return " ".join(SUBJECT_PREFIX.sub("", subject or "").lower().split())
+
+
+# Thread of an email: sender + normalised subject (None without a subject)
+def thread_key(sender, subject):
+    subject = normalize_subject(subject)
+    if not subject:
+        return None
+    key = f"{(sender or '').strip().lower()}\x00{subject}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def email_text(row):
+    return f"{row['subject'] or ''}\n{(row['body'] or '')[:BODY_CHARS]}"
+
+
+# Key of the exact text (case and spacing aside), for exact copies
+def content_hash(row):
+    text = " ".join(f"{row['subject'] or ''}\n{row['body'] or ''}".lower().split())
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# The closest representative within MAX_DISTANCE: (rep id, distance) or None
+def _nearest(conn, value):
+    bands = _bands(value)
+    rows = conn.execute(
+        f"""SELECT c.email_id, c.simhash FROM email_clusters c
+            WHERE c.email_id IN (SELECT email_id FROM simhash_bands
+                                 WHERE {' OR '.join('(band=? AND value=?)' for _ in bands)})""",
+        [x for band in bands for x in band]
+    ).fetchall()
+    matches = [(hamming(value, rep_hash), rep_id) for rep_id, rep_hash in rows]
+    matches = [m for m in matches if m[0] <= MAX_DISTANCE]
+    if not matches:
+        return None
+    distance, rep_id = min(matches)
+    return rep_id, distance
+
+
+# Highest clustered email id
+@cached_read
+def last_clustered_id():
+    return get_connection().execute("SELECT IFNULL(MAX(email_id), 0) FROM email_clusters").fetchone()[0]
+
+
+# Assigns a cluster and thread to every email that has none yet, oldest
+# first (run after ingest, like embeddings.index_new_emails). Returns the
+# number of emails clustered. When nothing is new it answers from the read
+# cache and never takes the write lock.
+def cluster_new_emails(batch_size=CLUSTER_BATCH):
+    done = 0
+    if max_email_id() <= last_clustered_id():
+        return done
+    while True:
+        with transaction() as conn:
+            last = conn.execute("SELECT IFNULL(MAX(email_id), 0) FROM email_clusters").fetchone()[0]
+            rows = conn.execute(
+                "SELECT id, sender, subject, body FROM emails WHERE id > ? ORDER BY id LIMIT ?",
+                (last, batch_size)
+            ).fetchall()
+            if not rows:
+                return done
+            for row in rows:
+                value = simhash(email_text(row))
+                cluster_id, distance = row['id'], 0
+                if value is not None:
+                    nearest = _nearest(conn, value)
+                    if nearest:
+                        cluster_id, distance = nearest
+                    else:
+                        conn.executemany(
+                            "INSERT INTO simhash_bands (band, value, email_id) VALUES (?, ?, ?)",
+                            [(band, part, row['id']) for band, part in _bands(value)]
+                        )
+                conn.execute(
+                    """INSERT INTO email_clusters (email_id, cluster_id, thread_key, simhash, distance, content_hash)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (row['id'], cluster_id, thread_key(row['sender'], row['subject']),
+                     None if value is None else _to_db(value), distance, content_hash(row))
+                )
+            data_changed()
+            done += len(rows)
+
+
+# Forgets all clusters (the inbox was reseeded)
+def reset_clusters():
+    with transaction() as conn:
+        conn.execute("DELETE FROM email_clusters")
+        conn.execute("DELETE FROM simhash_bands")
+        data_changed()
+
+
+# {email_id: cluster id} (an email not clustered yet is its own cluster)
+def clusters_of(email_ids):
+    found = {}
+    for chunk in _chunks(list(email_ids)):
+        rows = get_connection().execute(
+            f"SELECT email_id, cluster_id FROM email_clusters WHERE email_id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ).fetchall()
+        found.update({r[0]: r[1] for r in rows})
+    return {email_id: found.get(email_id, email_id) for email_id in email_ids}
+
+
+def _chunks(items, size=500):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# Results other emails already have that these emails may reuse.
+# versions: {field: current prompt version}; only values produced under
+# that version are shared. Returns {email_id: {field: {"value", "source_id",
+# "kind", "distance"}}}, in SHARE_FIELDS order of preference.
+def find_shared(email_ids, versions):
+    fields = [f for f in SHARE_FIELDS if f in versions]
+    shared = {}
+    conn = get_connection()
+    for chunk in _chunks(list(email_ids)):
+        for field in fields:
+            for kind in SHARE_FIELDS[field]:
+                pending = [i for i in chunk if field not in shared.get(i, {})]
+                if not pending:
+                    break
+                if kind == NEAR_DUPLICATE:
+                    found = _from_representative(conn, pending, field, versions[field])
+                else:
+                    column = "thread_key" if kind == THREAD else "content_hash"
+                    found = _from_group(conn, pending, field, versions[field], column)
+                for email_id, (value, source_id, distance) in found.items():
+                    shared.setdefault(email_id, {})[field] = {
+                        "value": value, "source_id": source_id, "kind": kind, "distance": distance
+                    }
+    return shared
+
+
+# {email_id: (value, representative id, distance)} for emails whose cluster
+# representative has `field` from prompt `version`
+def _from_representative(conn, email_ids, field, version):
+    rows = conn.execute(
+        f"""SELECT c.email_id, r.{field}, r.id, c.distance FROM email_clusters c
+            JOIN emails r ON r.id = c.cluster_id
+            WHERE c.email_id IN ({', '.join('?' * len(email_ids))}) AND c.cluster_id != c.email_id
+              AND IFNULL(r.{field}, '') != '' AND r.{field}_version = ?""",
+        email_ids + [version]
+    ).fetchall()
+    return {email_id: (value, source_id, distance) for email_id, value, source_id, distance in rows}
+
+
+# {email_id: (value, source id, None)} for emails with an earlier-clustered
+# mate sharing `column` (thread_key or content_hash) that has `field` from
+# prompt `version`
+def _from_group(conn, email_ids, field, version, column):
+    rows = conn.execute(
+        f"""SELECT c.email_id,
+                   (SELECT t.email_id FROM email_clusters t JOIN emails e ON e.id = t.email_id
+                    WHERE t.{column} = c.{column} AND t.email_id != c.email_id
+                      AND IFNULL(e.{field}, '') != '' AND e.{field}_version = ?
+                    ORDER BY t.email_id LIMIT 1) AS source_id
+            FROM email_clusters c
+            WHERE c.email_id IN ({', '.join('?' * len(email_ids))}) AND c.{column} IS NOT NULL""",
+        [version] + email_ids
+    ).fetchall()
+    sources = {email_id: source_id for email_id, source_id in rows if source_id}
+    if not sources:
+        return {}
+    values = dict(conn.execute(
+        f"SELECT id, {field} FROM emails WHERE id IN ({', '.join('?' * len(set(sources.values())))})",
+        list(set(sources.values()))
+    ).fetchall())
+    return {email_id: (values[source_id], source_id, None) for email_id, source_id in sources.items()}
+
+
+# Audit trail: one shared_results row per reused field.
+# reuses: [(email_id, field, {"source_id", "kind", "distance"})]
+def record_shared(reuses):
+    if not reuses:
+        return
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany(
+            """INSERT INTO shared_results (email_id, source_id, field, kind, distance, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(email_id, r["source_id"], field, r["kind"], r["distance"], now) for email_id, field, r in reuses]
+        )
+        data_changed()
+
+
+# Cluster sizes and reuse counts for the Stats tab
+@cached_read
+def report():
+    conn = get_connection()
+    clustered, clusters, duplicates = conn.execute(
+        """SELECT COUNT(*), COUNT(DISTINCT cluster_id), SUM(cluster_id != email_id)
+           FROM email_clusters"""
+    ).fetchone()
+    threads = conn.execute(
+        """SELECT COUNT(*) FROM (SELECT thread_key FROM email_clusters WHERE thread_key IS NOT NULL
+                                 GROUP BY thread_key HAVING COUNT(*) > 1)"""
+    ).fetchone()[0]
+    reused = conn.execute(
+        "SELECT kind, field, COUNT(*) AS reused FROM shared_results GROUP BY kind, field ORDER BY kind, field"
+    ).fetchall()
+    return {
+        "clustered": clustered,
+        "clusters": clusters,
+        "near_duplicates": duplicates or 0,
+        "threads": threads,
+        "reused": [dict(r) for r in reused],
+    }
@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import zlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process locks apply
+    fcntl = None
+from src.db_manager import DB_NAME, get_connection, max_email_id
+
+# Vectors live next to the inbox database
+INDEX_PREFIX = os.path.join(os.path.dirname(DB_NAME), "email_vectors")
+EMBED_DIM = int(os.getenv("EMBED_DIM", "256"))
+EMBED_BATCH = 1000
+SEARCH_CHUNK = 65536
+
+
+# Offline encoder: signed feature hashing of word unigrams and bigrams with
+# sublinear term frequency, L2-normalised. Stable across processes (crc32).
+class HashingEncoder:
+    name = "hashing-v1"
+
+    def __init__(self, dim=EMBED_DIM):
+        self.dim = dim
+
+    # crc32 of every unigram, and of every bigram "w1 w2" (chained from w1's crc)
+    @staticmethod
+    def _hashes(text):
+        words = re.findall(rb"[a-z0-9]+", (text or "").lower().encode("utf-8"))
+        unigrams = [zlib.crc32(w) for w in words]
+        bigrams = [zlib.crc32(b" " + w, h) for h, w in zip(unigrams, words[1:])]
+        return unigrams + bigrams
+
+    def encode(self, texts):
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            features = self._hashes(text)
+            hashes.extend(features)
+            rows.extend([row] * len(features))
+
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        flat = np.asarray(rows, dtype=np.int64) * self.dim + (hashes % self.dim).astype(np.int64)
+        signs = np.where(hashes >> 31, 1.0, -1.0)
+        counts = np.bincount(flat, weights=signs, minlength=len(texts) * self.dim)
+        counts = counts.reshape(len(texts), self.dim)
+
+        magnitude = np.abs(counts)
+        vectors = np.sign(counts) * np.where(magnitude > 0, 1.0 + np.log(np.maximum(magnitude, 1.0)), 0.0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+
+# Text an email is embedded from
+def email_text(row):
+    return f"{row['sender']} {row['subject']} {row['body'] or ''}"
+
+
+# Append-only float32 matrix on disk (<prefix>.f32) with a parallel id list
+# (<prefix>.ids), memory-mapped for search. Adds never rewrite old rows.
+# Writers (add, reset) also hold an flock on <prefix>.lock, so the app and
+# a separate import process never append the same ids or repair files the
+# other is still writing. Readers take no file lock: they only map the rows
+# present in both files.
+class VectorIndex:
+    def __init__(self, prefix=INDEX_PREFIX, encoder=None):
+        self.prefix = prefix
+        self.encoder = encoder or HashingEncoder()
+        self.dim = self.encoder.dim
+        self._lock = threading.Lock()
+        # held by index_new_emails from the max id read to the append
+        self.append_lock = threading.Lock()
+        self._vectors = None
+        self._ids = None
+        self._rows = None
+        self._loaded_rows = -1
+        self._check_meta()
+
+    @property
+    def vectors_path(self):
+        return self.prefix + ".f32"
+
+    @property
+    def ids_path(self):
+        return self.prefix + ".ids"
+
+    @property
+    def meta_path(self):
+        return self.prefix + ".json"
+
+    @property
+    def lock_path(self):
+        return self.prefix + ".lock"
+
+    # Exclusive lock shared with other processes using the same files
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Vectors from a different encoder/dimension are useless: start over
+    def _check_meta(self):
+        meta = {"encoder": self.encoder.name, "dim": self.dim}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                if json.load(f) == meta:
+                    return
+        folder = os.path.dirname(self.meta_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self.reset()
+        with open(self.meta_path, "w") as f:
+            json.dump(meta, f)
+
+    # Deletes all stored vectors
+    def reset(self):
+        with self._lock, self._file_lock():
+            for path in (self.vectors_path, self.ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._vectors = self._ids = self._rows = None
+            self._loaded_rows = -1
+
+    def _sizes(self):
+        return tuple(os.path.getsize(p) if os.path.exists(p) else 0 for p in (self.vectors_path, self.ids_path))
+
+    # Rows present in both files
+    def __len__(self):
+        vector_bytes, id_bytes = self._sizes()
+        return min(vector_bytes // (self.dim * 4), id_bytes // 8)
+
+    # Cuts both files back to their common rows (a crash between the two
+    # appends leaves vectors without ids, which would shift every later row).
+    # Returns the row count. Called with both locks held: without the file
+    # lock, the tail may be another process's append in progress.
+    def _align(self):
+        count = len(self)
+        if self._sizes() != (count * self.dim * 4, count * 8):
+            for path, size in ((self.vectors_path, count * self.dim * 4), (self.ids_path, count * 8)):
+                if os.path.exists(path):
+                    os.truncate(path, size)
+        return count
+
+    # (Re)maps the files if another writer appended since the last look
+    def _load(self):
+        count = len(self)
+        if count == self._loaded_rows:
+            return
+        if count == 0:
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self._ids = np.zeros(0, dtype=np.int64)
+        else:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+            self._ids = np.fromfile(self.ids_path, dtype=np.int64, count=count)
+        self._rows = {int(email_id): row for row, email_id in enumerate(self._ids)}
+        self._loaded_rows = count
+
+    # Highest email id already embedded (ids are appended in ascending order)
+    def max_id(self):
+        with self._lock:
+            self._load()
+            return int(self._ids[-1]) if len(self._ids) else 0
+
+    # Appends vectors for new emails. Ids not above the last stored one are
+    # dropped (another process may have indexed them meanwhile).
+    def add(self, email_ids, vectors):
+        email_ids = np.asarray(email_ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            count = self._align()
+            if count:
+                last = np.fromfile(self.ids_path, dtype=np.int64, count=1, offset=(count - 1) * 8)[0]
+                keep = email_ids > last
+                email_ids, vectors = email_ids[keep], vectors[keep]
+            if not len(email_ids):
+                return 0
+            # ids last: a reader never sees an id without its vector
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(email_ids.tobytes())
+            return len(email_ids)
+
+    # Cosine top-k over the whole index, scanned in chunks.
+    # Returns [(email_id, score)], best first, each id once.
+    def search(self, query_vector, k=5, exclude=()):
+        with self._lock:
+            self._load()
+            vectors, ids = self._vectors, self._ids
+        if not len(ids):
+            return []
+
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        want = k + len(exclude)
+        best_ids, best_scores = [], []
+        for start in range(0, len(ids), SEARCH_CHUNK):
+            scores = vectors[start:start + SEARCH_CHUNK] @ query_vector
+            take = min(want, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_ids.append(ids[start:start + SEARCH_CHUNK][top])
+            best_scores.append(scores[top])
+
+        all_ids = np.concatenate(best_ids)
+        all_scores = np.concatenate(best_scores)
+        order = np.argsort(-all_scores)
+        results, seen = [], set(exclude)
+        for i in order:
+            email_id = int(all_ids[i])
+            if email_id in seen:
+                continue
+            seen.add(email_id)
+            results.append((email_id, float(all_scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+    # Stored vector for an email, or None if it is not indexed
+    def vector_for(self, email_id):
+        with self._lock:
+            self._load()
+            row = self._rows.get(int(email_id))
+            return None if row is None else np.array(self._vectors[row])
+
+
+_shared_index = None
+
+
+# One index per process
+def get_index():
+    global _shared_index
+    if _shared_index is None:
+        _shared_index = VectorIndex()
+    return _shared_index
+
+
+# Embeds every email not yet in the index. Free when nothing is new (the
+# max id probe is a cached read), so it can run after any insert path.
+# Concurrent callers take turns, so no email is embedded twice.
+def index_new_emails(index=None):
+    index = index or get_index()
+    added = 0
+    with index.append_lock:
+        last = index.max_id()
+        if max_email_id() <= last:
+            return added
+        cursor = get_connection().execute(
+            "SELECT id, sender, subject, body FROM emails WHERE id > ? ORDER BY id", (last,)
+        )
+        while True:
+            rows = cursor.fetchmany(EMBED_BATCH)
+            if not rows:
+                break
+            added += index.add([r['id'] for r in rows], index.encoder.encode([email_text(r) for r in rows]))
+    return added
+
+
+# Emails most similar to the given one: [(email_id, score)]
+def similar_emails(email_id, k=5, index=None):
+    index = index or get_index()
+    vector = index.vector_for(email_id)
+    if vector is None:
+        return []
+    return index.search(vector, k, exclude={int(email_id)})
+
+
+# Emails most similar to free text (chat questions): [(email_id, score)]
+def search_text(text, k=10, index=None):
+    index = index or get_index()
+    return index.search(index.encoder.encode([text])[0], k)
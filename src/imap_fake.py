@@ -0,0 +1,233 @@
+import re
+import time
+import threading
+import socketserver
+
+# Minimal in-process IMAP4rev1 server for exercising the sync engine offline.
+# Speaks just what imap_sync uses (CAPABILITY, LOGIN, STATUS, SELECT/EXAMINE,
+# UID SEARCH, UID FETCH with partial BODY[], CLOSE, LOGOUT) over a real
+# socket, so imaplib runs unmodified. Every command is logged in `commands`
+# and every FETCH literal byte counted in `bytes_sent`.
+
+_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\([^)]*\))|(\S+)')
+_PARTIAL = re.compile(r"BODY(?:\.PEEK)?\[\](?:<(\d+)\.(\d+)>)?", re.I)
+
+
+def _tokens(text):
+    out = []
+    for quoted, group, atom in _TOKEN.findall(text):
+        if quoted or (not group and not atom):
+            out.append(re.sub(r"\\(.)", r"\1", quoted))
+        else:
+            out.append(group or atom)
+    return out
+
+
+# Expands an IMAP sequence set ("1:4,7,9:*") over the given sorted numbers
+def _sequence(spec, numbers):
+    if not numbers:
+        return []
+    top = numbers[-1]
+    chosen = set()
+    for part in spec.split(","):
+        low, _, high = part.partition(":")
+        low = top if low == "*" else int(low)
+        high = low if not high else (top if high == "*" else int(high))
+        low, high = min(low, high), max(low, high)
+        chosen.update(n for n in numbers if low <= n <= high)
+    return sorted(chosen)
+
+
+class FakeImapServer:
+    def __init__(self, user="demo", password="demo", uidvalidity=1):
+        self.user = user
+        self.password = password
+        self.folders = {}
+        self.uidvalidity = {}
+        self.uidnext = {}
+        self.default_uidvalidity = uidvalidity
+        self.commands = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    # Appends a raw RFC 822 message to a folder and returns its UID
+    def add_message(self, raw, folder="INBOX"):
+        with self._lock:
+            self.folders.setdefault(folder, {})
+            self.uidvalidity.setdefault(folder, self.default_uidvalidity)
+            uid = self.uidnext.get(folder, 1)
+            self.folders[folder][uid] = (raw, time.time())
+            self.uidnext[folder] = uid + 1
+            return uid
+
+    # Simulates a server-side mailbox rebuild: new UIDVALIDITY, renumbered UIDs
+    def renumber(self, folder="INBOX"):
+        with self._lock:
+            messages = list(self.folders.get(folder, {}).values())
+            self.uidvalidity[folder] = self.uidvalidity.get(folder, self.default_uidvalidity) + 1
+            self.folders[folder] = {uid: msg for uid, msg in enumerate(messages, start=1)}
+            self.uidnext[folder] = len(messages) + 1
+
+    def start(self):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                _Session(fake, self.rfile, self.wfile).run()
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Session:
+    def __init__(self, fake, rfile, wfile):
+        self.fake = fake
+        self.rfile = rfile
+        self.wfile = wfile
+        self.selected = None
+
+    def send(self, line):
+        self.wfile.write(line if isinstance(line, bytes) else line.encode())
+        if not line.endswith(b"\r\n" if isinstance(line, bytes) else "\r\n"):
+            self.wfile.write(b"\r\n")
+
+    def run(self):
+        self.send("* OK [CAPABILITY IMAP4rev1] fake IMAP ready")
+        for raw in self.rfile:
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if not line:
+                continue
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                sub, _, args = args.partition(" ")
+                command = "UID " + sub.upper()
+            with self.fake._lock:
+                self.fake.commands.append(command)
+            handler = getattr(self, "cmd_" + command.replace(" ", "_").lower(), None)
+            try:
+                if handler is None:
+                    self.send(f"{tag} BAD unknown command")
+                elif handler(tag, _tokens(args)) == "bye":
+                    return
+            except (ValueError, KeyError, IndexError) as e:
+                self.send(f"{tag} BAD {e}")
+
+    def cmd_capability(self, tag, args):
+        self.send("* CAPABILITY IMAP4rev1")
+        self.send(f"{tag} OK CAPABILITY completed")
+
+    def cmd_noop(self, tag, args):
+        self.send(f"{tag} OK NOOP completed")
+
+    def cmd_login(self, tag, args):
+        if args[:2] == [self.fake.user, self.fake.password]:
+            self.send(f"{tag} OK LOGIN completed")
+        else:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials")
+
+    def cmd_logout(self, tag, args):
+        self.send("* BYE logging out")
+        self.send(f"{tag} OK LOGOUT completed")
+        return "bye"
+
+    def cmd_status(self, tag, args):
+        folder = args[0]
+        if folder not in self.fake.folders:
+            return self.send(f"{tag} NO no such mailbox")
+        self.send(
+            f'* STATUS "{folder}" (UIDVALIDITY {self.fake.uidvalidity[folder]} '
+            f"UIDNEXT {self.fake.uidnext[folder]} MESSAGES {len(self.fake.folders[folder])})"
+        )
+        self.send(f"{tag} OK STATUS completed")
+
+    def cmd_select(self, tag, args, mode="READ-WRITE"):
+        folder = args[0]
+        if folder not in self.fake.folders:
+            return self.send(f"{tag} NO no such mailbox")
+        self.selected = folder
+        self.send(f"* {len(self.fake.folders[folder])} EXISTS")
+        self.send("* 0 RECENT")
+        self.send(f"* OK [UIDVALIDITY {self.fake.uidvalidity[folder]}] UIDs valid")
+        self.send(f"* OK [UIDNEXT {self.fake.uidnext[folder]}] predicted next UID")
+        self.send(f"{tag} OK [{mode}] SELECT completed")
+
+    def cmd_examine(self, tag, args):
+        self.cmd_select(tag, args, "READ-ONLY")
+
+    def cmd_close(self, tag, args):
+        self.selected = None
+        self.send(f"{tag} OK CLOSE completed")
+
+    def _uids(self):
+        return sorted(self.fake.folders[self.selected])
+
+    def cmd_uid_search(self, tag, args):
+        if self.selected is None:
+            return self.send(f"{tag} BAD no mailbox selected")
+        uids = self._uids()
+        if len(args) >= 2 and args[0].upper() == "UID":
+            uids = _sequence(args[1], uids)
+        self.send("* SEARCH " + " ".join(map(str, uids)))
+        self.send(f"{tag} OK SEARCH completed")
+
+    def cmd_uid_fetch(self, tag, args):
+        if self.selected is None:
+            return self.send(f"{tag} BAD no mailbox selected")
+        all_uids = self._uids()
+        wanted = " ".join(args[1:]).upper()
+        partial = _PARTIAL.search(wanted)
+        for uid in _sequence(args[0], all_uids):
+            raw, arrived = self.fake.folders[self.selected][uid]
+            seq = all_uids.index(uid) + 1
+            items = [f"UID {uid}"]
+            if "RFC822.SIZE" in wanted:
+                items.append(f"RFC822.SIZE {len(raw)}")
+            if "INTERNALDATE" in wanted:
+                items.append('INTERNALDATE "' + time.strftime("%d-%b-%Y %H:%M:%S +0000", time.gmtime(arrived)) + '"')
+            if partial:
+                start, length = partial.groups()
+                if start is None:
+                    literal, label = raw, "BODY[]"
+                else:
+                    literal, label = raw[int(start):int(start) + int(length)], f"BODY[]<{start}>"
+                with self.fake._lock:
+                    self.fake.bytes_sent += len(literal)
+                self.send(f"* {seq} FETCH ({' '.join(items)} {label} {{{len(literal)}}}".encode())
+                self.wfile.write(literal)
+                self.send(")")
+            else:
+                self.send(f"* {seq} FETCH ({' '.join(items)})")
+        self.send(f"{tag} OK FETCH completed")
+
+
+# Convenience for scripts: a started server (caller stops it)
+def start_fake_server(messages=(), folder="INBOX", **kwargs):
+    server = FakeImapServer(**kwargs)
+    server.folders.setdefault(folder, {})
+    server.uidvalidity.setdefault(folder, server.default_uidvalidity)
+    server.uidnext.setdefault(folder, 1)
+    for raw in messages:
+        server.add_message(raw, folder)
+    return server.start()
@@ -0,0 +1,148 @@
+import io
+import os
+import re
+import time
+import imaplib
+from src.db_manager import get_connection, transaction, insert_emails
+from src.mime_parser import parse_message
+
+# UIDs fetched per FETCH command
+IMAP_BATCH_SIZE = int(os.getenv("IMAP_BATCH_SIZE", "200"))
+# Bytes fetched per message (headers + the leading text part). Anything past
+# this, i.e. the attachments, never leaves the server.
+IMAP_FETCH_BYTES = int(os.getenv("IMAP_FETCH_BYTES", "65536"))
+
+_STATUS_ITEM = re.compile(rb"(UIDVALIDITY|UIDNEXT|MESSAGES) (\d+)")
+_FETCH_UID = re.compile(rb"UID (\d+)")
+_FETCH_DATE = re.compile(rb'INTERNALDATE "([^"]+)"')
+
+
+class ImapSyncError(Exception):
+    pass
+
+
+def _quote(folder):
+    return '"' + folder.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _check(typ, data, what):
+    if typ != "OK":
+        raise ImapSyncError(f"{what} failed: {data}")
+    return data
+
+
+# Stored sync position for a folder, or None before the first sync
+def get_folder_state(account, folder):
+    row = get_connection().execute(
+        "SELECT uidvalidity, last_uid, uidnext FROM imap_folders WHERE account=? AND folder=?",
+        (account, folder)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def _save_folder_state(conn, account, folder, uidvalidity, last_uid, uidnext):
+    conn.execute(
+        """INSERT OR REPLACE INTO imap_folders (account, folder, uidvalidity, last_uid, uidnext, synced_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (account, folder, uidvalidity, last_uid, uidnext, time.time())
+    )
+
+
+# {UIDVALIDITY, UIDNEXT, MESSAGES} of a folder without selecting it
+def _folder_status(imap, folder):
+    data = _check(*imap.status(_quote(folder), "(UIDVALIDITY UIDNEXT MESSAGES)"), "STATUS")
+    return {k.decode(): int(v) for k, v in _STATUS_ITEM.findall(b" ".join(d for d in data if d))}
+
+
+# Splits UIDs into FETCH-sized runs; each run goes out as one "first:last" set
+def _batches(uids, size):
+    for start in range(0, len(uids), size):
+        yield uids[start:start + size]
+
+
+# One UID FETCH for a run of messages: [(uid, email dict)].
+# Each message is a bounded partial fetch parsed straight from the literal.
+def _fetch_batch(imap, uids):
+    data = _check(*imap.uid(
+        "FETCH", f"{uids[0]}:{uids[-1]}", f"(UID INTERNALDATE BODY.PEEK[]<0.{IMAP_FETCH_BYTES}>)"
+    ), "FETCH")
+    messages = []
+    for i, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        # items after the literal may arrive in the trailing chunk
+        trailer = data[i + 1] if i + 1 < len(data) and isinstance(data[i + 1], bytes) else b""
+        meta = item[0] + b" " + trailer
+        uid = _FETCH_UID.search(meta)
+        if uid is None:
+            continue
+        email = parse_message(io.BytesIO(item[1]))
+        date = _FETCH_DATE.search(meta)
+        if email["received_at"] is None and date:
+            parsed = imaplib.Internaldate2tuple(b'INTERNALDATE "' + date.group(1) + b'"')
+            if parsed:
+                email["received_at"] = time.strftime("%Y-%m-%d %H:%M", parsed)
+        messages.append((int(uid.group(1)), email))
+    return messages
+
+
+# Brings one folder up to date and returns a stats dict.
+# Costs a single STATUS round-trip when nothing changed since the last sync;
+# otherwise fetches only UIDs above the stored last_uid (everything again if
+# UIDVALIDITY changed; Message-ID dedupe keeps that from duplicating rows).
+# Each batch is inserted and its position saved in one transaction, so an
+# interrupted sync resumes where it stopped.
+def sync_folder(imap, account, folder="INBOX", batch_size=IMAP_BATCH_SIZE, on_progress=None):
+    stats = {"folder": folder, "fetched": 0, "inserted": 0, "new_ids": [], "reset": False}
+    status = _folder_status(imap, folder)
+    uidvalidity, uidnext = status.get("UIDVALIDITY"), status.get("UIDNEXT")
+    state = get_folder_state(account, folder)
+
+    if state and state["uidvalidity"] == uidvalidity and uidnext is not None and state["uidnext"] == uidnext:
+        return stats
+
+    last_uid = 0
+    if state and state["uidvalidity"] == uidvalidity:
+        last_uid = state["last_uid"]
+    else:
+        stats["reset"] = state is not None
+
+    _check(*imap.select(_quote(folder), readonly=True), "SELECT")
+    found = _check(*imap.uid("SEARCH", "UID", f"{last_uid + 1}:*"), "SEARCH")
+    # "n:*" always matches the newest message, even when it is older than n
+    uids = sorted(int(u) for u in b" ".join(d for d in found if d).split() if int(u) > last_uid)
+
+    for run in _batches(uids, batch_size):
+        messages = _fetch_batch(imap, run)
+        with transaction() as conn:
+            new_ids = insert_emails([email for _, email in messages])
+            _save_folder_state(conn, account, folder, uidvalidity, run[-1], None)
+        stats["fetched"] += len(messages)
+        stats["inserted"] += len(new_ids)
+        stats["new_ids"].extend(new_ids)
+        if on_progress:
+            on_progress(folder, stats["fetched"], len(uids))
+        last_uid = run[-1]
+
+    with transaction() as conn:
+        _save_folder_state(conn, account, folder, uidvalidity, last_uid, max(uidnext or 0, last_uid + 1))
+    imap.close()
+    return stats
+
+
+# Connects, syncs the given folders and logs out. Returns one stats dict per folder.
+def sync_account(host, user, password, folders=("INBOX",), port=None, use_ssl=True,
+                 batch_size=IMAP_BATCH_SIZE, on_progress=None):
+    if use_ssl:
+        imap = imaplib.IMAP4_SSL(host, port or 993)
+    else:
+        imap = imaplib.IMAP4(host, port or 143)
+    try:
+        _check(*imap.login(user, password), "LOGIN")
+        account = f"{user}@{host}"
+        return [sync_folder(imap, account, folder, batch_size, on_progress) for folder in folders]
+    finally:
+        try:
+            imap.logout()
+        except (imaplib.IMAP4.error, OSError):
+            pass
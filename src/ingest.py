@@ -0,0 +1,118 @@
+import os
+import json
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from src.mime_parser import parse_message, synthetic_message_id
+
+# Readers for db_manager.ingest_emails. Each yields email dicts one at a
+# time (sender, subject, body, received_at, message_id), so an import never
+# holds more than one batch in memory.
+
+
+# Lines of one mbox message, stopping at the next "From " separator
+class _MboxMessage:
+    def __init__(self, f):
+        self.f = f
+        self.next_separator = b""
+
+    def __iter__(self):
+        for line in self.f:
+            if line.startswith(b"From "):
+                self.next_separator = line
+                return
+            # mboxrd quoting
+            yield line[1:] if line.startswith(b">From ") else line
+
+
+# Messages of an mbox file, parsed as they stream past
+def read_mbox(path):
+    with open(path, "rb") as f:
+        line = f.readline()
+        while line and not line.startswith(b"From "):
+            line = f.readline()
+        while line:
+            message = _MboxMessage(f)
+            lines = iter(message)
+            yield parse_message(lines)
+            for _ in lines:
+                pass
+            line = message.next_separator
+
+
+# A single .eml file
+def read_eml_file(path):
+    with open(path, "rb") as f:
+        yield parse_message(f)
+
+
+# Every .eml file under a directory, in path order
+def read_eml_dir(path):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".eml"):
+                with open(os.path.join(root, name), "rb") as f:
+                    yield parse_message(f)
+
+
+# Field names accepted in JSONL rows (first match wins)
+JSONL_FIELDS = {
+    "sender": ("sender", "from"),
+    "subject": ("subject",),
+    "body": ("body", "text", "content"),
+    "received_at": ("received_at", "date", "timestamp"),
+    "message_id": ("message_id", "message-id"),
+}
+
+
+# received_at in the "%Y-%m-%d %H:%M" form every listing sorts and pages on.
+# Accepts epoch seconds (or milliseconds), ISO 8601 and RFC 2822 dates;
+# None (insert uses now) when the value can't be parsed.
+def _jsonl_received_at(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, (int, float)) or str(value).strip().replace(".", "", 1).isdigit():
+            seconds = float(value)
+            if seconds > 1e11:
+                seconds /= 1000
+            return datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M")
+        text = str(value).strip()
+        try:
+            parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        except ValueError:
+            parsed = parsedate_to_datetime(text)
+        return parsed.strftime("%Y-%m-%d %H:%M")
+    except (TypeError, ValueError, IndexError, OverflowError, OSError):
+        return None
+
+
+# One JSON object per line
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            email = {}
+            for field, keys in JSONL_FIELDS.items():
+                email[field] = next((row[k] for k in keys if row.get(k) is not None), None)
+            email["received_at"] = _jsonl_received_at(email["received_at"])
+            if email["message_id"] is None:
+                email["message_id"] = synthetic_message_id(email)
+            else:
+                email["message_id"] = str(email["message_id"])
+            yield email
+
+
+# Picks the reader from the path: a directory of .eml files, a .jsonl file,
+# a single .eml, or otherwise an mbox file
+def read_messages(path):
+    if os.path.isdir(path):
+        return read_eml_dir(path)
+    lowered = path.lower()
+    if lowered.endswith((".jsonl", ".ndjson")):
+        return read_jsonl(path)
+    if lowered.endswith(".eml"):
+        return read_eml_file(path)
+    return read_mbox(path)
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+from src.db_manager import get_connection, transaction, cached_read, data_changed
+
+# A running job whose worker has been silent this long is assumed dead and re-claimed
+LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+RETRY_BASE_SECONDS = 5.0
+
+
+def _to_dict(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+    return job
+
+
+# Adds a job and returns its id. With dedupe, an identical queued/running
+# job (same kind and email) is reused instead of queueing a second one.
+# delay: seconds before the job becomes claimable (to pace bulk work)
+def enqueue_job(kind, email_id=None, payload=None, max_attempts=3, dedupe=True, delay=0):
+    now = time.time()
+    with transaction() as conn:
+        if dedupe and email_id is not None:
+            row = conn.execute(
+                """SELECT id FROM jobs WHERE email_id=? AND kind=? AND status IN ('queued', 'running')
+                   ORDER BY id LIMIT 1""",
+                (email_id, kind)
+            ).fetchone()
+            if row:
+                return row[0]
+        cursor = conn.execute(
+            """INSERT INTO jobs (kind, email_id, payload, max_attempts, available_at, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (kind, email_id, json.dumps(payload or {}), max_attempts, now + delay, now, now)
+        )
+        data_changed()
+        return cursor.lastrowid
+
+
+# Atomically takes the oldest runnable job for this worker, or None.
+# Runnable: queued and due, or running with an expired lease. An expired
+# job that has used up its attempts (its worker keeps crashing on it) is
+# dead-lettered instead of being handed out again.
+def claim_job(worker_id, kinds=None):
+    now = time.time()
+    kind_filter, params = "", [now, now - LEASE_SECONDS]
+    if kinds:
+        kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})"
+        params.extend(kinds)
+
+    with transaction() as conn:
+        expired = conn.execute(
+            """UPDATE jobs SET status='dead', error='lease expired after the last attempt', updated_at=?
+               WHERE status = 'running' AND updated_at < ? AND attempts >= max_attempts""",
+            (now, now - LEASE_SECONDS)
+        ).rowcount
+        if expired:
+            data_changed()
+        row = conn.execute(
+            f"""SELECT id FROM jobs
+                WHERE ((status = 'queued' AND available_at <= ?)
+                       OR (status = 'running' AND updated_at < ?))
+                {kind_filter}
+                ORDER BY id LIMIT 1""",
+            params
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            """UPDATE jobs SET status='running', attempts=attempts + 1, worker=?, updated_at=?
+               WHERE id=?""",
+            (worker_id, now, row[0])
+        )
+        data_changed()
+        return _to_dict(conn.execute("SELECT * FROM jobs WHERE id=?", (row[0],)).fetchone())
+
+
+# The calls below only touch a job while `worker_id` still holds it: a
+# worker whose lease expired and whose job was re-claimed by another worker
+# must not finish, fail or renew it.
+
+# Stores a progress note on a running job; also renews its lease.
+# Returns False when the worker no longer holds the job.
+def update_job_progress(job_id, worker_id, progress):
+    updated = get_connection().execute(
+        "UPDATE jobs SET result=?, updated_at=? WHERE id=? AND worker=? AND status='running'",
+        (progress, time.time(), job_id, worker_id)
+    ).rowcount
+    data_changed()
+    return updated == 1
+
+
+# Marks a job as finished. Returns False when the worker no longer holds it.
+def complete_job(job_id, worker_id, result=None):
+    updated = get_connection().execute(
+        """UPDATE jobs SET status='done', result=?, error=NULL, updated_at=?
+           WHERE id=? AND worker=? AND status='running'""",
+        (result, time.time(), job_id, worker_id)
+    ).rowcount
+    data_changed()
+    return updated == 1
+
+
+# Records a failure. The job is retried with exponential backoff until
+# max_attempts, then dead-lettered (status 'dead') for inspection.
+# Returns the new status, or None when the worker no longer holds the job.
+def fail_job(job_id, worker_id, error):
+    now = time.time()
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT attempts, max_attempts FROM jobs WHERE id=? AND worker=? AND status='running'",
+            (job_id, worker_id)
+        ).fetchone()
+        if row is None:
+            return None
+        if row['attempts'] >= row['max_attempts']:
+            status, available_at = 'dead', now
+        else:
+            status, available_at = 'queued', now + RETRY_BASE_SECONDS * (2 ** (row['attempts'] - 1))
+        conn.execute(
+            "UPDATE jobs SET status=?, error=?, available_at=?, updated_at=? WHERE id=?",
+            (status, str(error)[:1000], available_at, now, job_id)
+        )
+        data_changed()
+        return status
+
+
+# Puts a dead-lettered job back in the queue with a fresh attempt budget
+def retry_dead_job(job_id):
+    get_connection().execute(
+        """UPDATE jobs SET status='queued', attempts=0, available_at=?, updated_at=?
+           WHERE id=? AND status='dead'""",
+        (time.time(), time.time(), job_id)
+    )
+    data_changed()
+
+
+# Fetches a job (payload decoded)
+def get_job(job_id):
+    return _to_dict(get_connection().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone())
+
+
+# {kind: status} of queued/running jobs for an email, for the UI to poll
+@cached_read
+def active_jobs_for_email(email_id):
+    rows = get_connection().execute(
+        "SELECT kind, status FROM jobs WHERE email_id=? AND status IN ('queued', 'running')",
+        (email_id,)
+    ).fetchall()
+    return {r['kind']: r['status'] for r in rows}
+
+
+# {kind: error} for kinds whose most recent job for this email was dead-lettered
+@cached_read
+def dead_jobs_for_email(email_id):
+    rows = get_connection().execute(
+        """SELECT kind, error FROM jobs j
+           WHERE email_id=? AND status='dead'
+             AND id = (SELECT MAX(id) FROM jobs WHERE email_id=j.email_id AND kind=j.kind)""",
+        (email_id,)
+    ).fetchall()
+    return {r['kind']: r['error'] for r in rows}
+
+
+# Most recent job of a kind (any status), e.g. the last batch auto-tag run
+@cached_read
+def latest_job(kind):
+    return _to_dict(get_connection().execute(
+        "SELECT * FROM jobs WHERE kind=? ORDER BY id DESC LIMIT 1", (kind,)
+    ).fetchone())
+
+
+# Job counts per status
+@cached_read
+def queue_stats():
+    rows = get_connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    stats = {status: 0 for status in ("queued", "running", "done", "dead")}
+    stats.update({r[0]: r[1] for r in rows})
+    return stats
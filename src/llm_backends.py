@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+# Model backends for LLMEngine. A backend turns a prompt into text:
+#   generate(prompt) -> str        stream(prompt) -> iterator of str chunks
+# and raises on failure (quota errors must mention 429/quota so
+# rate_limiter.is_quota_error recognises them). model_name keys the cache.
+#
+# LLM_BACKEND picks the default: "gemini" (live API), "fake" (offline,
+# deterministic) or "replay" (answers recorded in LLM_REPLAY_FILE).
+
+load_dotenv()
+
+# Configure Gemini
+api_key = os.getenv("GOOGLE_API_KEY")
+if api_key:
+    genai.configure(api_key=api_key)
+
+BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+GEMINI_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+
+FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "300"))
+FAKE_LATENCY_SIGMA = float(os.getenv("LLM_FAKE_LATENCY_SIGMA", "0.5"))
+FAKE_QUOTA_RATE = float(os.getenv("LLM_FAKE_QUOTA_RATE", "0"))
+FAKE_MALFORMED_RATE = float(os.getenv("LLM_FAKE_MALFORMED_RATE", "0"))
+FAKE_SEED = int(os.getenv("LLM_FAKE_SEED", "0"))
+REPLAY_FILE = os.getenv("LLM_REPLAY_FILE", "data/llm_replay.jsonl")
+
+
+class GeminiBackend:
+    def __init__(self, model_name=GEMINI_MODEL):
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
+
+
+# Offline stand-in with realistic failure modes. Latency is log-normal
+# (median latency_ms, spread sigma), a share of calls fails with a
+# Gemini-style 429 and a share of JSON answers comes back malformed.
+# Outcomes are derived from (seed, prompt, attempt number), not from call
+# order, so a run is reproducible however threads interleave.
+class FakeBackend:
+    model_name = "fake"
+
+    def __init__(self, latency_ms=FAKE_LATENCY_MS, sigma=FAKE_LATENCY_SIGMA, quota_rate=FAKE_QUOTA_RATE,
+                 malformed_rate=FAKE_MALFORMED_RATE, retry_after=0.1, seed=FAKE_SEED, sleep=True):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.quota_rate = quota_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.sleep = sleep
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "quota_errors": 0, "malformed": 0, "latency_seconds": 0.0}
+
+    def _rng(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.stats["calls"] += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    # The answer a well-behaved model would give to each LLMEngine prompt
+    @staticmethod
+    def answer(prompt):
+        echo = re.search(r"reply with only the word '([^']+)'", prompt, re.I)
+        if echo:
+            return echo.group(1)
+        ids = re.findall(r"Email id=(\d+)", prompt)
+        if ids:
+            return json.dumps([{"id": int(i), "category": FakeBackend._category(prompt, i)} for i in ids])
+        if "OUTPUT FORMAT" in prompt:
+            answer = {
+                "category": FakeBackend._category(prompt),
+                "action_items": "* Review the request\n* Reply by Friday",
+                "draft_reply": "Hi,\n\nThanks for your email. I will take a look and get back to you by Friday.\n\nBest regards",
+            }
+            return json.dumps({k: v for k, v in answer.items() if f'"{k}"' in prompt})
+        if "Return ONLY the category" in prompt:
+            return FakeBackend._category(prompt)
+        if "USER FEEDBACK" in prompt:
+            return "Hi,\n\nThanks, noted. I will follow up shortly.\n\nBest"
+        if "User Question" in prompt:
+            return "Based on your inbox, the most pressing item is the request due by Friday."
+        if "reply" in prompt.split("Email Data")[0].lower():
+            return "Hi,\n\nThanks for reaching out. I will get back to you by Friday.\n\nBest regards"
+        return "* Review the request\n* Reply by Friday"
+
+    # Keyword guess so categories vary with content (ids pick their own block)
+    @staticmethod
+    def _category(prompt, email_id=None):
+        text = prompt
+        if email_id is not None:
+            match = re.search(rf"Email id={email_id}\n(.*?)(?:\n---\n|$)", prompt, re.S)
+            text = match.group(1) if match else ""
+        text = text.lower()
+        for category, words in (("Urgent", ("urgent", "asap", "down", "incident")),
+                                ("Finance", ("invoice", "payment", "bill", "transaction")),
+                                ("Spam", ("won", "prize", "offer", "selected")),
+                                ("Newsletter", ("digest", "newsletter", "roundup", "week in")),
+                                ("Personal", ("dinner", "movie", "mom", "birthday"))):
+            if any(w in text for w in words):
+                return category
+        return "Work"
+
+    def _call(self, prompt):
+        rng = self._rng(prompt)
+        delay = self.latency_ms / 1000.0 * math.exp(rng.gauss(0.0, self.sigma))
+        with self._lock:
+            self.stats["latency_seconds"] += delay
+        if self.sleep:
+            time.sleep(delay)
+        if rng.random() < self.quota_rate:
+            with self._lock:
+                self.stats["quota_errors"] += 1
+            raise RuntimeError(f"429 Resource has been exhausted (e.g. check quota). Please retry in {self.retry_after}s")
+
+        text = self.answer(prompt)
+        if text.startswith(("[", "{")) and rng.random() < self.malformed_rate:
+            with self._lock:
+                self.stats["malformed"] += 1
+            text = text[:max(1, len(text) // 2)]
+        return text
+
+    def generate(self, prompt):
+        return self._call(prompt)
+
+    def stream(self, prompt):
+        for chunk in re.findall(r"\S+\s*", self._call(prompt)):
+            yield chunk
+
+
+# Replays answers recorded earlier (JSONL of {"key", "response"}, keyed by a
+# hash of the prompt). With `fallback` set, misses go to that backend and are
+# recorded, so a live session can be captured once and replayed offline.
+class ReplayBackend:
+    def __init__(self, path=REPLAY_FILE, fallback=None):
+        self.path = path
+        self.fallback = fallback
+        self.model_name = "replay"
+        self._lock = threading.Lock()
+        self._answers = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._answers[entry["key"]] = entry["response"]
+
+    @staticmethod
+    def key(prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def generate(self, prompt):
+        key = self.key(prompt)
+        if key in self._answers:
+            return self._answers[key]
+        if self.fallback is None:
+            raise LookupError(f"No recorded response for prompt {key[:12]}")
+        text = self.fallback.generate(prompt)
+        self._record(key, text)
+        return text
+
+    def stream(self, prompt):
+        yield self.generate(prompt)
+
+    def _record(self, key, text):
+        with self._lock:
+            self._answers[key] = text
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "response": text}) + "\n")
+
+
+# Backend named by `name` (default: LLM_BACKEND)
+def make_backend(name=None):
+    name = (name or BACKEND).lower()
+    if name == "fake":
+        return FakeBackend()
+    if name == "replay":
+        return ReplayBackend(fallback=GeminiBackend() if os.getenv("LLM_REPLAY_RECORD") == "1" else None)
+    if name == "gemini":
+        return GeminiBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
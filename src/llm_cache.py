@@ -0,0 +1,178 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from src.db_manager import DB_NAME, PRAGMAS
+
+# Cache lives next to the inbox database
+CACHE_DB = os.path.join(os.path.dirname(DB_NAME), "llm_cache.db")
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "0"))  # 0 = never expire
+CACHE_ENABLED = os.getenv("LLM_CACHE_DISABLED", "") == ""
+# hits between writes of their last_used times
+TOUCH_BATCH = int(os.getenv("LLM_CACHE_TOUCH_BATCH", "64"))
+
+
+# Key is a hash of (model, prompt): editing a prompt changes the key, so old entries simply stop matching
+def make_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+# Persistent LLM response cache with LRU eviction and optional TTL.
+# The app and worker.py share the file, so it uses WAL and a busy timeout
+# like the inbox database, and a database error never reaches the caller:
+# get() reports a miss and put()/delete() are skipped.
+# Hits only note their last_used time in memory; the notes are written in
+# one statement every TOUCH_BATCH hits and before each eviction.
+class ResponseCache:
+    def __init__(self, path=CACHE_DB, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, enabled=CACHE_ENABLED):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._conn = None
+        self._count = None
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    # Opens the cache database on first use
+    def _connection(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                last_used REAL
+            )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+            conn.commit()
+            self._count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    # Rolls back a failed write and counts it. Called with the lock held.
+    def _failed(self):
+        self.errors += 1
+        if self._conn is not None:
+            try:
+                self._conn.rollback()
+            except sqlite3.Error:
+                pass
+
+    # Writes the pending last_used notes. Called with the lock held.
+    def _flush_touches(self, conn):
+        if self._touched:
+            conn.executemany("UPDATE llm_cache SET last_used=? WHERE key=?",
+                             [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    # Returns the cached response or None
+    def get(self, model_name, prompt):
+        if not self.enabled:
+            return None
+        key = make_key(model_name, prompt)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+                if row and self.ttl and now - row[1] > self.ttl:
+                    deleted = conn.execute("DELETE FROM llm_cache WHERE key=?", (key,)).rowcount
+                    conn.commit()
+                    self._count -= deleted
+                    self._touched.pop(key, None)
+                    row = None
+                if row is not None:
+                    self._touched[key] = now
+                    if len(self._touched) >= TOUCH_BATCH:
+                        self._flush_touches(conn)
+                        conn.commit()
+            except sqlite3.Error:
+                self._failed()
+                self.misses += 1
+                return None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    # Stores a response and evicts the least recently used entries past max_entries
+    def put(self, model_name, prompt, response):
+        if not self.enabled or response is None:
+            return
+        key = make_key(model_name, prompt)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                existed = conn.execute("SELECT 1 FROM llm_cache WHERE key=?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, model_name, response, now, now)
+                )
+                self._touched.pop(key, None)
+                count = self._count + (0 if existed else 1)
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    self._flush_touches(conn)
+                    count -= conn.execute(
+                        "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)",
+                        (overflow,)
+                    ).rowcount
+                conn.commit()
+                self._count = count
+            except sqlite3.Error:
+                self._failed()
+
+    # Drops one cached response (e.g. an answer its caller rejected)
+    def delete(self, model_name, prompt):
+        if not self.enabled:
+            return
+        key = make_key(model_name, prompt)
+        with self._lock:
+            try:
+                conn = self._connection()
+                deleted = conn.execute("DELETE FROM llm_cache WHERE key=?", (key,)).rowcount
+                conn.commit()
+                self._count -= deleted
+                self._touched.pop(key, None)
+            except sqlite3.Error:
+                self._failed()
+
+    # Drops every cached response
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            self._count = 0
+            self._touched.clear()
+
+    # Hit/miss counters for the UI
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count or 0,
+            "errors": self.errors,
+            "enabled": self.enabled,
+        }
+
+
+# One cache per process, shared by every LLMEngine instance
+shared_cache = ResponseCache()
@@ -1,81 +1,485 @@
 import os
-import time
 import json
-import google.generativeai as genai
-from dotenv import load_dotenv
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.db_manager import FIELD_PROMPT_KEYS
+from src.llm_backends import make_backend
+from src.llm_cache import shared_cache
+from src.llm_metrics import shared_call_log, OK, QUOTA, ERROR, CIRCUIT_OPEN, INTERRUPTED
+from src.prompt_registry import compile_template, version_id
+from src.rate_limiter import (
+    shared_limiter, shared_breaker, estimate_tokens,
+    is_quota_error, parse_retry_after, backoff_delay
+)
 
-load_dotenv()
+# Batch tuning (overridable from .env)
+MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "4"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
 
-# Configure Gemini
-api_key = os.getenv("GOOGLE_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
+# Packed categorization: up to PACK_SIZE emails per prompt, capped by a token budget
+PACK_SIZE = int(os.getenv("LLM_PACK_SIZE", "10"))
+PACK_TOKEN_BUDGET = int(os.getenv("LLM_PACK_TOKEN_BUDGET", "6000"))
 
-class LLMEngine:
-    # Initializes the LLMEngine
-    def __init__(self):
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+# Fields produced by the consolidated insight call
+INSIGHT_FIELDS = ("category", "action_items", "draft_reply")
 
+CHAT_UNAVAILABLE = "I'm having trouble connecting right now."
 
-    # helper method to execute LLM API calls
-    def _call_llm_with_retry(self, prompt, retries=3):
-        base_delay = 2
-        
-        for attempt in range(retries):
-            try:
-                response = self.model.generate_content(prompt)
-                return response.text.strip()
-            except Exception as e:
-                error_str = str(e).lower()
-                if "429" in error_str or "quota" in error_str:
-                    if attempt < retries - 1:
-                        sleep_time = base_delay * (2 ** attempt) 
-                        time.sleep(sleep_time)
-                        continue
-                return None
-        return None
-    
-
-    # to categorize an email
-    def categorize_only(self, email_body, sender, subject, cat_prompt):
-        prompt = f"""
-        {cat_prompt}
+# Prompt templates, compiled per rule text by prompt_registry.compile_template
+CATEGORIZE_TEMPLATE = """
+        {rule}
         
         Email Data:
         From: {sender}
         Subject: {subject}
-        Body: {email_body[:1000]} 
+        Body: {body} 
         
         Output: Return ONLY the category name. No formatting.
         """
-        result = self._call_llm_with_retry(prompt)
-        return result if result else "Uncategorised"
-    
 
-    # consolidated API call
-    def generate_all_insights(self, email_body, sender, subject, prompts):
-        combined_prompt = f"""
+PACKED_TEMPLATE = """
+        {rule}
+
+        Classify EACH of the emails below independently.
+
+        {emails}
+
+        Output: Return ONLY a JSON array with one object per email, e.g.
+        [{{"id": 12, "category": "Work"}}, {{"id": 13, "category": "Spam"}}]
+        """
+
+INSIGHTS_TEMPLATE = """
         You are an intelligent email assistant. Process this email and return a JSON object.
         
-        1. CATEGORIZATION RULE: {prompts['categorize']}
-        2. EXTRACTION RULE: {prompts['extract']}
-        3. DRAFT RULE: {prompts['reply']}
+        {rule_lines}
         
         EMAIL CONTEXT:
         From: {sender}
         Subject: {subject}
-        Body: {email_body}
+        Body: {body}
         
         OUTPUT FORMAT:
         You must return valid JSON with these exact keys:
         {{
-            "category": "Category Name",
-            "action_items": "Bulleted list of items",
-            "draft_reply": "The email draft"
+            {example_lines}
         }}
         """
+
+CHAT_TEMPLATE = """
+        System: You are a helpful assistant having access to the emails in the user's inbox that are most relevant to the question.
+        Context: {context}
+        User Question: {query}
+        Answer:
+        """
+
+EMAIL_TEMPLATE = "{instructions}\n\n---\n\nEmail Data:\nFrom: {sender}\nSubject: {subject}\nBody: {body}"
+
+REFINE_TEMPLATE = """
+        ORIGINAL DRAFT:
+        {draft}
         
-        raw_response = self._call_llm_with_retry(combined_prompt)
+        USER FEEDBACK:
+        {feedback}
+        
+        TASK:
+        Rewrite the draft to satisfy the feedback. Keep the same tone unless asked to change.
+        Return ONLY the new draft text.
+        """
+
+INSIGHT_RULES = {
+    "category": "CATEGORIZATION RULE: ",
+    "action_items": "EXTRACTION RULE: ",
+    "draft_reply": "DRAFT RULE: ",
+}
+INSIGHT_EXAMPLES = {
+    "category": '"category": "Category Name"',
+    "action_items": '"action_items": "Bulleted list of items"',
+    "draft_reply": '"draft_reply": "The email draft"',
+}
+
+
+# Version id of the user prompts a call was built from (see prompt_registry)
+@functools.lru_cache(maxsize=256)
+def prompt_version(*texts):
+    return "+".join(version_id(t) for t in texts)
+
+
+# Consolidated-insights template for these rule texts and fields; the
+# numbered rules and JSON example are built once per combination
+@functools.lru_cache(maxsize=64)
+def _insights_template(rule_texts, fields):
+    rule_lines = "\n        ".join(
+        f"{i}. {INSIGHT_RULES[f]}{text}" for i, (f, text) in enumerate(zip(fields, rule_texts), start=1)
+    )
+    example_lines = ",\n            ".join(INSIGHT_EXAMPLES[f] for f in fields)
+    return compile_template(INSIGHTS_TEMPLATE, rule_lines=rule_lines, example_lines=example_lines)
+
+
+class LLMEngine:
+    # Initializes the LLMEngine
+    # backend: see src/llm_backends.py (default picked by LLM_BACKEND)
+    # call_log: where every call is recorded (see src/llm_metrics.py)
+    def __init__(self, limiter=None, cache=None, breaker=None, backend=None, call_log=None):
+        self.backend = backend or make_backend()
+        self.model_name = self.backend.model_name
+        self.limiter = limiter or shared_limiter
+        self.cache = cache or shared_cache
+        self.breaker = breaker or shared_breaker
+        self.call_log = call_log or shared_call_log
+        self.last_error = None
+        self.last_timing = None
+
+
+    # helper method to execute LLM API calls.
+    # Every call goes through the shared limiter and circuit breaker; on
+    # failure it returns None and leaves the reason in self.last_error.
+    # use_cache=False bypasses the response cache for this call
+    # method: the public method on whose behalf the call is made (metrics)
+    # version: prompt_version() of the user prompts it was built from (metrics)
+    def _call_llm_with_retry(self, prompt, retries=MAX_RETRIES, use_cache=True, method="call", version=None,
+                             validate=None):
+        start = time.monotonic()
+        if use_cache:
+            cached = self.cache.get(self.model_name, prompt)
+            if cached is not None and validate is not None and not validate(cached):
+                # stored before answers were validated: drop it and ask again
+                self.cache.delete(self.model_name, prompt)
+                cached = None
+            if cached is not None:
+                self._record(method, prompt, cached, start, 0, OK, cache_hit=True, version=version)
+                return cached
+
+        prompt_tokens = estimate_tokens(prompt)
+        for attempt in range(retries):
+            if not self._allow_call():
+                self._record(method, prompt, None, start, attempt, CIRCUIT_OPEN, version=version)
+                return None
+            try:
+                self.limiter.acquire(prompt_tokens)
+                text = self.backend.generate(prompt).strip()
+            except Exception as e:
+                if self._on_call_error(e, attempt, retries):
+                    continue
+                self._record(method, prompt, None, start, attempt, QUOTA if is_quota_error(e) else ERROR,
+                             version=version)
+                return None
+
+            # an answer the caller would reject is not worth replaying
+            self._on_call_success(prompt, text, use_cache and (validate is None or validate(text)))
+            self._record(method, prompt, text, start, attempt, OK, version=version)
+            return text
+        self._record_no_attempts(method, prompt, start, version=version)
+        return None
+
+    # Streaming counterpart of _call_llm_with_retry: yields text chunks as the
+    # model produces them. Attempts are retried only until the first chunk
+    # (after that the text is already on screen). on_complete(full_text) runs
+    # once the stream ended cleanly, so callers can persist the result.
+    # Time to first token / total time land in self.last_timing.
+    def _stream_llm(self, prompt, on_complete=None, retries=MAX_RETRIES, use_cache=True, method="stream",
+                    version=None):
+        start = time.monotonic()
+        self.last_timing = None
+        if use_cache:
+            cached = self.cache.get(self.model_name, prompt)
+            if cached is not None:
+                elapsed = time.monotonic() - start
+                self.last_timing = {"ttft": elapsed, "total": elapsed, "cached": True}
+                self._record(method, prompt, cached, start, 0, OK, cache_hit=True, ttft=elapsed, streamed=True,
+                             version=version)
+                yield cached
+                if on_complete:
+                    on_complete(cached)
+                return
+
+        prompt_tokens = estimate_tokens(prompt)
+        for attempt in range(retries):
+            if not self._allow_call():
+                self._record(method, prompt, None, start, attempt, CIRCUIT_OPEN, streamed=True, version=version)
+                return
+            parts, first_token_at = [], None
+            try:
+                self.limiter.acquire(prompt_tokens)
+                for text in self.backend.stream(prompt):
+                    if not text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    parts.append(text)
+                    yield text
+            except Exception as e:
+                if parts:
+                    self.breaker.record_success()
+                    self.breaker.record_gave_up()
+                    self.last_error = f"Stream interrupted: {e}"
+                    self._record(method, prompt, "".join(parts), start, attempt, INTERRUPTED,
+                                 ttft=first_token_at - start, streamed=True, version=version)
+                    return
+                if self._on_call_error(e, attempt, retries):
+                    continue
+                self._record(method, prompt, None, start, attempt, QUOTA if is_quota_error(e) else ERROR,
+                             streamed=True, version=version)
+                return
+
+            text = "".join(parts).strip()
+            self._on_call_success(prompt, text, use_cache)
+            end = time.monotonic()
+            self.last_timing = {
+                "ttft": (first_token_at or end) - start, "total": end - start, "cached": False
+            }
+            self._record(method, prompt, text, start, attempt, OK, ttft=self.last_timing["ttft"], streamed=True,
+                         version=version)
+            if text and on_complete:
+                on_complete(text)
+            return
+        self._record_no_attempts(method, prompt, start, streamed=True, version=version)
+
+    # Circuit check before an attempt; books the fast-fail when it is open
+    def _allow_call(self):
+        if self.breaker.allow():
+            return True
+        self.last_error = "LLM API saturated (circuit open)"
+        self.breaker.record_gave_up()
+        return False
+
+    # Books a failed attempt. Returns True when the call should be retried.
+    def _on_call_error(self, e, attempt, retries):
+        if is_quota_error(e):
+            retry_after = parse_retry_after(e)
+            self.breaker.record_failure(retry_after)
+            self.last_error = f"Quota exceeded: {e}"
+            if attempt < retries - 1:
+                # pauses every caller sharing the limiter, not just this one
+                self.limiter.on_throttled(backoff_delay(attempt, retry_after))
+                return True
+        else:
+            # the API answered, so it is not saturated
+            self.breaker.record_success()
+            self.last_error = f"LLM error: {e}"
+        self.breaker.record_gave_up()
+        return False
+
+    def _on_call_success(self, prompt, text, use_cache):
+        self.breaker.record_success()
+        self.limiter.on_success()
+        self.last_error = None
+        if use_cache:
+            self.cache.put(self.model_name, prompt, text)
+
+    # retries=0 allows no attempt; the call still gets its llm_calls row
+    def _record_no_attempts(self, method, prompt, start, streamed=False, version=None):
+        self.last_error = "LLM error: no attempts allowed (retries=0)"
+        self._record(method, prompt, None, start, 0, ERROR, streamed=streamed, version=version)
+
+    # One llm_calls row: latency is wall time since `start`, including
+    # limiter waits and backoff; retries is the number of failed attempts
+    def _record(self, method, prompt, response, start, retries, outcome, cache_hit=False, ttft=None,
+                streamed=False, version=None):
+        self.call_log.record(
+            method, self.model_name, estimate_tokens(prompt), estimate_tokens(response) if response else 0,
+            time.monotonic() - start, retries=retries, cache_hit=cache_hit, outcome=outcome,
+            error=None if outcome == OK else self.last_error, ttft=ttft, streamed=streamed,
+            prompt_version=version,
+        )
+
+    # limiter + breaker counters for the UI
+    def metrics(self):
+        data = self.limiter.metrics()
+        data.update(self.breaker.metrics())
+        return data
+    
+
+    # builds the categorization prompt for a single email
+    def _categorize_prompt(self, email_body, sender, subject, cat_prompt):
+        return compile_template(CATEGORIZE_TEMPLATE, rule=cat_prompt).render(
+            sender=sender, subject=subject, body=email_body[:1000]
+        )
+
+    # to categorize an email (None if the API call failed)
+    def categorize_only(self, email_body, sender, subject, cat_prompt):
+        prompt = self._categorize_prompt(email_body, sender, subject, cat_prompt)
+        return self._call_llm_with_retry(prompt, method="categorize_only", version=prompt_version(cat_prompt))
+
+    # builds one prompt that asks for the category of every email in the pack
+    def _packed_prompt(self, emails, cat_prompt):
+        blocks = []
+        for e in emails:
+            blocks.append(
+                f"Email id={e['id']}\nFrom: {e['sender']}\nSubject: {e['subject']}\nBody: {(e['body'] or '')[:1000]}"
+            )
+        return compile_template(PACKED_TEMPLATE, rule=cat_prompt).render(emails="\n---\n".join(blocks))
+
+    # splits emails into packs of at most pack_size that fit the token budget
+    def _make_packs(self, emails, cat_prompt, pack_size, token_budget):
+        packs, current = [], []
+        used = base = estimate_tokens(cat_prompt) + 60
+        for e in emails:
+            cost = estimate_tokens((e['body'] or "")[:1000]) + estimate_tokens(f"{e['sender']} {e['subject']}") + 10
+            if current and (len(current) >= pack_size or used + cost > token_budget):
+                packs.append(current)
+                current, used = [], base
+            current.append(e)
+            used += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    # parses a packed response into {email_id: category}, keeping only valid entries
+    def _parse_packed(self, raw_response, emails):
+        wanted = {str(e['id']): e['id'] for e in emails}
+        try:
+            clean_json = raw_response.replace("```json", "").replace("```", "").strip()
+            data = json.loads(clean_json)
+        except (json.JSONDecodeError, AttributeError):
+            return {}
+        if not isinstance(data, list):
+            return {}
+
+        parsed = {}
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            key = str(item.get("id", "")).strip()
+            category = item.get("category")
+            if key in wanted and isinstance(category, str) and category.strip():
+                parsed[wanted[key]] = category.strip()
+        return parsed
+
+    # categorizes a pack in one call; only the ids missing from a malformed
+    # answer are re-split and retried, down to single-email prompts
+    def categorize_packed(self, emails, cat_prompt):
+        emails = list(emails)
+        if not emails:
+            return {}
+        if len(emails) == 1:
+            e = emails[0]
+            return {e['id']: self._call_llm_with_retry(
+                self._categorize_prompt(e['body'] or "", e['sender'], e['subject'], cat_prompt),
+                method="categorize_packed", version=prompt_version(cat_prompt)
+            )}
+
+        # only an answer covering every email is cached
+        raw_response = self._call_llm_with_retry(
+            self._packed_prompt(emails, cat_prompt), method="categorize_packed", version=prompt_version(cat_prompt),
+            validate=lambda text: len(self._parse_packed(text, emails)) == len(emails)
+        )
+        if raw_response is None:
+            # API failure, not a bad answer: splitting would only multiply requests
+            return {e['id']: None for e in emails}
+
+        results = self._parse_packed(raw_response, emails)
+        failed = [e for e in emails if e['id'] not in results]
+        if failed:
+            mid = (len(failed) + 1) // 2
+            results.update(self.categorize_packed(failed[:mid], cat_prompt))
+            results.update(self.categorize_packed(failed[mid:], cat_prompt))
+        return results
+
+    # categorizes many emails through a bounded worker pool.
+    # emails: iterable of dicts with id/body/sender/subject
+    # pack_size > 1 puts several emails in each request (see categorize_packed)
+    # on_result(email_id, category, done, total) fires as each result arrives
+    # Failed calls map to None so callers can leave those rows untagged.
+    def categorize_batch(self, emails, cat_prompt, max_workers=None, on_result=None,
+                         pack_size=None, token_budget=None):
+        emails = list(emails)
+        results = {}
+        if not emails:
+            return results
+
+        pack_size = PACK_SIZE if pack_size is None else pack_size
+        packs = self._make_packs(emails, cat_prompt, max(pack_size, 1), token_budget or PACK_TOKEN_BUDGET)
+        total = len(emails)
+
+        with ThreadPoolExecutor(max_workers=max_workers or MAX_WORKERS) as pool:
+            futures = {pool.submit(self.categorize_packed, pack, cat_prompt): pack for pack in packs}
+            for future in as_completed(futures):
+                try:
+                    pack_results = future.result()
+                except Exception:
+                    pack_results = {}
+                for e in futures[future]:
+                    category = pack_results.get(e['id'])
+                    results[e['id']] = category
+                    if on_result:
+                        on_result(e['id'], category, len(results), total)
+        return results
+    
+
+    # builds the consolidated prompt for the requested fields
+    def _insights_prompt(self, email_body, sender, subject, prompts, fields=INSIGHT_FIELDS):
+        return _insights_template(
+            tuple(prompts[FIELD_PROMPT_KEYS[f]] for f in fields), tuple(fields)
+        ).render(sender=sender, subject=subject, body=email_body)
+
+    # prompt_version() of the user prompts behind `fields`
+    @staticmethod
+    def _insights_version(prompts, fields=INSIGHT_FIELDS):
+        return prompt_version(*(prompts[FIELD_PROMPT_KEYS[f]] for f in fields))
+
+    # Checks a consolidated answer against INSIGHT_FIELDS and returns only the
+    # valid fields: non-empty strings (lists of items are joined as bullets),
+    # and a category that is a short single line.
+    @staticmethod
+    def _validate_insights(raw_response):
+        if not raw_response:
+            return {}
+        start, end = raw_response.find("{"), raw_response.rfind("}")
+        try:
+            data = json.loads(raw_response[start:end + 1])
+        except (json.JSONDecodeError, ValueError):
+            return {}
+        if not isinstance(data, dict):
+            return {}
+
+        valid = {}
+        for field in INSIGHT_FIELDS:
+            value = data.get(field)
+            if isinstance(value, list):
+                value = "\n".join(f"* {item}" for item in value if str(item).strip())
+            if not isinstance(value, str) or not value.strip():
+                continue
+            value = value.strip()
+            if field == "category" and ("\n" in value or len(value) > 50):
+                continue
+            valid[field] = value
+        return valid
+
+    # Produces the requested insight fields with one consolidated call; only
+    # fields missing or invalid in that answer are re-requested one by one.
+    # Returns {field: text} for every field that could be produced.
+    def generate_insights_validated(self, email_body, sender, subject, prompts, fields=INSIGHT_FIELDS):
+        fields = [f for f in INSIGHT_FIELDS if f in fields]
+        results = {}
+        if len(fields) > 1:
+            # only an answer with every requested field valid is cached
+            raw_response = self._call_llm_with_retry(
+                self._insights_prompt(email_body, sender, subject, prompts, fields),
+                method="generate_insights_validated", version=self._insights_version(prompts, fields),
+                validate=lambda text: set(fields) <= set(self._validate_insights(text))
+            )
+            results = {f: v for f, v in self._validate_insights(raw_response).items() if f in fields}
+
+        single_calls = {
+            "category": lambda: self.categorize_only(email_body, sender, subject, prompts['categorize']),
+            "action_items": lambda: self.extract_only(email_body, sender, subject, prompts['extract']),
+            "draft_reply": lambda: self.draft_only(email_body, sender, subject, prompts['reply']),
+        }
+        for field in fields:
+            if field not in results:
+                value = single_calls[field]()
+                if value:
+                    results[field] = value
+        return results
+
+    # consolidated API call
+    def generate_all_insights(self, email_body, sender, subject, prompts):
+        combined_prompt = self._insights_prompt(email_body, sender, subject, prompts)
+        
+        raw_response = self._call_llm_with_retry(
+            combined_prompt, method="generate_all_insights", version=self._insights_version(prompts)
+        )
         
         if not raw_response:
             return "Error", "API Error", "Could not process."
@@ -88,38 +492,57 @@ class LLMEngine:
             return "Parsing Error", raw_response, "Error parsing AI response."
         
     # agent logic
+    def _chat_prompt(self, user_query, context):
+        return compile_template(CHAT_TEMPLATE).render(context=context, query=user_query)
+
     def chat_with_inbox(self, user_query, context):
-        prompt = f"""
-        System: You are a helpful assistant having access to an email inbox summary.
-        Context: {context}
-        User Question: {user_query}
-        Answer:
-        """
-        return self._call_llm_with_retry(prompt) or "I'm having trouble connecting right now."
+        return self._call_llm_with_retry(
+            self._chat_prompt(user_query, context), method="chat_with_inbox"
+        ) or CHAT_UNAVAILABLE
+
+    # Streams the chat answer; falls back to the apology if nothing arrived
+    def chat_stream(self, user_query, context, on_complete=None):
+        produced = False
+        for chunk in self._stream_llm(self._chat_prompt(user_query, context), on_complete, method="chat_stream"):
+            produced = True
+            yield chunk
+        if not produced:
+            yield CHAT_UNAVAILABLE
+
+    # prompt for the per-email instructions (extract / draft)
+    def _email_prompt(self, instructions, email_body, sender, subject):
+        return compile_template(EMAIL_TEMPLATE, instructions=instructions).render(
+            sender=sender, subject=subject, body=email_body
+        )
     
     # Extracts action items specifically
     def extract_only(self, email_body, sender, subject, act_prompt):
-        prompt = f"{act_prompt}\n\n---\n\nEmail Data:\nFrom: {sender}\nSubject: {subject}\nBody: {email_body}"
-        return self._call_llm_with_retry(prompt)
+        return self._call_llm_with_retry(
+            self._email_prompt(act_prompt, email_body, sender, subject), method="extract_only",
+            version=prompt_version(act_prompt)
+        )
 
     # only draft
     def draft_only(self, email_body, sender, subject, rep_prompt):
-        prompt = f"{rep_prompt}\n\n---\n\nEmail Data:\nFrom: {sender}\nSubject: {subject}\nBody: {email_body}"
-        return self._call_llm_with_retry(prompt)
+        return self._call_llm_with_retry(
+            self._email_prompt(rep_prompt, email_body, sender, subject), method="draft_only",
+            version=prompt_version(rep_prompt)
+        )
+
+    # draft, streamed chunk by chunk
+    def draft_stream(self, email_body, sender, subject, rep_prompt, on_complete=None):
+        return self._stream_llm(
+            self._email_prompt(rep_prompt, email_body, sender, subject), on_complete, method="draft_stream",
+            version=prompt_version(rep_prompt)
+        )
     
+    def _refine_prompt(self, current_draft, feedback):
+        return compile_template(REFINE_TEMPLATE).render(draft=current_draft, feedback=feedback)
+
     # refine logic
     def refine_reply(self, current_draft, feedback):
-        prompt = f"""
-        ORIGINAL DRAFT:
-        {current_draft}
-        
-        USER FEEDBACK:
-        {feedback}
-        
-        TASK:
-        Rewrite the draft to satisfy the feedback. Keep the same tone unless asked to change.
-        Return ONLY the new draft text.
-        """
-        return self._call_llm_with_retry(prompt)
-    
-    
\ No newline at end of file
+        return self._call_llm_with_retry(self._refine_prompt(current_draft, feedback), method="refine_reply")
+
+    # refined draft, streamed chunk by chunk
+    def refine_stream(self, current_draft, feedback, on_complete=None):
+        return self._stream_llm(self._refine_prompt(current_draft, feedback), on_complete, method="refine_stream")
@@ -0,0 +1,173 @@
+import os
+import time
+import sqlite3
+import pandas as pd
+from src.db_manager import get_connection, cached_read, data_changed
+
+# Per-call LLM instrumentation. LLMEngine records one row in llm_calls for
+# every call it makes (including cache hits and calls that gave up), and the
+# Stats tab summarizes them. Token counts are estimates (estimate_tokens).
+
+METRICS_ENABLED = os.getenv("LLM_METRICS_DISABLED", "") == ""
+
+# USD per million tokens, for the spend estimate (defaults: Gemini 2.5 Flash)
+PRICE_INPUT_PER_M = float(os.getenv("LLM_PRICE_INPUT_PER_M", "0.30"))
+PRICE_OUTPUT_PER_M = float(os.getenv("LLM_PRICE_OUTPUT_PER_M", "2.50"))
+
+# outcome values
+OK = "ok"
+QUOTA = "quota"
+ERROR = "error"
+CIRCUIT_OPEN = "circuit_open"
+INTERRUPTED = "interrupted"
+
+CALL_COLUMNS = ("created_at", "method", "model", "prompt_tokens", "response_tokens", "latency_ms",
+                "ttft_ms", "retries", "cache_hit", "streamed", "outcome", "error", "prompt_version")
+
+
+# Writes call records to the inbox database. A failed write never breaks
+# the LLM call it describes.
+class CallLog:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+
+    def record(self, method, model, prompt_tokens, response_tokens, latency, retries=0, cache_hit=False,
+               outcome=OK, error=None, ttft=None, streamed=False, prompt_version=None):
+        if not self.enabled:
+            return
+        values = (
+            time.time(), method, model, prompt_tokens, response_tokens, latency * 1000.0,
+            None if ttft is None else ttft * 1000.0, retries, int(cache_hit), int(streamed), outcome,
+            (error or "")[:500] or None, prompt_version,
+        )
+        try:
+            get_connection().execute(
+                f"INSERT INTO llm_calls ({', '.join(CALL_COLUMNS)}) VALUES ({', '.join('?' * len(CALL_COLUMNS))})",
+                values
+            )
+            data_changed()
+        except sqlite3.Error:
+            pass
+
+
+# One log per process, shared by every LLMEngine instance
+shared_call_log = CallLog()
+
+
+# Every query below is limited to calls in the last `seconds` (all of them
+# if None) and aggregated in SQL, so the Stats tab never loads the raw log;
+# results are cached until the next write.
+def _window(seconds):
+    if seconds:
+        return "created_at >= ?", [time.time() - seconds]
+    return "1", []
+
+
+# Totals per group. Latency percentiles cover answered calls that reached
+# the API (cache hits would drag them towards zero) and are nearest-rank;
+# tokens and spend count answered, uncached calls only.
+_TOTALS = """COUNT(*) AS calls,
+             SUM(cache_hit = 0) AS api_calls,
+             AVG(cache_hit) AS cache_hit_rate,
+             SUM(cache_hit = 0 AND outcome != 'ok') AS errors,
+             IFNULL(SUM(CASE WHEN cache_hit = 0 THEN retries END), 0) AS retries,
+             IFNULL(SUM(CASE WHEN cache_hit = 0 AND outcome = 'ok' THEN prompt_tokens END), 0) AS prompt_tokens,
+             IFNULL(SUM(CASE WHEN cache_hit = 0 AND outcome = 'ok' THEN response_tokens END), 0) AS response_tokens,
+             MIN(created_at) AS first_at, MAX(created_at) AS last_at"""
+
+
+# One row per group: keys [(sql expression, column name)], plus _TOTALS,
+# p50_ms, p95_ms, error_rate and cost_usd
+def _grouped(seconds, keys, where="1"):
+    window, params = _window(seconds)
+    where = f"{window} AND {where}"
+    names = ", ".join(name for _, name in keys)
+    select = ", ".join(f"{expr} AS {name}" for expr, name in keys)
+    partition = ", ".join(expr for expr, _ in keys)
+    conn = get_connection()
+    totals = pd.read_sql(
+        f"SELECT {select}, {_TOTALS} FROM llm_calls WHERE {where} GROUP BY {names}", conn, params=params
+    )
+    latency = pd.read_sql(
+        f"""SELECT {names}, MIN(CASE WHEN pos >= 0.5 * n THEN latency_ms END) AS p50_ms,
+                   MIN(CASE WHEN pos >= 0.95 * n THEN latency_ms END) AS p95_ms
+            FROM (SELECT {select}, latency_ms,
+                         ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY latency_ms) AS pos,
+                         COUNT(*) OVER (PARTITION BY {partition}) AS n
+                  FROM llm_calls WHERE {where} AND cache_hit = 0 AND outcome = 'ok')
+            GROUP BY {names}""",
+        conn, params=params
+    )
+    rows = totals.merge(latency, on=[name for _, name in keys], how="left")
+    rows["error_rate"] = (rows["errors"] / rows["api_calls"]).where(rows["api_calls"] > 0, 0.0)
+    rows["cost_usd"] = (rows["prompt_tokens"] * PRICE_INPUT_PER_M
+                        + rows["response_tokens"] * PRICE_OUTPUT_PER_M) / 1e6
+    return rows
+
+
+# Headline numbers for the window
+@cached_read
+def summarize(seconds=None):
+    rows = _grouped(seconds, [("'all'", "scope")])
+    if rows.empty:
+        return {"calls": 0, "api_calls": 0, "cache_hit_rate": 0.0, "error_rate": 0.0, "retries": 0,
+                "p50_ms": None, "p95_ms": None, "calls_per_min": 0.0, "prompt_tokens": 0,
+                "response_tokens": 0, "cost_usd": 0.0}
+    row = rows.iloc[0]
+    span = row["last_at"] - row["first_at"]
+    return {
+        "calls": int(row["calls"]),
+        "api_calls": int(row["api_calls"]),
+        "cache_hit_rate": float(row["cache_hit_rate"]),
+        "error_rate": float(row["error_rate"]),
+        "retries": int(row["retries"]),
+        "p50_ms": None if pd.isna(row["p50_ms"]) else float(row["p50_ms"]),
+        "p95_ms": None if pd.isna(row["p95_ms"]) else float(row["p95_ms"]),
+        "calls_per_min": row["calls"] / (span / 60.0) if span else float(row["calls"]),
+        "prompt_tokens": int(row["prompt_tokens"]),
+        "response_tokens": int(row["response_tokens"]),
+        "cost_usd": float(row["cost_usd"]),
+    }
+
+
+BREAKDOWN_COLUMNS = ["calls", "cache_hit_rate", "error_rate", "retries", "p50_ms", "p95_ms",
+                     "prompt_tokens", "response_tokens", "cost_usd"]
+
+
+# Per-method breakdown, busiest method first
+@cached_read
+def by_method(seconds=None):
+    rows = _grouped(seconds, [("method", "method")])
+    return rows[["method"] + BREAKDOWN_COLUMNS].sort_values("calls", ascending=False)
+
+
+# Per (method, prompt version) breakdown: how each saved prompt text performed
+@cached_read
+def by_prompt_version(seconds=None):
+    rows = _grouped(seconds, [("method", "method"), ("prompt_version", "prompt_version")],
+                    "prompt_version IS NOT NULL")
+    return rows[["method", "prompt_version"] + BREAKDOWN_COLUMNS].sort_values("calls", ascending=False)
+
+
+# Time series per `freq` bucket (pandas offset alias, e.g. "5min", "1h"):
+# calls, errors, p50/p95 latency of answered API calls, tokens and spend
+@cached_read
+def over_time(seconds, freq):
+    width = pd.Timedelta(freq).total_seconds()
+    rows = _grouped(seconds, [(f"CAST(created_at / {width} AS INTEGER)", "bucket")])
+    rows.index = pd.DatetimeIndex(pd.to_datetime(rows["bucket"] * width, unit="s"), name=None)
+    rows["tokens"] = rows["prompt_tokens"] + rows["response_tokens"]
+    return rows[["calls", "errors", "p50_ms", "p95_ms", "tokens", "cost_usd"]]
+
+
+# The most recent failed calls in the window, newest first
+@cached_read
+def recent_failures(seconds=None, limit=20):
+    window, params = _window(seconds)
+    failures = pd.read_sql(
+        f"""SELECT created_at, method, outcome, retries, latency_ms, error FROM llm_calls
+            WHERE {window} AND outcome != 'ok' ORDER BY created_at DESC LIMIT ?""",
+        get_connection(), params=params + [limit]
+    )
+    failures["created_at"] = pd.to_datetime(failures["created_at"], unit="s")
+    return failures
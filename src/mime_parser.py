@@ -0,0 +1,171 @@
+import re
+import base64
+import binascii
+import quopri
+import hashlib
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+
+# Most body text kept per email; the rest of the part is read and dropped
+MAX_BODY_BYTES = 65536
+
+# compat32 headers: raw strings, far cheaper than the header registry;
+# only From/Subject need RFC 2047 decoding
+_header_parser = BytesHeaderParser()
+
+
+# Collects header lines up to the blank line that ends them
+def _read_headers(lines):
+    raw = []
+    for line in lines:
+        if not line.strip():
+            break
+        raw.append(line)
+    return _header_parser.parsebytes(b"".join(raw))
+
+
+# Incremental Content-Transfer-Encoding decoder for one part
+class _PartDecoder:
+    def __init__(self, encoding, limit):
+        self.encoding = (encoding or "7bit").strip().lower()
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self._b64_pending = b""
+
+    @property
+    def full(self):
+        return self.size >= self.limit
+
+    def feed(self, line):
+        if self.full:
+            return
+        if self.encoding == "base64":
+            data = self._b64_pending + re.sub(rb"[^A-Za-z0-9+/=]", b"", line)
+            usable = len(data) - len(data) % 4
+            self._b64_pending = data[usable:]
+            try:
+                decoded = base64.b64decode(data[:usable])
+            except binascii.Error:
+                decoded = b""
+        elif self.encoding == "quoted-printable":
+            decoded = quopri.decodestring(line)
+        else:
+            decoded = line
+        self.chunks.append(decoded[:self.limit - self.size])
+        self.size += len(self.chunks[-1])
+
+    def text(self, charset):
+        data = b"".join(self.chunks)
+        try:
+            return data.decode(charset or "utf-8", errors="replace")
+        except LookupError:
+            return data.decode("utf-8", errors="replace")
+
+
+# Walks one MIME part from the line iterator. Keeps the first text/plain and
+# first text/html leaf in `found`; every other part streams past unbuffered.
+# Returns the outer boundary line that ended the part (None at end of input).
+def _walk(lines, headers, delimiters, found, limit):
+    content_type = headers.get_content_type()
+
+    if content_type.startswith("multipart/"):
+        boundary = headers.get_param("boundary")
+        if not boundary:
+            return _skip(lines, delimiters)
+        marker = b"--" + str(boundary).encode("ascii", "replace")
+        inner = delimiters + [marker]
+        ended = _skip(lines, inner)  # preamble
+        while ended == marker:
+            ended = _walk(lines, _read_headers(lines), inner, found, limit)
+        if ended == marker + b"--":
+            ended = _skip(lines, delimiters)  # epilogue
+        return ended
+
+    wanted = content_type in ("text/plain", "text/html") and content_type not in found
+    if headers.get_content_disposition() == "attachment":
+        wanted = False
+    if not wanted:
+        return _skip(lines, delimiters)
+
+    decoder = _PartDecoder(headers.get("Content-Transfer-Encoding"), limit)
+    ended = None
+    for line in lines:
+        if _is_delimiter(line, delimiters):
+            ended = line.rstrip()
+            break
+        decoder.feed(line)
+    found[content_type] = decoder.text(headers.get_content_charset())
+    return ended
+
+
+def _is_delimiter(line, delimiters):
+    if not line.startswith(b"--"):
+        return False
+    line = line.rstrip()
+    return any(line == d or line == d + b"--" for d in delimiters)
+
+
+# Discards lines until one of the boundaries
+def _skip(lines, delimiters):
+    for line in lines:
+        if delimiters and _is_delimiter(line, delimiters):
+            return line.rstrip()
+    return None
+
+
+def _html_to_text(html):
+    html = re.sub(r"(?is)<(script|style).*?</\1>", " ", html)
+    text = re.sub(r"<[^>]+>", " ", html)
+    return re.sub(r"[ \t]+", " ", text).strip()
+
+
+def _decoded(value):
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(str(value)))).strip()
+    except (ValueError, LookupError):
+        return str(value).strip()
+
+
+def _received_at(headers):
+    try:
+        return parsedate_to_datetime(str(headers["Date"])).strftime("%Y-%m-%d %H:%M")
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+# Parses one RFC 822 message from a binary line iterator (an open file,
+# io.BytesIO, a partial IMAP fetch...) in a single pass. Only the headers and
+# the first readable text part are kept, capped at max_body_bytes, so large
+# attachments are never held in memory. Truncated input is fine.
+# Returns a dict shaped for db_manager.insert_emails.
+def parse_message(lines, max_body_bytes=MAX_BODY_BYTES):
+    lines = iter(lines)
+    headers = _read_headers(lines)
+    found = {}
+    _walk(lines, headers, [], found, max_body_bytes)
+
+    body = found.get("text/plain")
+    if body is None and "text/html" in found:
+        body = _html_to_text(found["text/html"])
+
+    message_id = str(headers["Message-ID"] or "").strip() or None
+    email = {
+        "sender": _decoded(headers["From"]),
+        "subject": _decoded(headers["Subject"]),
+        "body": (body or "").replace("\r\n", "\n").strip(),
+        "received_at": _received_at(headers),
+        "message_id": message_id,
+    }
+    if message_id is None:
+        email["message_id"] = synthetic_message_id(email)
+    return email
+
+
+# Stable stand-in id for mail without a Message-ID header, so re-imports dedupe
+def synthetic_message_id(email):
+    key = "\x00".join(str(email.get(k) or "") for k in ("sender", "subject", "received_at", "body"))
+    return f"<{hashlib.sha1(key.encode('utf-8')).hexdigest()}@local>"
@@ -0,0 +1,141 @@
+import os
+from src import dedupe
+from src.db_manager import get_email_by_id, update_email_ai_data, FIELD_PROMPT_KEYS
+from src.job_queue import enqueue_job
+from src.llm_engine import INSIGHT_FIELDS
+from src.preclassifier import shared_preclassifier
+from src.prompt_manager import PromptManager
+from src.prompt_registry import version_id
+
+# Queue the insight stage automatically for every newly ingested email
+AUTO_ANALYZE = os.getenv("AUTO_ANALYZE_NEW_EMAILS", "1") != "0"
+
+
+# The three user prompts in the shape LLMEngine expects
+def current_prompts():
+    return {
+        'categorize': PromptManager.get_categorization_prompt(),
+        'extract': PromptManager.get_extraction_prompt(),
+        'reply': PromptManager.get_reply_prompt(),
+    }
+
+
+# {field: version id of the prompt it is generated from}, stored next to
+# each field so reprocess.py can tell which rows a prompt change made stale
+def field_versions(prompts, fields=INSIGHT_FIELDS):
+    return {f: version_id(prompts[FIELD_PROMPT_KEYS[f]]) for f in fields}
+
+
+# Categorizes emails with the local pre-classifier in front of the LLM:
+# emails whose near duplicate or thread already has a category from this
+# prompt reuse it, only one email per near-duplicate cluster is classified
+# (the others copy its answer), emails the pre-classifier is sure about are
+# labelled locally and the rest go through categorize_batch (whose answers
+# also train it). on_result as in categorize_batch, counting every kind.
+# Returns {email_id: category or None}.
+def categorize_emails(emails, cat_prompt, llm, on_result=None):
+    emails = list(emails)
+    total = len(emails)
+    results = {}
+    reuses = []
+
+    def emit(email_id, category):
+        results[email_id] = category
+        if on_result:
+            on_result(email_id, category, len(results), total)
+
+    shared = dedupe.find_shared([e['id'] for e in emails], {"category": version_id(cat_prompt)})
+    pending = []
+    for email in emails:
+        reuse = shared.get(email['id'], {}).get("category")
+        if reuse:
+            reuses.append((email['id'], "category", reuse))
+            emit(email['id'], reuse["value"])
+        else:
+            pending.append(email)
+
+    members = {}
+    clusters = dedupe.clusters_of([e['id'] for e in pending])
+    for email in pending:
+        members.setdefault(clusters[email['id']], []).append(email)
+    leaders = [group[0] for group in members.values()]
+
+    def fan_out(email_id, category):
+        emit(email_id, category)
+        for follower in members[clusters[email_id]][1:]:
+            reuses.append((follower['id'], "category",
+                           {"source_id": email_id, "kind": dedupe.NEAR_DUPLICATE, "distance": None}))
+            emit(follower['id'], category)
+
+    def on_llm_result(email_id, category, done, llm_total):
+        fan_out(email_id, category)
+
+    local, escalate = shared_preclassifier.split(leaders, cat_prompt)
+    for email_id, category in local.items():
+        fan_out(email_id, category)
+    answers = llm.categorize_batch(escalate, cat_prompt, on_result=on_llm_result)
+    shared_preclassifier.record_llm(escalate, answers)
+    dedupe.record_shared([r for r in reuses if results.get(r[0])])
+    return results
+
+
+# categorize_emails for one email, with a single-email LLM call
+def categorize_one(email, cat_prompt, llm):
+    reuse = dedupe.find_shared([email['id']], {"category": version_id(cat_prompt)}).get(email['id'], {})
+    if reuse:
+        dedupe.record_shared([(email['id'], "category", reuse["category"])])
+        return reuse["category"]["value"]
+    local, escalate = shared_preclassifier.split([email], cat_prompt)
+    if not escalate:
+        return local[email['id']]
+    category = llm.categorize_only(email['body'] or "", email['sender'], email['subject'], cat_prompt)
+    shared_preclassifier.record_llm(escalate, {email['id']: category})
+    return category
+
+
+# Insight stage for one email: asks for whichever of category / action items /
+# draft are still empty in ~1 consolidated call (fields that come back invalid
+# are re-requested alone), then persists all three with a single write.
+# Fields a near duplicate or thread mate already has from the current prompts
+# are copied, and a category the pre-classifier is sure about is not asked for.
+# Returns the fields that were produced.
+def process_email_insights(email_id, llm, prompts=None):
+    email = get_email_by_id(email_id)
+    if email is None:
+        return {}
+    missing = [f for f in INSIGHT_FIELDS if not (email[f] or "").strip()]
+    if not missing:
+        return {}
+
+    prompts = prompts or current_prompts()
+    local = {}
+    shareable = [f for f in missing if f in dedupe.SHARE_FIELDS]
+    shared = dedupe.find_shared([email_id], field_versions(prompts, shareable)).get(email_id, {})
+    for field, reuse in shared.items():
+        local[field] = reuse["value"]
+        missing.remove(field)
+    if "category" in missing:
+        decided, _ = shared_preclassifier.split([email], prompts['categorize'])
+        if decided:
+            local["category"] = decided[email_id]
+            missing.remove("category")
+    produced = {}
+    if missing:
+        produced = llm.generate_insights_validated(
+            email['body'] or "", email['sender'], email['subject'], prompts, missing
+        )
+    if produced.get("category"):
+        shared_preclassifier.record_llm([email], {email_id: produced["category"]})
+    produced.update(local)
+    dedupe.record_shared([(email_id, field, reuse) for field, reuse in shared.items()])
+    if produced:
+        merged = {f: produced.get(f, email[f]) for f in INSIGHT_FIELDS}
+        update_email_ai_data(email_id, merged['category'], merged['action_items'], merged['draft_reply'],
+                             field_versions(prompts, produced))
+    return produced
+
+
+# Ingestion hook: queues the insight stage for new emails (one job each)
+def enqueue_insights(email_ids, prompts=None):
+    payload = {"prompts": prompts} if prompts else None
+    return [enqueue_job("insights", email_id, payload) for email_id in email_ids]
@@ -0,0 +1,307 @@
+import os
+import re
+import math
+import time
+import zlib
+import threading
+from src.db_manager import get_connection, transaction, cached_read, data_changed
+
+# Local categorization tier that runs before the LLM. Three tiers, cheapest
+# first:
+#   rule       sender address / domain rules (billing@, newsletter@, ...)
+#   heuristic  subject / body signals (URGENT: ..., an unsubscribe footer)
+#   model      multinomial naive Bayes on hashed features (sender, domain,
+#              subject and body words), trained incrementally from the
+#              categories the LLM assigned; counts live in SQLite
+# An email is decided locally only when a tier is at least MIN_CONFIDENCE
+# sure of a category the categorize prompt allows; everything else goes to
+# the LLM. Every decision is logged in precls_decisions together with the
+# LLM's answer when there is one (escalated emails, plus one in AUDIT_EVERY
+# local decisions sent to the LLM anyway), so report() can give the hit
+# rate and the agreement with the LLM per tier and per confidence band.
+
+PRECLASSIFIER_ENABLED = os.getenv("PRECLASSIFIER_DISABLED", "") == ""
+MIN_CONFIDENCE = float(os.getenv("PRECLASSIFIER_MIN_CONFIDENCE", "0.95"))
+# the model only speaks once it has learned from this many emails
+MIN_TRAINING_DOCS = int(os.getenv("PRECLASSIFIER_MIN_DOCS", "50"))
+# one in N local decisions is checked against the LLM (0 = never)
+AUDIT_EVERY = int(os.getenv("PRECLASSIFIER_AUDIT_EVERY", "20"))
+
+N_BUCKETS = 2 ** 18
+BODY_CHARS = 1000
+
+# Same fallback as the inbox filters when the prompt lists no [categories]
+DEFAULT_CATEGORIES = ["Work", "Personal", "Urgent", "Finance", "Spam"]
+
+# tiers
+RULE = "rule"
+HEURISTIC = "heuristic"
+MODEL = "model"
+LLM = "llm"
+
+# (pattern on the lowercased sender address, category)
+SENDER_RULES = [
+    (re.compile(r"^(?:newsletters?|news|digest|weekly)@"), "Newsletter"),
+    (re.compile(r"^(?:billing|invoices?|receipts?|payments?|payroll)@"), "Finance"),
+    (re.compile(r"^(?:spam|winner|prize)@|@(?:[\w-]+\.)*(?:lottery|casino)\."), "Spam"),
+]
+RULE_CONFIDENCE = 0.99
+
+# (field, pattern, category, confidence); replies and forwards are skipped
+HEURISTICS = [
+    ("subject", re.compile(r"^\s*(?:urgent|action required)\b", re.I), "Urgent", 0.97),
+    ("subject", re.compile(r"\b(?:invoice #|your payment of|statement for)", re.I), "Finance", 0.96),
+    ("body", re.compile(r"\bunsubscribe\b", re.I), "Newsletter", 0.95),
+]
+REPLY_SUBJECT = re.compile(r"^\s*(?:re|fwd?|aw)\s*:", re.I)
+
+WORD = re.compile(r"[a-z0-9][a-z0-9'$#-]+")
+
+
+# Categories the categorize prompt allows ("[Work, Personal, ...]")
+def prompt_categories(cat_prompt):
+    match = re.search(r"\[(.*?)\]", cat_prompt or "")
+    if not match:
+        return list(DEFAULT_CATEGORIES)
+    return [c.strip() for c in match.group(1).split(",") if c.strip()]
+
+
+# Hashed feature buckets of an email (each counted once)
+def features(email):
+    sender = (email.get("sender") or "").lower()
+    local, _, domain = sender.partition("@")
+    tokens = [f"from:{sender}", f"user:{local}", f"domain:{domain}"]
+    tokens += ["s:" + w for w in WORD.findall((email.get("subject") or "").lower())]
+    tokens += ["b:" + w for w in WORD.findall((email.get("body") or "")[:BODY_CHARS].lower())]
+    return sorted({zlib.crc32(t.encode("utf-8")) % N_BUCKETS for t in tokens})
+
+
+class PreClassifier:
+    def __init__(self, min_confidence=MIN_CONFIDENCE, min_docs=MIN_TRAINING_DOCS, audit_every=AUDIT_EVERY,
+                 enabled=PRECLASSIFIER_ENABLED):
+        self.min_confidence = min_confidence
+        self.min_docs = min_docs
+        self.audit_every = audit_every
+        self.enabled = enabled
+        self._counts = None     # bucket -> {category: emails with it}
+        self._docs = {}         # category -> emails learned
+        self._tokens = {}       # category -> sum of their feature counts
+        self._lock = threading.RLock()
+
+    # Loads the model on first use, and again when another process (or a
+    # reseeded database) changed it since; each load also learns the
+    # LLM-labelled emails the model has not seen yet
+    def _sync(self):
+        with self._lock:
+            stored = get_connection().execute("SELECT IFNULL(SUM(docs), 0) FROM precls_classes").fetchone()[0]
+            if self._counts is not None and stored == sum(self._docs.values()):
+                return
+            self._load()
+            self.train_from_inbox()
+
+    def _load(self):
+        self._counts, self._docs, self._tokens = {}, {}, {}
+        conn = get_connection()
+        for category, docs, tokens in conn.execute("SELECT category, docs, tokens FROM precls_classes"):
+            self._docs[category], self._tokens[category] = docs, tokens
+        for category, bucket, count in conn.execute("SELECT category, bucket, count FROM precls_tokens"):
+            self._counts.setdefault(bucket, {})[category] = count
+
+    # (category, probability) of the model's best guess among `categories`,
+    # or (None, 0.0) while it knows too little
+    def predict(self, email, categories):
+        with self._lock:
+            known = [c for c in categories if self._docs.get(c)]
+            total = sum(self._docs.values())
+            if not known or total < self.min_docs:
+                return None, 0.0
+            vocabulary = len(self._counts) or 1
+            buckets = features(email)
+            scores = {}
+            for c in known:
+                denominator = math.log(self._tokens[c] + vocabulary)
+                score = math.log(self._docs[c] / total)
+                for b in buckets:
+                    score += math.log(self._counts.get(b, {}).get(c, 0) + 1) - denominator
+                scores[c] = score
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        return best, 1.0 / sum(math.exp(s - top) for s in scores.values())
+
+    # (tier, category, confidence) for one email. The tier is LLM when no
+    # local tier is sure enough; category is then the best local guess.
+    def classify(self, email, categories):
+        allowed = {c.lower(): c for c in categories}
+        sender = (email.get("sender") or "").lower()
+        for pattern, category in SENDER_RULES:
+            if category.lower() in allowed and pattern.search(sender):
+                return RULE, allowed[category.lower()], RULE_CONFIDENCE
+
+        guess = (LLM, None, 0.0)
+        if not REPLY_SUBJECT.match(email.get("subject") or ""):
+            for field, pattern, category, confidence in HEURISTICS:
+                if category.lower() in allowed and pattern.search(email.get(field) or ""):
+                    if confidence >= self.min_confidence:
+                        return HEURISTIC, allowed[category.lower()], confidence
+                    guess = (LLM, allowed[category.lower()], confidence)
+                    break
+
+        category, probability = self.predict(email, categories)
+        if category is not None and probability >= self.min_confidence:
+            return MODEL, category, probability
+        if category is not None and probability > guess[2]:
+            guess = (LLM, category, probability)
+        return guess
+
+    # Splits emails (dicts with id/sender/subject/body) into the ones decided
+    # locally, {email_id: category}, and the ones the LLM has to see. Audited
+    # local decisions go to the LLM as well and are not in the first part.
+    def split(self, emails, cat_prompt):
+        emails = list(emails)
+        if not self.enabled or not emails:
+            return {}, emails
+        self._sync()
+        categories = prompt_categories(cat_prompt)
+        decided, escalate, log = {}, [], []
+        now = time.time()
+        for e in emails:
+            tier, category, confidence = self.classify(e, categories)
+            audited = tier != LLM and self.audit_every and e['id'] % self.audit_every == 0
+            if tier == LLM or audited:
+                escalate.append(e)
+            else:
+                decided[e['id']] = category
+            log.append((e['id'], tier, category, confidence, int(bool(audited)), now))
+        with transaction() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO precls_decisions
+                   (email_id, tier, category, confidence, llm_category, audited, created_at)
+                   VALUES (?, ?, ?, ?, NULL, ?, ?)""",
+                log
+            )
+            data_changed()
+        return decided, escalate
+
+    # Records the LLM's categories for emails it was asked about: their
+    # agreement with the local guess, and one more training example each.
+    # results: {email_id: category or None}
+    def record_llm(self, emails, results):
+        if not self.enabled:
+            return
+        labelled = [(e, results[e['id']]) for e in emails if results.get(e['id'])]
+        if not labelled:
+            return
+        # the model lock is always taken before the write lock (see learn_many)
+        with self._lock, transaction() as conn:
+            conn.executemany(
+                "UPDATE precls_decisions SET llm_category=? WHERE email_id=?",
+                [(category, e['id']) for e, category in labelled]
+            )
+            data_changed()
+            self.learn_many(labelled)
+
+    # Adds (email, category) examples to the model. An email learned before
+    # under another category is moved, so a relabelled email counts once.
+    def learn_many(self, examples):
+        with self._lock, transaction() as conn:
+            if self._counts is None:
+                self._load()
+            token_deltas, class_deltas = {}, {}
+            for email, category in examples:
+                row = conn.execute("SELECT category FROM precls_trained WHERE email_id=?", (email['id'],)).fetchone()
+                if row and row[0] == category:
+                    continue
+                buckets = features(email)
+                changes = [(category, 1)] + ([(row[0], -1)] if row else [])
+                for cat, sign in changes:
+                    for b in buckets:
+                        token_deltas[(cat, b)] = token_deltas.get((cat, b), 0) + sign
+                    docs, tokens = class_deltas.get(cat, (0, 0))
+                    class_deltas[cat] = (docs + sign, tokens + sign * len(buckets))
+                conn.execute(
+                    "INSERT OR REPLACE INTO precls_trained (email_id, category) VALUES (?, ?)",
+                    (email['id'], category)
+                )
+            if not class_deltas:
+                return 0
+            conn.executemany(
+                """INSERT INTO precls_tokens (category, bucket, count) VALUES (?, ?, ?)
+                   ON CONFLICT(category, bucket) DO UPDATE SET count = count + excluded.count""",
+                [(cat, b, delta) for (cat, b), delta in token_deltas.items() if delta]
+            )
+            conn.executemany(
+                """INSERT INTO precls_classes (category, docs, tokens) VALUES (?, ?, ?)
+                   ON CONFLICT(category) DO UPDATE SET docs = docs + excluded.docs,
+                                                       tokens = tokens + excluded.tokens""",
+                [(cat, docs, tokens) for cat, (docs, tokens) in class_deltas.items()]
+            )
+            data_changed()
+            for (cat, b), delta in token_deltas.items():
+                per_bucket = self._counts.setdefault(b, {})
+                per_bucket[cat] = per_bucket.get(cat, 0) + delta
+            for cat, (docs, tokens) in class_deltas.items():
+                self._docs[cat] = self._docs.get(cat, 0) + docs
+                self._tokens[cat] = self._tokens.get(cat, 0) + tokens
+            return sum(docs for docs, _ in class_deltas.values() if docs > 0)
+
+    # Learns every categorized email the model has not seen, except those
+    # the pre-classifier labelled itself and those whose category was copied
+    # from a near duplicate or thread mate (src/dedupe.py records those in
+    # shared_results): it must not learn its own output, even second hand
+    def train_from_inbox(self, batch_size=5000):
+        learned = 0
+        while True:
+            rows = get_connection().execute(
+                """SELECT id, sender, subject, body, category FROM emails e
+                   WHERE IFNULL(category, '') != ''
+                     AND NOT EXISTS (SELECT 1 FROM precls_trained t WHERE t.email_id = e.id)
+                     AND NOT EXISTS (SELECT 1 FROM precls_decisions d
+                                     WHERE d.email_id = e.id AND d.tier != 'llm' AND d.llm_category IS NULL)
+                     AND NOT EXISTS (SELECT 1 FROM shared_results s
+                                     WHERE s.email_id = e.id AND s.field = 'category')
+                   LIMIT ?""",
+                (batch_size,)
+            ).fetchall()
+            if not rows:
+                return learned
+            learned += self.learn_many([(dict(r), r['category']) for r in rows])
+
+    # Hit rate and agreement with the LLM, overall and per tier
+    @cached_read
+    def report(self):
+        rows = get_connection().execute(
+            """SELECT tier, COUNT(*) AS decisions, SUM(audited) AS audited,
+                      SUM(llm_category IS NOT NULL AND category IS NOT NULL) AS compared,
+                      IFNULL(SUM(lower(llm_category) = lower(category)), 0) AS agreed
+               FROM precls_decisions GROUP BY tier"""
+        ).fetchall()
+        tiers = [dict(r) for r in rows]
+        for t in tiers:
+            t["agreement"] = t["agreed"] / t["compared"] if t["compared"] else None
+        total = sum(t["decisions"] for t in tiers)
+        local = [t for t in tiers if t["tier"] != LLM]
+        compared = sum(t["compared"] for t in local)
+        return {
+            "decisions": total,
+            "hit_rate": sum(t["decisions"] for t in local) / total if total else 0.0,
+            "llm_calls_saved": sum(t["decisions"] - t["audited"] for t in local),
+            "agreement": sum(t["agreed"] for t in local) / compared if compared else None,
+            "by_tier": tiers,
+        }
+
+    # Agreement with the LLM per confidence band (width `step`), for choosing
+    # MIN_CONFIDENCE: the lowest band that still agrees often enough
+    @cached_read
+    def agreement_by_confidence(self, step=0.05):
+        rows = get_connection().execute(
+            """SELECT ROUND(MIN(CAST(confidence / ? + 1e-9 AS INTEGER) * ?, 1.0), 4) AS band, COUNT(*) AS compared,
+                      SUM(lower(llm_category) = lower(category)) AS agreed
+               FROM precls_decisions WHERE llm_category IS NOT NULL AND category IS NOT NULL
+               GROUP BY band ORDER BY band""",
+            (step, step)
+        ).fetchall()
+        return [dict(r, agreement=r["agreed"] / r["compared"]) for r in rows]
+
+
+# One pre-classifier per process, shared by the worker threads
+shared_preclassifier = PreClassifier()
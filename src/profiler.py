@@ -0,0 +1,233 @@
+import os
+import time
+import cProfile
+import inspect
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Opt-in profiling of the Streamlit rerun cycle. With EMAIL_AGENT_PROFILE=1,
+# install() wraps the db_manager functions, PromptManager and LLMEngine
+# methods with timing spans, and app.py marks its major sections. Each rerun
+# collects its spans (calls, total and self time per name) for the debug
+# panel, and can be dumped as folded stacks ("a;b;c <microseconds>", the
+# input of flamegraph.pl and speedscope). EMAIL_AGENT_PROFILE=cprofile also
+# runs cProfile over every rerun and dumps a .prof file next to it.
+#
+# install() must run before anything does `from src.db_manager import ...`,
+# since those imports copy the unwrapped functions.
+
+PROFILE = os.getenv("EMAIL_AGENT_PROFILE", "").lower()
+ENABLED = PROFILE not in ("", "0", "false", "off")
+USE_CPROFILE = PROFILE == "cprofile"
+PROFILE_DIR = os.getenv("EMAIL_AGENT_PROFILE_DIR", "data/profiles")
+
+# Called per row, per cached read or hand out connections/transactions:
+# spans there are noise
+SKIP_DB_FUNCTIONS = {"get_connection", "transaction", "close_connections", "format_chat_line",
+                     "cached_read", "data_version"}
+
+ROOT = "rerun"
+
+# Totals of recent reruns (ms), newest last
+history = deque(maxlen=50)
+
+_local = threading.local()
+_installed = False
+
+
+# Spans of one rerun. Only the thread that started it records into it, so
+# background workers never leak into the script's numbers.
+class Run:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_activity = self.started
+        self.total = None
+        self.interrupted = False
+        self.stack = []    # open spans: [name, start, time spent in children]
+        self.stats = {}    # name -> [calls, total seconds, self seconds]
+        self.folded = {}   # "rerun;section;function" -> self seconds
+        self.section = None
+        self.profile = None
+        if USE_CPROFILE:
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # another profiler is already active (e.g. a concurrent session)
+                self.profile = None
+
+    def enter(self, name):
+        frame = [name, time.perf_counter(), 0.0]
+        self.stack.append(frame)
+        return frame
+
+    def is_open(self, frame):
+        return any(f is frame for f in self.stack)
+
+    def exit(self, frame):
+        # already closed by section() or finish()
+        if not self.is_open(frame):
+            return
+        now = time.perf_counter()
+        position = next(i for i, f in enumerate(self.stack) if f is frame)
+        path = ";".join([ROOT] + [f[0] for f in self.stack[:position + 1]])
+        del self.stack[position]
+        elapsed = now - frame[1]
+        own = max(0.0, elapsed - frame[2])
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        entry = self.stats.setdefault(frame[0], [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += own
+        self.folded[path] = self.folded.get(path, 0.0) + own
+        self.last_activity = now
+
+    def finish(self, end=None):
+        while self.stack:
+            self.exit(self.stack[-1])
+        end = end or time.perf_counter()
+        self.total = end - self.started
+        self.folded[ROOT] = max(0.0, self.total - sum(self.folded.values()))
+        if self.profile:
+            self.profile.disable()
+        history.append(round(self.total * 1000, 1))
+
+
+def _current():
+    return getattr(_local, "run", None)
+
+
+# Starts collecting for this rerun. A previous rerun on this thread that
+# never reached end_run (st.rerun() stops the script) is closed first.
+def start_run():
+    if not ENABLED:
+        return None
+    previous = _current()
+    if previous is not None:
+        previous.interrupted = True
+        previous.finish(previous.last_activity)
+    _local.run = Run()
+    return _local.run
+
+
+# Ends this rerun's collection and returns it (None when profiling is off)
+def end_run():
+    run = _current()
+    if run is None:
+        return None
+    run.finish()
+    _local.run = None
+    return run
+
+
+# Times the enclosed block under `name` (free when no run is active)
+@contextmanager
+def span(name):
+    run = _current()
+    if run is None:
+        yield
+        return
+    frame = run.enter(name)
+    try:
+        yield
+    finally:
+        run.exit(frame)
+
+
+# Marks the start of a top-level section of the script, ending the previous
+# one. Suits app.py's long linear stretches that have no block to wrap.
+def section(name):
+    run = _current()
+    if run is None:
+        return
+    if run.section is not None and run.is_open(run.section):
+        while run.stack[-1] is not run.section:
+            run.exit(run.stack[-1])
+        run.exit(run.section)
+    run.section = run.enter(name)
+
+
+# Wraps fn so each call is a span; generator functions are timed over their
+# whole iteration
+def timed(name, fn):
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            with span(name):
+                yield from fn(*args, **kwargs)
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        run = _current()
+        if run is None:
+            return fn(*args, **kwargs)
+        frame = run.enter(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            run.exit(frame)
+    return wrapper
+
+
+def _wrap_class(cls, prefix):
+    for name, member in list(vars(cls).items()):
+        if name.startswith("__"):
+            continue
+        if isinstance(member, staticmethod):
+            setattr(cls, name, staticmethod(timed(f"{prefix}.{name}", member.__func__)))
+        elif inspect.isfunction(member):
+            setattr(cls, name, timed(f"{prefix}.{name}", member))
+
+
+# Wraps the hot-path modules in place when EMAIL_AGENT_PROFILE is set.
+# Returns True if profiling is on.
+def install():
+    global _installed
+    if not ENABLED or _installed:
+        return ENABLED
+    from src import db_manager
+    for name, member in list(vars(db_manager).items()):
+        if (inspect.isfunction(member) and member.__module__ == db_manager.__name__
+                and not name.startswith("_") and name not in SKIP_DB_FUNCTIONS):
+            setattr(db_manager, name, timed(f"db.{name}", member))
+
+    # imported after the db_manager patch so their own imports get the wrappers
+    from src.prompt_manager import PromptManager
+    from src.llm_engine import LLMEngine
+    _wrap_class(PromptManager, "prompts")
+    _wrap_class(LLMEngine, "llm")
+    _installed = True
+    return True
+
+
+# Rows for the debug panel: one per span name, slowest total first
+def report(run):
+    total = run.total or 1e-9
+    rows = [
+        {"span": name, "calls": calls, "total_ms": round(seconds * 1000, 2),
+         "self_ms": round(own * 1000, 2), "share": round(seconds / total, 3)}
+        for name, (calls, seconds, own) in run.stats.items()
+    ]
+    return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+
+# Writes the run as folded stacks (and the cProfile data when collected).
+# Returns the paths written.
+def dump(run, directory=PROFILE_DIR):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    stem = os.path.join(directory, time.strftime("rerun-%Y%m%d-%H%M%S"))
+    paths = [stem + ".folded"]
+    with open(paths[0], "w", encoding="utf-8") as f:
+        for path, seconds in sorted(run.folded.items()):
+            micros = int(seconds * 1e6)
+            if micros:
+                f.write(f"{path} {micros}\n")
+    if run.profile:
+        run.profile.dump_stats(stem + ".prof")
+        paths.append(stem + ".prof")
+    return paths
@@ -1,36 +1,29 @@
-from src.db_manager import get_prompt, save_prompt
+from src.prompt_registry import shared_registry
 
 
 # Manage the retrieval and updates of system prompts
+# (served from memory by the prompt registry, see src/prompt_registry.py)
 class PromptManager:
     @staticmethod
     def get_categorization_prompt():
-        default = """
-        You are an email organizer. 
-        Classify the following email into one of these categories: [Work, Personal, Newsletter, Finance, Spam, Urgent].
-        Return ONLY the category name.
-        """
-        return get_prompt("categorize", default)
+        return shared_registry.get("categorize")
 
     @staticmethod
     def get_extraction_prompt():
-        default = """
-        Identify any specific tasks, deadlines, or requests in the email.
-        Return them as a bulleted list. If none, write 'No action items'.
-        """
-        return get_prompt("extract", default)
+        return shared_registry.get("extract")
 
     @staticmethod
     def get_reply_prompt():
-        default = """
-        Draft a professional, concise reply to this email. 
-        If it is work-related, be formal. If personal, be casual.
-        """
-        return get_prompt("reply", default)
+        return shared_registry.get("reply")
+
+    # {key: version id} of the current prompts
+    @staticmethod
+    def get_versions():
+        return shared_registry.versions()
 
     @staticmethod
     def update_prompts(cat_prompt, ext_prompt, rep_prompt):
-        save_prompt("categorize", cat_prompt)
-        save_prompt("extract", ext_prompt)
-        save_prompt("reply", rep_prompt)
-        return True
\ No newline at end of file
+        shared_registry.save("categorize", cat_prompt)
+        shared_registry.save("extract", ext_prompt)
+        shared_registry.save("reply", rep_prompt)
+        return True
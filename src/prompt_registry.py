@@ -0,0 +1,195 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from string import Formatter
+from src.db_manager import get_connection, transaction, data_version, invalidate_read_cache
+
+# Versioned user prompts. Every saved prompt text gets a stable version id
+# (a hash of the text, the same on every machine), is kept in the
+# prompt_versions history and served from memory; subscribers hear about
+# changes. The registry reloads when db_manager's data version moves, so
+# prompts saved by another process are picked up without polling SQL.
+#
+# Prompt templates are compiled once per rule text: the static parts (rules,
+# scaffolding) are substituted ahead of time and only the per-email fields
+# are filled in per call.
+
+DEFAULT_PROMPTS = {
+    "categorize": """
+        You are an email organizer. 
+        Classify the following email into one of these categories: [Work, Personal, Newsletter, Finance, Spam, Urgent].
+        Return ONLY the category name.
+        """,
+    "extract": """
+        Identify any specific tasks, deadlines, or requests in the email.
+        Return them as a bulleted list. If none, write 'No action items'.
+        """,
+    "reply": """
+        Draft a professional, concise reply to this email. 
+        If it is work-related, be formal. If personal, be casual.
+        """,
+}
+
+COMPILED_CACHE_SIZE = 256
+
+
+# Stable id of a prompt text
+def version_id(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:12]
+
+
+class PromptRegistry:
+    def __init__(self, defaults=DEFAULT_PROMPTS):
+        self.defaults = dict(defaults)
+        self._texts = {}
+        self._versions = {}
+        self._seen = None
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+    # Reloads the current prompts when the database changed since last time
+    def _refresh(self):
+        seen = data_version()
+        if seen == self._seen:
+            return
+        rows = dict(get_connection().execute("SELECT key, value FROM prompts").fetchall())
+        changed = []
+        with self._lock:
+            for key in set(self.defaults) | set(rows):
+                text = rows.get(key, self.defaults.get(key, ""))
+                if self._texts.get(key) != text:
+                    if key in self._texts:
+                        changed.append(key)
+                    self._texts[key] = text
+                    self._versions[key] = version_id(text)
+            self._seen = seen
+        for key in changed:
+            self._notify(key)
+
+    def get(self, key):
+        self._refresh()
+        return self._texts.get(key, self.defaults.get(key, ""))
+
+    # Version id of the current text of `key`
+    def version(self, key):
+        self._refresh()
+        return self._versions.get(key) or version_id(self.defaults.get(key, ""))
+
+    # {key: text} of every prompt
+    def current(self):
+        self._refresh()
+        return dict(self._texts)
+
+    # {key: version id} of every prompt
+    def versions(self):
+        self._refresh()
+        return dict(self._versions)
+
+    # Saves a new text for `key`, records it in the history and tells the
+    # subscribers. Returns its version id.
+    def save(self, key, text):
+        version = version_id(text)
+        with transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO prompts (key, value) VALUES (?, ?)", (key, text))
+            conn.execute(
+                "INSERT OR IGNORE INTO prompt_versions (version_id, key, text, created_at) VALUES (?, ?, ?, ?)",
+                (version, key, text, time.time())
+            )
+        invalidate_read_cache()
+        with self._lock:
+            changed = self._texts.get(key) != text
+            self._texts[key] = text
+            self._versions[key] = version
+        if changed:
+            self._notify(key)
+        return version
+
+    # Earlier texts of `key`, newest first: [{version_id, text, created_at}]
+    def history(self, key):
+        rows = get_connection().execute(
+            "SELECT version_id, text, created_at FROM prompt_versions WHERE key=? ORDER BY created_at DESC",
+            (key,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    # callback(key, version_id, text) runs after a prompt changes
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _notify(self, key):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            version, text = self._versions.get(key), self._texts.get(key)
+        for callback in subscribers:
+            callback(key, version, text)
+
+
+# One registry per process
+shared_registry = PromptRegistry()
+
+
+# A template with its static fields already substituted. `parts` holds the
+# literal text between the remaining fields, `slots` where each of those
+# goes, so render() is a list fill and one join.
+class CompiledTemplate:
+    def __init__(self, template, static):
+        self.parts = []
+        self.slots = []
+        literal = []
+        for text, field, spec, conversion in Formatter().parse(template):
+            literal.append(text)
+            if field is None:
+                continue
+            if field in static:
+                literal.append(format(static[field], spec or ""))
+            else:
+                self.parts.append("".join(literal))
+                self.slots.append((len(self.parts), field, spec))
+                self.parts.append(None)
+                literal = []
+        self.parts.append("".join(literal))
+
+    # The prompt for one call
+    def render(self, **fields):
+        parts = self.parts[:]
+        for position, field, spec in self.slots:
+            value = fields[field]
+            parts[position] = format(value, spec) if spec else value if type(value) is str else str(value)
+        return "".join(parts)
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+# Compiled form of `template` with `static` bound, cached per rule text
+# (the oldest compiled templates are dropped first)
+def compile_template(template, **static):
+    key = (template, tuple(static.items()))
+    # hits skip the lock: they are on every prompt built
+    compiled = _compiled.get(key)
+    if compiled is not None:
+        return compiled
+    compiled = CompiledTemplate(template, static)
+    with _compiled_lock:
+        _compiled[key] = compiled
+        while len(_compiled) > COMPILED_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+# Templates compiled for replaced prompt texts will not be asked for again
+def _drop_compiled(key, version, text):
+    with _compiled_lock:
+        _compiled.clear()
+
+
+shared_registry.subscribe(_drop_compiled)
@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import random
+import threading
+
+# Process-wide quota (overridable from .env)
+REQUESTS_PER_MIN = int(os.getenv("LLM_REQUESTS_PER_MIN", "60"))
+TOKENS_PER_MIN = int(os.getenv("LLM_TOKENS_PER_MIN", "250000"))
+BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+BASE_DELAY = 2.0
+MAX_DELAY = 60.0
+
+
+# Rough token estimate (~4 characters per token) used for budgeting
+def estimate_tokens(text):
+    return len(text or "") // 4 + 1
+
+
+# True if an exception from the API means "slow down"
+def is_quota_error(error):
+    error_str = str(error).lower()
+    return "429" in error_str or "quota" in error_str or "resource exhausted" in error_str
+
+
+# Reads the server's retry hint from an exception, in seconds (None if absent).
+# Gemini reports it as "Please retry in 33.2s" and/or "retry_delay { seconds: 33 }".
+def parse_retry_after(error):
+    hint = getattr(error, "retry_after", None)
+    if hint:
+        return float(hint)
+    text = str(error)
+    match = re.search(r"retry in ([\d.]+)\s*s", text, re.IGNORECASE)
+    if not match:
+        match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text)
+    if not match:
+        match = re.search(r"retry-after:?\s*([\d.]+)", text, re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+# Jittered exponential backoff. A server hint wins over the local schedule.
+def backoff_delay(attempt, retry_after=None):
+    if retry_after:
+        return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+    ceiling = min(MAX_DELAY, BASE_DELAY * (2 ** attempt))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+# Classic token bucket refilled continuously at `per_min` units per minute
+class TokenBucket:
+    def __init__(self, per_min, burst=None):
+        self.base_rate = per_min / 60.0
+        self.rate = self.base_rate
+        self.capacity = float(burst if burst is not None else max(1, per_min // 10))
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` units are available
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else MAX_DELAY
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+# Requests/min and tokens/min limiter shared by every thread.
+# A 429 pauses all callers (not just the one that hit it) and halves the
+# request rate; successes slowly restore it.
+class RateLimiter:
+    def __init__(self, requests_per_min=REQUESTS_PER_MIN, tokens_per_min=TOKENS_PER_MIN, burst=None):
+        self.requests = TokenBucket(requests_per_min, burst)
+        self.tokens = TokenBucket(tokens_per_min, max(1, tokens_per_min // 10))
+        self.min_rate = self.requests.base_rate / 8
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.queued = 0
+        self.calls = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    # Blocks until a request carrying `tokens` prompt tokens may start
+    def acquire(self, tokens=1):
+        started = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    wait = max(
+                        self._paused_until - now,
+                        self.requests.wait_time(1, now),
+                        self.tokens.wait_time(tokens, now),
+                    )
+                    if wait <= 0:
+                        self.requests.consume(1)
+                        self.tokens.consume(tokens)
+                        self.calls += 1
+                        self.wait_seconds += now - started
+                        return
+                time.sleep(min(wait, 1.0))
+        finally:
+            with self._lock:
+                self.queued -= 1
+
+    # Server said slow down: pause everyone and back off the rate
+    def on_throttled(self, delay):
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.requests.rate = max(self.min_rate, self.requests.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            bucket = self.requests
+            bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate * 0.05)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 2),
+                "current_rpm": round(self.requests.rate * 60, 1),
+            }
+
+
+# Fails fast while the API is saturated instead of queueing more doomed calls.
+# closed -> open after `threshold` consecutive quota failures; after the
+# cooldown one probe call is let through (half-open) to test recovery.
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_until = 0.0
+        self.fast_failed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() >= self.opened_until:
+                self.state = "half-open"
+                return True
+            self.fast_failed += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    # Quota failure; retry_after stretches the open window to the server's hint
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_until = time.monotonic() + max(self.cooldown, retry_after or 0)
+
+    # Call gave up for good (retries exhausted or non-retryable error)
+    def record_gave_up(self):
+        with self._lock:
+            self.failed += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "circuit": self.state,
+                "failed": self.failed,
+                "fast_failed": self.fast_failed,
+            }
+
+
+# One limiter and breaker per process, shared by every LLMEngine instance
+shared_limiter = RateLimiter()
+shared_breaker = CircuitBreaker()
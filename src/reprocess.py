@@ -0,0 +1,99 @@
+import os
+from src.db_manager import get_connection, transaction, get_email_by_id, update_email_fields, FIELD_PROMPT_KEYS
+from src.job_queue import enqueue_job
+from src.llm_engine import INSIGHT_FIELDS
+from src.pipeline import current_prompts, field_versions
+from src.preclassifier import shared_preclassifier
+from src.prompt_registry import shared_registry
+
+# Incremental reprocessing after a prompt change. Every AI column stores the
+# version of the prompt that generated it (<column>_version); a row is stale
+# for a field when that differs from the current prompt's version. The
+# planner queues one "reprocess" job per stale email, most important first
+# (unread, then urgent, then newest), and each job re-runs only the stages
+# that are stale for that email: a new categorize prompt re-categorizes and
+# leaves action items and drafts alone.
+#
+# Work is paced: a pass queues at most REPROCESS_BUDGET emails, released at
+# REPROCESS_PER_MINUTE so interactive jobs queued meanwhile are not starved.
+
+REPROCESS_BUDGET = int(os.getenv("REPROCESS_BUDGET", "200"))
+REPROCESS_PER_MINUTE = float(os.getenv("REPROCESS_PER_MINUTE", "30"))
+
+# unread first, then urgent, then newest
+PRIORITY_ORDER = "is_read, (category = 'Urgent') DESC, received_at DESC, id DESC"
+
+
+# {field: version id of the current prompt behind it}
+def current_versions():
+    return {field: shared_registry.version(FIELD_PROMPT_KEYS[field]) for field in INSIGHT_FIELDS}
+
+
+def _stale_sql(field):
+    return f"(IFNULL({field}, '') != '' AND IFNULL({field}_version, '') != ?)"
+
+
+# Fields of one email (a row dict) that an older prompt produced
+def stale_fields(email, versions=None):
+    versions = versions or current_versions()
+    return [
+        f for f in INSIGHT_FIELDS
+        if (email[f] or "").strip() and email[f"{f}_version"] != versions[f]
+    ]
+
+
+# {field: number of stale rows}, counted in one pass over the table
+def plan(versions=None):
+    versions = versions or current_versions()
+    counts = get_connection().execute(
+        f"SELECT {', '.join(f'IFNULL(SUM({_stale_sql(f)}), 0)' for f in INSIGHT_FIELDS)} FROM emails",
+        [versions[f] for f in INSIGHT_FIELDS]
+    ).fetchone()
+    return dict(zip(INSIGHT_FIELDS, counts))
+
+
+# Ids of up to `limit` stale emails in priority order, skipping those that
+# already have a reprocess job waiting
+def next_batch(limit, versions=None):
+    versions = versions or current_versions()
+    rows = get_connection().execute(
+        f"""SELECT id FROM emails
+            WHERE ({' OR '.join(_stale_sql(f) for f in INSIGHT_FIELDS)})
+              AND id NOT IN (SELECT email_id FROM jobs
+                             WHERE kind = 'reprocess' AND status IN ('queued', 'running'))
+            ORDER BY {PRIORITY_ORDER} LIMIT ?""",
+        [versions[f] for f in INSIGHT_FIELDS] + [limit]
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+# Queues the next `budget` stale emails, one job each, the i-th claimable
+# after i / per_minute minutes. Returns the number queued.
+def schedule_reprocessing(budget=REPROCESS_BUDGET, per_minute=REPROCESS_PER_MINUTE):
+    email_ids = next_batch(budget)
+    with transaction():
+        for i, email_id in enumerate(email_ids):
+            enqueue_job("reprocess", email_id, delay=i * 60.0 / per_minute)
+    return len(email_ids)
+
+
+# Re-runs the stale stages of one email with the current prompts (one
+# consolidated call when several are stale) and stores the new values with
+# their versions. Returns (stale fields, {field: new value}).
+def reprocess_email(email_id, llm):
+    email = get_email_by_id(email_id)
+    if email is None:
+        return [], {}
+    prompts = current_prompts()
+    stale = stale_fields(email, field_versions(prompts))
+    if not stale:
+        return [], {}
+    produced = llm.generate_insights_validated(
+        email['body'] or "", email['sender'], email['subject'], prompts, stale
+    )
+    if produced:
+        update_email_fields(email_id, produced, field_versions(prompts, produced))
+    if produced.get("category"):
+        # relabelled under the new prompt: the pre-classifier learns the new label
+        shared_preclassifier.record_llm([email], {email_id: produced["category"]})
+    return stale, produced
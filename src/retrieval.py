@@ -0,0 +1,80 @@
+import os
+import re
+from src.db_manager import (
+    search_emails, fetch_email_page, fetch_chat_rows,
+    format_chat_line, chat_context_size
+)
+from src.rate_limiter import estimate_tokens
+from src.embeddings import search_text
+
+# How much inbox the chat prompt may carry
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", "30"))
+USE_EMBEDDINGS = os.getenv("CHAT_USE_EMBEDDINGS", "1") != "0"
+RRF_K = 60
+
+# Question words that would otherwise match half the inbox
+STOPWORDS = {
+    "a", "about", "all", "am", "an", "and", "any", "are", "as", "at", "be", "by", "can",
+    "did", "do", "does", "email", "emails", "for", "from", "get", "got", "have", "how",
+    "i", "if", "in", "inbox", "is", "it", "me", "my", "of", "on", "or", "show", "so",
+    "that", "the", "there", "this", "to", "was", "were", "what", "when", "which", "who",
+    "why", "with", "you", "your",
+}
+
+
+# Content words of a chat question, for an OR full-text query
+def query_terms(question):
+    return [w for w in re.findall(r"\w+", question.lower()) if w not in STOPWORDS]
+
+
+# Merges ranked id lists with reciprocal rank fusion
+def fuse_rankings(*rankings):
+    scores = {}
+    for ranking in rankings:
+        for position, email_id in enumerate(ranking):
+            scores[email_id] = scores.get(email_id, 0.0) + 1.0 / (RRF_K + position + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+# Picks the emails most relevant to the question, best first: BM25 hits from
+# the FTS index fused with nearest neighbours from the local vector index,
+# then the newest emails to fill any remaining slots.
+def rank_emails(question, top_k=CHAT_TOP_K, use_embeddings=USE_EMBEDDINGS):
+    lexical, semantic = [], []
+    terms = query_terms(question)
+    if terms:
+        lexical = [r['id'] for r in search_emails(" ".join(terms), limit=top_k, match_any=True)]
+        if use_embeddings:
+            semantic = [email_id for email_id, score in search_text(" ".join(terms), k=top_k) if score > 0]
+    ranked = fuse_rankings(lexical, semantic)[:top_k]
+
+    if len(ranked) < top_k:
+        recent, _ = fetch_email_page(limit=top_k)
+        seen = set(ranked)
+        ranked += [r['id'] for r in recent if r['id'] not in seen][:top_k - len(ranked)]
+    return ranked
+
+
+# Builds the chat context for a question within token_budget.
+# Returns (context, stats) where stats reports how many tokens were saved
+# compared with sending the whole inbox.
+def build_chat_context(question, token_budget=CHAT_TOKEN_BUDGET, top_k=CHAT_TOP_K):
+    header = "RELEVANT EMAILS (most relevant first):\n"
+    lines, used = [], estimate_tokens(header)
+    for row in fetch_chat_rows(rank_emails(question, top_k)):
+        line = format_chat_line(row)
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+
+    full = chat_context_size() // 4 + 1
+    stats = {
+        "emails_used": len(lines),
+        "tokens_used": used,
+        "tokens_full": full,
+        "tokens_saved": max(0, full - used),
+    }
+    return header + "".join(lines), stats
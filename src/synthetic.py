@@ -0,0 +1,105 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+# Seeded synthetic mailbox for load tests and benchmarks. The same
+# (count, seed, end) always yields the same emails, so timings from
+# different runs compare like for like.
+
+# Sender pools per kind with Zipf-like weights: a few senders dominate,
+# as in a real inbox (newsletters and the boss write the most)
+SENDERS = {
+    "Work": ["boss@startup.io", "colleague@startup.io", "pm@startup.io", "hr@startup.io",
+             "cto@startup.io", "designer@startup.io", "client@bigclient.com", "partner@agency.co"],
+    "Urgent": ["boss@startup.io", "alerts@pagerduty.com", "oncall@startup.io", "client@bigclient.com"],
+    "Personal": ["mom@gmail.com", "friend@gmail.com", "sam@outlook.com", "alex@yahoo.com", "landlord@rental.com"],
+    "Newsletter": ["newsletter@dailyml.com", "digest@medium.com", "news@pythonweekly.com",
+                   "updates@producthunt.com", "weekly@hackernews.io"],
+    "Finance": ["billing@aws.com", "noreply@bank.com", "billing@netflix.com", "invoices@stripe.com",
+                "payroll@startup.io"],
+    "Spam": ["winner@lottery.com", "deals@cheap-pills.biz", "prince@royal-transfer.ng", "promo@tool.io"],
+}
+
+# Share of the inbox per kind
+KIND_WEIGHTS = {"Newsletter": 0.28, "Work": 0.30, "Personal": 0.12, "Finance": 0.12, "Spam": 0.13, "Urgent": 0.05}
+
+SUBJECTS = {
+    "Work": ["Code Review Request: {topic}", "Notes from the {topic} sync", "{topic} roadmap for Q{q}",
+             "Can you take a look at {topic}?", "Re: {topic} estimate", "Ticket assigned: {ticket}"],
+    "Urgent": ["URGENT: {topic} is down", "ACTION REQUIRED: {topic} incident", "Production alert: {ticket}",
+               "Need this by {when}: {topic}"],
+    "Personal": ["Dinner {when}?", "Movie night {when}?", "Photos from the trip", "Re: plans for {when}",
+                 "Happy birthday!"],
+    "Newsletter": ["The week in {topic}", "{n} papers you need to read about {topic}",
+                   "{topic} digest #{issue}", "What's new in {topic}"],
+    "Finance": ["Invoice #{invoice} available", "Your payment of ${amount} was successful",
+                "Transaction alert: ${amount} purchase", "Statement for {month} is ready"],
+    "Spam": ["YOU WON ${amount}!!!", "Limited offer: {n}0% off everything", "Claim your prize now",
+             "Re: your account has been selected"],
+}
+
+TOPICS = ["the API gateway", "billing service", "mobile app", "search ranking", "data pipeline",
+          "onboarding flow", "LLM evaluation", "auth migration", "dashboard", "vector index"]
+WHEN = ["today", "tomorrow", "Friday", "Monday", "this weekend", "by EOD", "next Tuesday", "by the 25th"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+          "October", "November", "December"]
+
+OPENERS = {
+    "Work": "Hi, following up on {topic}.", "Urgent": "This needs your attention right away: {topic}.",
+    "Personal": "Hey! Hope you're doing well.", "Newsletter": "Here is this week's roundup on {topic}.",
+    "Finance": "This is a notification about your account.", "Spam": "Congratulations, you have been selected!",
+}
+ASKS = ["Can you review it {when}?", "Please send the numbers {when}.", "Let me know if you can join {when}.",
+        "We need a decision {when}.", "Could you confirm {when}?", "Please submit the report {when}."]
+FILLER = ("the team discussed the latest numbers and agreed that we should revisit the plan once the "
+          "new data is in while keeping an eye on costs and the timeline for the release we also "
+          "talked about hiring priorities customer feedback and the open questions from last week").split()
+
+
+def _weighted_choice(rng, items):
+    # Zipf-like: the i-th item is ~1/(i+1) as likely as the first
+    weights = [1.0 / (i + 1) for i in range(len(items))]
+    return rng.choices(items, weights)[0]
+
+
+def _fill(rng, template):
+    return template.format(
+        topic=rng.choice(TOPICS), when=rng.choice(WHEN), q=rng.randint(1, 4), n=rng.randint(3, 9),
+        ticket=f"FIX-{rng.randint(100, 9999)}", issue=rng.randint(1, 400), invoice=rng.randint(10000, 99999),
+        amount=f"{rng.uniform(5, 2500):,.2f}", month=rng.choice(MONTHS),
+    )
+
+
+# Body length in words: log-normal, median ~60, long tail
+def _body(rng, kind):
+    words = max(8, min(2000, int(math.exp(rng.gauss(4.1, 0.7)))))
+    parts = [_fill(rng, OPENERS[kind])]
+    if kind in ("Work", "Urgent") or rng.random() < 0.2:
+        parts.append(_fill(rng, rng.choice(ASKS)))
+    parts.append(" ".join(rng.choices(FILLER, k=words)).capitalize() + ".")
+    return " ".join(parts)
+
+
+# Received time: spread over `days` before `end`, mostly during working hours
+def _received_at(rng, end, days):
+    day = end - timedelta(days=rng.randrange(days))
+    hour = min(23, max(0, int(rng.gauss(13, 3.5))))
+    return day.replace(hour=hour, minute=rng.randrange(60)).strftime("%Y-%m-%d %H:%M")
+
+
+# Yields `count` email dicts shaped for db_manager.ingest_emails, plus the
+# ground-truth "kind" (the category an ideal classifier would assign).
+def generate_emails(count, seed=0, end=None, days=365):
+    rng = random.Random(seed)
+    end = end or datetime(2025, 11, 24)
+    kinds, weights = list(KIND_WEIGHTS), list(KIND_WEIGHTS.values())
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        yield {
+            "sender": _weighted_choice(rng, SENDERS[kind]),
+            "subject": _fill(rng, rng.choice(SUBJECTS[kind])),
+            "body": _body(rng, kind),
+            "received_at": _received_at(rng, end, days),
+            "message_id": f"<synthetic-{seed}-{i}@example.com>",
+            "kind": kind,
+        }
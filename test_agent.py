@@ -1,18 +1,21 @@
 import sys
 from src.llm_engine import LLMEngine
-from src.db_manager import fetch_emails, get_all_emails_for_chat
+from src.db_manager import init_db, fetch_emails
+from src.retrieval import build_chat_context
 from src.prompt_manager import PromptManager
 
 def test_connection():
     # Checks LLM API connectivity
     print("\n1. Testing LLM Connection")
     llm = LLMEngine()
-    response = llm._call_llm("Reply with only the word 'Pong'", "Ping")
+    print(f"Backend: {llm.model_name}")
+    response = llm._call_llm_with_retry("Reply with only the word 'Pong'.\n\nPing", use_cache=False,
+                                       method="test_connection")
     print(f"Sent: Ping\nReceived: {response}")
-    if "Pong" in response:
+    if response and "Pong" in response:
         print("Connection Successful")
     else:
-        print("Connection Failed. Check API Key.")
+        print(f"Connection Failed. Check API Key. ({llm.last_error})")
 
 def test_extraction():
     # Tests the Categorize, Extract, and Draft pipeline
@@ -34,11 +37,11 @@ def test_extraction():
     }
     
     # Process email
-    cat, act, rep = llm.process_email(sample_body, sample_sender, sample_subject, prompts)
+    insights = llm.generate_insights_validated(sample_body, sample_sender, sample_subject, prompts)
     
-    print(f"\n[Category]: {cat}")
-    print(f"[Actions]:\n{act}")
-    print(f"[Draft]:\n{rep}")
+    print(f"\n[Category]: {insights.get('category')}")
+    print(f"[Actions]:\n{insights.get('action_items')}")
+    print(f"[Draft]:\n{insights.get('draft_reply')}")
 
 def test_chat_rag():
     # Tests RAG logic for chat
@@ -46,13 +49,14 @@ def test_chat_rag():
     llm = LLMEngine()
     
     try:
-        context = get_all_emails_for_chat()
-        if len(context) < 20:
+        query = "Do I have any urgent work?"
+        context, stats = build_chat_context(query)
+        if stats['emails_used'] == 0:
             print("DB seems empty. Run setup_data.py first.")
             return
-            
-        query = "Do I have any urgent work?"
-        print(f"Context Length: {len(context)} chars")
+
+        print(f"Context: {stats['emails_used']} emails, ~{stats['tokens_used']} tokens "
+              f"(~{stats['tokens_saved']} saved vs. full inbox)")
         print(f"Query: {query}")
         
         response = llm.chat_with_inbox(query, context)
@@ -61,20 +65,152 @@ def test_chat_rag():
     except Exception as e:
         print(f"Error: {e}")
 
+def test_imap_sync():
+    # Syncs from a local in-process IMAP server into a scratch database
+    print("\n 4. Testing IMAP Sync (local server)")
+    import os
+    import tempfile
+    from email.message import EmailMessage
+    from src import db_manager
+    from src.imap_fake import start_fake_server
+    from src.imap_sync import sync_account
+
+    def make_message(i, attachment_mb=0):
+        msg = EmailMessage()
+        msg['From'] = f"sender{i}@example.com"
+        msg['Subject'] = f"Test message {i}"
+        msg['Date'] = "Mon, 24 Nov 2025 10:30:00 +0000"
+        msg['Message-ID'] = f"<test-{i}@example.com>"
+        msg.set_content(f"Body of message {i}")
+        if attachment_mb:
+            msg.add_attachment(os.urandom(attachment_mb * 1024 * 1024), maintype="application",
+                               subtype="pdf", filename="report.pdf")
+        return msg.as_bytes()
+
+    original_db = db_manager.DB_NAME
+    db_manager.DB_NAME = os.path.join(tempfile.mkdtemp(), "imap_test.db")
+    server = start_fake_server([make_message(i, attachment_mb=5 if i == 1 else 0) for i in range(1, 26)])
+    try:
+        db_manager.init_db()
+        sync = lambda: sync_account("127.0.0.1", "demo", "demo", port=server.port, use_ssl=False, batch_size=10)
+
+        first = sync()[0]
+        print(f"Initial sync: {first['inserted']} emails, {server.bytes_sent} bytes fetched (mailbox has a 5 MB attachment)")
+
+        server.commands.clear()
+        again = sync()[0]
+        folder_commands = [c for c in server.commands if c not in ("CAPABILITY", "LOGIN", "LOGOUT")]
+        print(f"Unchanged re-sync: {again['inserted']} new, commands {folder_commands}")
+
+        server.add_message(make_message(26))
+        print(f"After one new message: {sync()[0]['inserted']} new")
+
+        server.renumber()
+        print(f"After UIDVALIDITY change: {sync()[0]['inserted']} new (duplicates skipped)")
+
+        ok = (first['inserted'] == 25 and server.bytes_sent < 5 * 1024 * 1024
+              and folder_commands == ["STATUS"])
+        print("IMAP Sync OK" if ok else "IMAP Sync FAILED")
+    finally:
+        server.stop()
+        db_manager.close_connections()
+        db_manager.DB_NAME = original_db
+
+def test_offline_load():
+    # Batch categorization against the offline fake backend: concurrency,
+    # retries on injected 429s / malformed JSON, and the cache on a second pass
+    print("\n 5. Load Test (offline fake backend)")
+    import os
+    import time
+    import tempfile
+    from src.llm_backends import FakeBackend
+    from src.llm_cache import ResponseCache
+    from src.rate_limiter import RateLimiter, CircuitBreaker
+    from src.synthetic import generate_emails
+
+    backend = FakeBackend(latency_ms=50, quota_rate=0.1, malformed_rate=0.1, retry_after=0.05, seed=7)
+    cache = ResponseCache(os.path.join(tempfile.mkdtemp(), "llm_cache.db"))
+    llm = LLMEngine(
+        limiter=RateLimiter(requests_per_min=3000, tokens_per_min=10000000),
+        cache=cache, breaker=CircuitBreaker(), backend=backend
+    )
+    emails = [dict(email, id=i) for i, email in enumerate(generate_emails(300, seed=7), start=1)]
+    cat_prompt = "Classify the email into one of: [Work, Personal, Newsletter, Finance, Spam, Urgent]."
+
+    for run in ("Cold", "Cached"):
+        calls_before = backend.stats["calls"]
+        start = time.perf_counter()
+        results = llm.categorize_batch(emails, cat_prompt)
+        tagged = sum(1 for c in results.values() if c)
+        agree = sum(1 for e in emails if results.get(e['id']) == e['kind'])
+        print(f"{run}: {tagged}/{len(emails)} categorized ({agree} match the generator) in "
+              f"{time.perf_counter() - start:.2f}s with {backend.stats['calls'] - calls_before} backend calls")
+
+    print(f"Injected: {backend.stats['quota_errors']} quota errors, {backend.stats['malformed']} malformed answers")
+    print(f"Limiter/breaker: {llm.metrics()}")
+    print(f"Cache: {cache.stats()}")
+
+def test_rerun_sql():
+    # Runs the app twice with Streamlit's test runner and counts the SQL the
+    # second, write-free rerun issues: every read should come from the cache
+    print("\n 6. Rerun SQL Check")
+    import os
+    import sqlite3
+    import threading
+    from streamlit.testing.v1 import AppTest
+    from src import db_manager
+
+    os.environ["EXTERNAL_WORKER"] = "1"
+    app = AppTest.from_file("app.py", default_timeout=60).run()
+    statements = []
+
+    def trace(sql):
+        if threading.current_thread().name.startswith("ScriptRunner"):
+            statements.append(sql)
+
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(trace)
+        return conn
+
+    sqlite3.connect = traced_connect
+    for conn in list(db_manager._all_connections):
+        conn.set_trace_callback(trace)
+    try:
+        app.run()
+    finally:
+        sqlite3.connect = connect
+        for conn in list(db_manager._all_connections):
+            conn.set_trace_callback(None)
+
+    for sql in statements:
+        print(" ".join(sql.split())[:120])
+    print(f"Statements on a rerun without writes: {len(statements)}")
+    print("Rerun SQL OK" if not statements and not app.exception else "Rerun SQL FAILED")
+
 def main():
     # Main CLI loop
+    init_db()
     while True:
         print("\n=== Agent Test CLI ===")
         print("1. Test API Connection")
         print("2. Test Email Processing")
         print("3. Test Chat Logic")
-        print("4. Exit")
+        print("4. Test IMAP Sync (local server)")
+        print("5. Load Test (offline fake backend)")
+        print("6. Rerun SQL Check")
+        print("7. Exit")
         choice = input("Select option: ")
         
         if choice == '1': test_connection()
         elif choice == '2': test_extraction()
         elif choice == '3': test_chat_rag()
-        elif choice == '4': sys.exit()
+        elif choice == '4': test_imap_sync()
+        elif choice == '5': test_offline_load()
+        elif choice == '6': test_rerun_sql()
+        elif choice == '7': sys.exit()
         else: print("Invalid choice")
 
 if __name__ == "__main__":
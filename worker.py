@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from src.db_manager import (
+    init_db, get_email_by_id, update_email_fields, update_categories_bulk,
+    fetch_untagged_emails, schedule_with_shadow_summary
+)
+from src.job_queue import claim_job, complete_job, fail_job, update_job_progress, queue_stats
+from src.llm_engine import LLMEngine, INSIGHT_FIELDS
+from src.pipeline import process_email_insights, categorize_emails, categorize_one
+from src.reprocess import reprocess_email
+from src.prompt_manager import PromptManager
+from src.prompt_registry import version_id
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+POLL_SECONDS = 1.0
+# longest pause after repeated database errors (e.g. "database is locked")
+MAX_ERROR_BACKOFF = 30.0
+
+
+# Raised by handlers when the LLM gave nothing back, so the job is retried
+class JobFailed(Exception):
+    pass
+
+
+def _require(text, llm):
+    if not text:
+        raise JobFailed(llm.last_error or "Empty LLM response")
+    return text
+
+
+def _email(job):
+    email = get_email_by_id(job['email_id'])
+    if email is None:
+        raise JobFailed(f"Email {job['email_id']} no longer exists")
+    return email
+
+
+# Job handlers: each takes (job, llm) and returns a short result string.
+# Prompts travel in the payload so the job uses the rules shown when it was queued.
+def handle_extract(job, llm):
+    email = _email(job)
+    prompt = job['payload'].get('prompt') or PromptManager.get_extraction_prompt()
+    actions = _require(llm.extract_only(email['body'], email['sender'], email['subject'], prompt), llm)
+    update_email_fields(email['id'], {"action_items": actions}, {"action_items": version_id(prompt)})
+    return "extracted"
+
+
+def handle_draft(job, llm):
+    email = _email(job)
+    prompt = job['payload'].get('prompt') or PromptManager.get_reply_prompt()
+    reply = _require(llm.draft_only(email['body'], email['sender'], email['subject'], prompt), llm)
+    update_email_fields(email['id'], {"draft_reply": reply}, {"draft_reply": version_id(prompt)})
+    return "drafted"
+
+
+def handle_refine(job, llm):
+    email = _email(job)
+    new_draft = _require(llm.refine_reply(email['draft_reply'], job['payload']['feedback']), llm)
+    update_email_fields(email['id'], {"draft_reply": new_draft})
+    return "refined"
+
+
+def handle_schedule(job, llm):
+    email = _email(job)
+    prompt = job['payload'].get('prompt') or PromptManager.get_extraction_prompt()
+    summary = _require(llm.extract_only(email['body'], email['sender'], email['subject'], prompt), llm)
+    schedule_with_shadow_summary(email['id'], summary)
+    return "scheduled"
+
+
+def handle_categorize(job, llm):
+    email = _email(job)
+    prompt = job['payload'].get('prompt') or PromptManager.get_categorization_prompt()
+    category = _require(categorize_one(email, prompt, llm), llm)
+    update_email_fields(email['id'], {"category": category}, {"category": version_id(prompt)})
+    return category
+
+
+def handle_autotag(job, llm):
+    prompt = job['payload'].get('prompt') or PromptManager.get_categorization_prompt()
+    emails = fetch_untagged_emails()
+    last_report = [0.0]
+
+    def on_result(email_id, category, done, total):
+        if time.monotonic() - last_report[0] > 1.0 or done == total:
+            last_report[0] = time.monotonic()
+            update_job_progress(job['id'], job['worker'], f"{done}/{total}")
+
+    tagged = update_categories_bulk(categorize_emails(emails, prompt, llm, on_result), version_id(prompt))
+    if emails and not tagged:
+        raise JobFailed(llm.last_error or "No emails could be tagged")
+    return f"tagged {tagged}/{len(emails)}"
+
+
+def handle_insights(job, llm):
+    email = _email(job)
+    process_email_insights(email['id'], llm, job['payload'].get('prompts'))
+    missing = [f for f in INSIGHT_FIELDS if not (get_email_by_id(email['id'])[f] or "").strip()]
+    if missing:
+        raise JobFailed(llm.last_error or f"Could not produce: {', '.join(missing)}")
+    return "analyzed"
+
+
+# Re-runs the stages a prompt change made stale (see src/reprocess.py)
+def handle_reprocess(job, llm):
+    stale, produced = reprocess_email(_email(job)['id'], llm)
+    missing = [f for f in stale if f not in produced]
+    if missing:
+        raise JobFailed(llm.last_error or f"Could not reprocess: {', '.join(missing)}")
+    return f"reprocessed {', '.join(stale)}" if stale else "up to date"
+
+
+HANDLERS = {
+    "insights": handle_insights,
+    "extract": handle_extract,
+    "draft": handle_draft,
+    "refine": handle_refine,
+    "schedule": handle_schedule,
+    "categorize": handle_categorize,
+    "autotag": handle_autotag,
+    "reprocess": handle_reprocess,
+}
+
+
+# Claims and runs one job. Returns False when the queue had nothing runnable.
+def run_one(worker_id, llm):
+    job = claim_job(worker_id, kinds=list(HANDLERS))
+    if job is None:
+        return False
+    try:
+        result = HANDLERS[job['kind']](job, llm)
+    except Exception as e:
+        status = fail_job(job['id'], worker_id, f"{type(e).__name__}: {e}")
+        if status is None:
+            print(f"[{worker_id}] job {job['id']} ({job['kind']}) failed after its lease expired: {e}")
+        else:
+            print(f"[{worker_id}] job {job['id']} ({job['kind']}) failed -> {status}: {e}")
+    else:
+        if not complete_job(job['id'], worker_id, result):
+            print(f"[{worker_id}] job {job['id']} ({job['kind']}) finished after its lease expired; result dropped")
+    return True
+
+
+# One worker thread: keeps claiming jobs; with drain=True exits once idle.
+# Database errors (a locked database, a full disk) are logged and retried
+# with exponential backoff instead of ending the thread.
+def _worker_loop(worker_id, llm, stop_event, drain):
+    backoff = POLL_SECONDS
+    while not stop_event.is_set():
+        try:
+            ran = run_one(worker_id, llm)
+        except sqlite3.Error as e:
+            print(f"[{worker_id}] database error, retrying in {backoff:.0f}s: {e}")
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+            continue
+        backoff = POLL_SECONDS
+        if not ran:
+            if drain:
+                return
+            stop_event.wait(POLL_SECONDS)
+
+
+# Runs `concurrency` worker threads sharing one LLMEngine (and so one rate
+# limiter). drain=True returns once the queue is empty.
+def run_workers(concurrency=WORKER_CONCURRENCY, drain=False, stop_event=None):
+    init_db()
+    llm = LLMEngine()
+    stop_event = stop_event or threading.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    threads = [
+        threading.Thread(target=_worker_loop, args=(f"{prefix}-{i}", llm, stop_event, drain), daemon=True)
+        for i in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    return threads
+
+
+_background_started = False
+_background_lock = threading.Lock()
+
+
+# Starts worker threads inside the current process once (used by the Streamlit app
+# so queued work runs even when no separate worker process is deployed)
+def start_background_worker(concurrency=2):
+    global _background_started
+    with _background_lock:
+        if not _background_started:
+            run_workers(concurrency)
+            _background_started = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain the email agent job queue.")
+    parser.add_argument("--workers", type=int, default=WORKER_CONCURRENCY, help="concurrent worker threads")
+    parser.add_argument("--drain", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    print(f"Starting {args.workers} workers. Queue: {queue_stats()}")
+    stop_event = threading.Event()
+    threads = run_workers(args.workers, drain=args.drain, stop_event=stop_event)
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(POLL_SECONDS)
+    except KeyboardInterrupt:
+        stop_event.set()
+        sys.exit(0)
+    print(f"Done. Queue: {queue_stats()}")
+
+
+if __name__ == "__main__":
+    main()